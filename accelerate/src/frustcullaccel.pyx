@@ -1,6 +1,8 @@
 """Transformation Matrix implementation in Cython (requires Numpy)"""
 import numpy as np
 cimport numpy as np
+cimport cython
+from libc.math cimport fabs
 
 ctypedef np.float32_t DTYPE_T
 
@@ -36,3 +38,64 @@ def planeCull( np.ndarray[DTYPE_T,ndim=2] planes, np.ndarray[DTYPE_T,ndim=2] poi
             # nothing was found in front, so this plane has entirely excluded the volume...
             return True, planes[planeIndex]
     return False,None 
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def boxCull( planes, boxes, masks, first, double minDistance = 0.0 ):
+    """Test (N,2,3) axis-aligned boxes against (P,4) plane equations
+
+    planes -- (P,4) plane equations, points with a*x+b*y+c*z+d >= 0
+        being in front of (inside) the plane, at most 63 planes
+    boxes -- (N,2,3) (minimum,maximum) corners
+    masks -- (N,) int64 bitmask of the planes to test for each box
+    first -- (N,) index of the plane to test first for each box
+        (e.g. the plane which culled it last time), -1 for none
+    minDistance -- minimum distance behind a plane that a box must
+        be to be excluded
+
+    returns (culled,masks) where culled is the (N,) index of the
+    plane culling each box (-1 if it is not culled) and masks the
+    (N,) bitmask of the tested planes which each box intersects
+    """
+    cdef double[:,:] plane = np.ascontiguousarray( planes, dtype=np.float64 ).reshape( (-1,4) )
+    cdef double[:,:,:] box = np.ascontiguousarray( boxes, dtype=np.float64 ).reshape( (-1,2,3) )
+    cdef long long[:] mask = np.ascontiguousarray( masks, dtype=np.int64 )
+    cdef long long[:] start = np.ascontiguousarray( first, dtype=np.int64 )
+    cdef Py_ssize_t count = box.shape[0], planeCount = plane.shape[0]
+    culledArray = np.full( (count,), -1, dtype=np.int64 )
+    maskArray = np.zeros( (count,), dtype=np.int64 )
+    cdef long long[:] culled = culledArray
+    cdef long long[:] remaining = maskArray
+    cdef Py_ssize_t n,i,p,axis
+    cdef double center,extent,distance,radius
+    cdef long long bit
+    if planeCount > 63:
+        raise ValueError( "At most 63 planes are supported" )
+    with nogil:
+        for n in range(count):
+            for i in range(-1,planeCount):
+                if i < 0:
+                    p = start[n]
+                    if p < 0 or p >= planeCount:
+                        continue
+                else:
+                    p = i
+                    if p == start[n]:
+                        continue
+                bit = (<long long>1) << p
+                if not mask[n] & bit:
+                    continue
+                distance = plane[p,3]
+                radius = 0.0
+                for axis in range(3):
+                    center = (box[n,0,axis] + box[n,1,axis]) * 0.5
+                    extent = (box[n,1,axis] - box[n,0,axis]) * 0.5
+                    distance = distance + center*plane[p,axis]
+                    radius = radius + extent*fabs( plane[p,axis] )
+                if distance + radius < -minDistance:
+                    culled[n] = p
+                    remaining[n] = 0
+                    break
+                if distance - radius < 0.0:
+                    remaining[n] = remaining[n] | bit
+    return culledArray, maskArray
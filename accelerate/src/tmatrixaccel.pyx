@@ -2,6 +2,8 @@
 from __future__ import division
 import numpy as np
 cimport numpy as np
+cimport cython
+from libc.math cimport sin, cos, sqrt, fmod
 
 cdef float VERY_SMALL = 1e-6
 cdef float TWOPI = np.pi * 2.0
@@ -89,3 +91,196 @@ def orthoMatrix( float left=-1.0, float right=1.0, float bottom=-1.0, float top=
         [0,	0,	 -2/((zFar-zNear or VERY_SMALL)),	 tz],
         [0,	0,	0,	1],
     ], dtype=np.float32)
+
+cdef void _quaternionMatrix( double x, double y, double z, double a, double m[3][3] ):
+    """Fill m with the (row-vector) rotation matrix for axis x,y,z angle a"""
+    cdef double length, s, w
+    length = sqrt( x*x + y*y + z*z )
+    if length == 0.0:
+        x,y,z,length = 0.0,1.0,0.0,1.0
+    s = sin( a/2.0 )/length
+    w = cos( a/2.0 )
+    x,y,z = x*s,y*s,z*s
+    m[0][0] = 1-2*(y*y+z*z)
+    m[0][1] = 2*(x*y+w*z)
+    m[0][2] = 2*(x*z-w*y)
+    m[1][0] = 2*(x*y-w*z)
+    m[1][1] = 1-2*(x*x+z*z)
+    m[1][2] = 2*(y*z+w*x)
+    m[2][0] = 2*(x*z+w*y)
+    m[2][1] = 2*(y*z-w*x)
+    m[2][2] = 1-2*(x*x+y*y)
+
+cdef void _scaled( double so[3][3], double sx, double sy, double sz, double out[3][3] ):
+    """Fill out with SO' * S * SO"""
+    cdef int i,j
+    for i in range(3):
+        for j in range(3):
+            out[i][j] = so[0][i]*sx*so[0][j] + so[1][i]*sy*so[1][j] + so[2][i]*sz*so[2][j]
+
+cdef void _product( double a[3][3], double b[3][3], double out[3][3] ):
+    """Fill out with a * b"""
+    cdef int i,j
+    for i in range(3):
+        for j in range(3):
+            out[i][j] = a[i][0]*b[0][j] + a[i][1]*b[1][j] + a[i][2]*b[2][j]
+
+cdef _fill( float[:,:] target, double linear[3][3], double ox, double oy, double oz ):
+    """Fill 4x4 target with linear 3x3 and translation row ox,oy,oz"""
+    cdef int i,j
+    for i in range(3):
+        for j in range(3):
+            target[i,j] = linear[i][j]
+        target[i,3] = 0.0
+    target[3,0] = ox
+    target[3,1] = oy
+    target[3,2] = oz
+    target[3,3] = 1.0
+
+def localMatrices(
+    float tx=0.0, float ty=0.0, float tz=0.0,
+    float cx=0.0, float cy=0.0, float cz=0.0,
+    float rx=0.0, float ry=1.0, float rz=0.0, float ra=0.0,
+    float sx=1.0, float sy=1.0, float sz=1.0,
+    float sox=0.0, float soy=1.0, float soz=0.0, float soa=0.0,
+):
+    """Produce (forward,inverse) VRML Transform matrices in closed form
+
+    Rotations are converted via quaternions to 3x3 matrices, and the
+    linear portion and translation row of each result are calculated
+    directly, so each result is a single allocation.
+    """
+    cdef double R[3][3]
+    cdef double RT[3][3]
+    cdef double SO[3][3]
+    cdef double S[3][3]
+    cdef double SI[3][3]
+    cdef double L[3][3]
+    cdef double LI[3][3]
+    cdef double ox,oy,oz
+    cdef int i,j
+    _quaternionMatrix( sox,soy,soz, soa if fmod( soa, TWOPI ) else 0.0, SO )
+    _scaled( SO, sx,sy,sz, S )
+    _scaled(
+        SO,
+        1.0/(sx if sx else VERY_SMALL),
+        1.0/(sy if sy else VERY_SMALL),
+        1.0/(sz if sz else VERY_SMALL),
+        SI,
+    )
+    _quaternionMatrix( rx,ry,rz, ra if fmod( ra, TWOPI ) else 0.0, R )
+    for i in range(3):
+        for j in range(3):
+            RT[i][j] = R[j][i]
+    _product( S, R, L )
+    _product( RT, SI, LI )
+    ox,oy,oz = cx+tx,cy+ty,cz+tz
+    forward = np.empty( (4,4), dtype=np.float32 )
+    inverse = np.empty( (4,4), dtype=np.float32 )
+    _fill(
+        forward, L,
+        ox - (cx*L[0][0] + cy*L[1][0] + cz*L[2][0]),
+        oy - (cx*L[0][1] + cy*L[1][1] + cz*L[2][1]),
+        oz - (cx*L[0][2] + cy*L[1][2] + cz*L[2][2]),
+    )
+    _fill(
+        inverse, LI,
+        cx - (ox*LI[0][0] + oy*LI[1][0] + oz*LI[2][0]),
+        cy - (ox*LI[0][1] + oy*LI[1][1] + oz*LI[2][1]),
+        cz - (ox*LI[0][2] + oy*LI[1][2] + oz*LI[2][2]),
+    )
+    return forward, inverse
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _identities( double[:,:,:] target ) noexcept nogil:
+    """Set every matrix in target to the identity"""
+    cdef Py_ssize_t n,i,j
+    for n in range(target.shape[0]):
+        for i in range(4):
+            for j in range(4):
+                target[n,i,j] = 1.0 if i == j else 0.0
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rotMatrices( sources ):
+    """Convert (N,4) VRML rotations to (R,R') (N,4,4) double matrix stacks
+
+    Null rotation vectors are treated as rotations about the y axis.
+    """
+    cdef double[:,:] source = np.ascontiguousarray( sources, dtype=np.float64 ).reshape( (-1,4) )
+    cdef Py_ssize_t count = source.shape[0]
+    forward = np.empty( (count,4,4), dtype=np.float64 )
+    inverse = np.empty( (count,4,4), dtype=np.float64 )
+    cdef double[:,:,:] R = forward
+    cdef double[:,:,:] R1 = inverse
+    cdef Py_ssize_t n,i,j
+    cdef double x,y,z,a,c,s,t,h
+    with nogil:
+        _identities( R )
+        _identities( R1 )
+        for n in range(count):
+            x,y,z,a = source[n,0],source[n,1],source[n,2],source[n,3]
+            h = sqrt( x*x + y*y + z*z )
+            if h == 0.0:
+                x,y,z = 0.0,1.0,0.0
+            else:
+                x,y,z = x/h,y/h,z/h
+            c = cos( a )
+            s = sin( a )
+            t = 1-c
+            R[n,0,0] = t*x*x+c
+            R[n,0,1] = t*x*y+s*z
+            R[n,0,2] = t*x*z-s*y
+            R[n,1,0] = t*x*y-s*z
+            R[n,1,1] = t*y*y+c
+            R[n,1,2] = t*y*z+s*x
+            R[n,2,0] = t*x*z+s*y
+            R[n,2,1] = t*y*z-s*x
+            R[n,2,2] = t*z*z+c
+            for i in range(3):
+                for j in range(3):
+                    R1[n,j,i] = R[n,i,j]
+    return forward, inverse
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def scaleMatrices( sources ):
+    """Convert (N,3) VRML scales to (S,S') (N,4,4) double matrix stacks"""
+    cdef double[:,:] source = np.ascontiguousarray( sources, dtype=np.float64 ).reshape( (-1,3) )
+    cdef Py_ssize_t count = source.shape[0]
+    forward = np.empty( (count,4,4), dtype=np.float64 )
+    inverse = np.empty( (count,4,4), dtype=np.float64 )
+    cdef double[:,:,:] S = forward
+    cdef double[:,:,:] S1 = inverse
+    cdef Py_ssize_t n,i
+    cdef double value
+    with nogil:
+        _identities( S )
+        _identities( S1 )
+        for n in range(count):
+            for i in range(3):
+                value = source[n,i]
+                S[n,i,i] = value
+                S1[n,i,i] = 1.0/(value if value != 0.0 else 1e-300)
+    return forward, inverse
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def transMatrices( sources ):
+    """Convert (N,3) VRML translations to (T,T') (N,4,4) double matrix stacks"""
+    cdef double[:,:] source = np.ascontiguousarray( sources, dtype=np.float64 ).reshape( (-1,3) )
+    cdef Py_ssize_t count = source.shape[0]
+    forward = np.empty( (count,4,4), dtype=np.float64 )
+    inverse = np.empty( (count,4,4), dtype=np.float64 )
+    cdef double[:,:,:] T = forward
+    cdef double[:,:,:] T1 = inverse
+    cdef Py_ssize_t n,i
+    with nogil:
+        _identities( T )
+        _identities( T1 )
+        for n in range(count):
+            for i in range(3):
+                T[n,3,i] = source[n,i]
+                T1[n,3,i] = -source[n,i]
+    return forward, inverse
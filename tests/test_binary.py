@@ -0,0 +1,161 @@
+import unittest, os, io, tempfile
+from vrml.vrml97.parser import buildParser
+from vrml.vrml97 import binary
+from vrml.vrml97.scenegraph import SceneGraph
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTED = '''#VRML V2.0 utf8
+PROTO Mover [
+    exposedField SFVec3f position 0,0,0
+    eventIn SFTime go
+] {
+    DEF Body Transform {
+        translation IS position
+        children [
+            DEF Sc Script {
+                eventIn SFTime start IS go
+                field SFNode target USE Body
+                url "javascript:function start(value) {}"
+            }
+        ]
+    }
+}
+DEF Clock TimeSensor { cycleInterval 2.5 }
+DEF M Mover { position 1,2,3 }
+Shape {
+    geometry DEF F IndexedFaceSet {
+        coord Coordinate { point [0 0 0, 1 0 0, 1 1 0] }
+        coordIndex [0,1,2,-1]
+    }
+}
+Shape { geometry USE F }
+ROUTE Clock.cycleTime TO M.go
+'''
+
+
+class TestBinary(unittest.TestCase):
+    def parsed_content(self, source):
+        success, result, parsed = buildParser().parse(source)
+        if not success or parsed < len(source):
+            raise RuntimeError("Did not finish parse")
+        return result[1]
+
+    def round_trip(self, scene):
+        file = io.BytesIO()
+        binary.write(scene, file)
+        file.seek(0)
+        loaded = binary.read(file)
+        assert isinstance(loaded, SceneGraph), loaded
+        return loaded
+
+    def test_fixtures(self):
+        for name in ('proto_is_simple.wrl', 'exampleD.2.wrl'):
+            source = open(os.path.join(HERE, 'fixtures', name)).read()
+            scene = self.parsed_content(source)
+            loaded = self.round_trip(scene)
+            assert loaded.toString() == scene.toString(), name
+
+    def test_structure(self):
+        scene = self.parsed_content(SCRIPTED)
+        loaded = self.round_trip(scene)
+        assert loaded.toString() == scene.toString()
+        first, second = loaded.children[-2:]
+        assert first.geometry is second.geometry
+        assert loaded.getDEF('F') is first.geometry
+        (route,) = loaded.routes
+        assert route.source is loaded.getDEF('Clock')
+        assert route.destination is loaded.getDEF('M')
+        mover = loaded.getDEF('M')
+        body = mover.renderedChildren()[0]
+        assert np.allclose(body.translation, (1, 2, 3)), body.translation
+
+    def test_memory_mapped(self):
+        scene = self.parsed_content(SCRIPTED)
+        handle, filename = tempfile.mkstemp(suffix='.bvrml')
+        os.close(handle)
+        try:
+            # small arrays are stored in the table unless the threshold is 0
+            binary.write(scene, filename, arrayThreshold=0)
+            loaded = binary.read(filename)
+            point = loaded.getDEF('F').coord.point
+            assert point.ctypes.data % binary.ALIGNMENT == 0
+            assert not point.flags.owndata
+            assert np.allclose(point, scene.getDEF('F').coord.point)
+            # copy-on-write, the file is unchanged
+            point[0] = (5, 5, 5)
+            again = binary.read(filename)
+            assert np.allclose(again.getDEF('F').coord.point[0], (0, 0, 0))
+            del loaded, point, again
+        finally:
+            os.remove(filename)
+
+    def test_archive(self):
+        import shutil
+        from vrml.vrml97 import archive
+
+        scene = self.parsed_content(SCRIPTED)
+        expected = scene.getDEF('F').coord.point
+        directory = tempfile.mkdtemp()
+        try:
+            for target in ('scene', 'scene.zip'):
+                path = archive.write(
+                    scene, os.path.join(directory, target), arrayThreshold=0
+                )
+                loaded = archive.read(path, mmapThreshold=0)
+                assert loaded.toString() == scene.toString(), target
+                coord = loaded.getDEF('F').coord
+                assert np.allclose(coord.point, expected)
+                assert not coord.point.flags.writeable
+                assert not coord.point.flags.owndata
+                if target.endswith('.zip'):
+                    assert coord.point.ctypes.data % binary.ALIGNMENT == 0
+                # changes replace the mapped array
+                coord.point = coord.point * 2
+                assert np.allclose(coord.point, expected * 2)
+                again = archive.read(path)
+                assert np.allclose(again.getDEF('F').coord.point, expected)
+                del loaded, coord, again
+            # only large MF arrays get .npy members
+            points = np.arange(3000, dtype='f').reshape((-1, 3))
+            scene.getDEF('F').coord.point = points
+            path = archive.write(scene, os.path.join(directory, 'default'))
+            assert sorted(os.listdir(path)) == ['0.npy', archive.TABLE]
+            loaded = archive.read(path, mmapThreshold=0)
+            assert np.array_equal(loaded.getDEF('F').coord.point, points)
+            assert loaded.getDEF('M').position.tolist() == [1, 2, 3]
+            del loaded
+        finally:
+            shutil.rmtree(directory)
+
+    def test_small_values(self):
+        from vrml.vrml97 import basenodes
+
+        rng = np.random.default_rng(3)
+        scene = SceneGraph()
+        scene.children = [
+            basenodes.Transform(
+                translation=rng.random(3) * 100,
+                rotation=(0, 1, 0, rng.random()),
+                scale=rng.random(3) + 0.5,
+                children=[basenodes.Shape(geometry=basenodes.Box(size=rng.random(3)))],
+            )
+            for index in range(200)
+        ]
+        file = io.BytesIO()
+        binary.write(scene, file)
+        content = scene.toString()
+        # SF values are stored in the (compressed) table, not as payloads
+        assert len(file.getvalue()) < len(content) / 2, len(file.getvalue())
+        file.seek(0)
+        loaded = binary.read(file)
+        assert loaded.toString() == content
+        assert isinstance(loaded.children[0].translation, np.ndarray)
+        # large MF arrays are still payloads, small ones keep their dtype
+        points = np.arange(3000, dtype='f').reshape((-1, 3))
+        writer = binary.Writer()
+        large = writer._value(basenodes.Coordinate.point, points)
+        small = writer._value(basenodes.Coordinate.point, points[:10])
+        assert 'a' in large and small['t'] == '<f4', small
+        assert np.array_equal(binary.Reader()._value('MFVec3f', small), points[:10])
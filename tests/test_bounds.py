@@ -0,0 +1,133 @@
+import unittest
+from vrml.vrml97 import basenodes, bounds, nodepath
+from vrml.vrml97.scenegraph import SceneGraph
+import numpy as np
+
+
+class TestBounds(unittest.TestCase):
+    def assert_bounds(self, value, expected):
+        assert value is not None
+        assert np.allclose(value, expected), (value, expected)
+
+    def test_primitives(self):
+        self.assert_bounds(
+            bounds.localBounds(basenodes.Box(size=(2, 4, 6))),
+            [(-1, -2, -3), (1, 2, 3)],
+        )
+        self.assert_bounds(
+            bounds.localBounds(basenodes.Sphere(radius=2)), [(-2, -2, -2), (2, 2, 2)]
+        )
+        self.assert_bounds(
+            bounds.localBounds(basenodes.Cylinder(side=0, bottom=0)),
+            [(-1, 1, -1), (1, 1, 1)],
+        )
+        cone = basenodes.Cone(side=0, bottom=0)
+        assert bounds.localBounds(cone) is None
+        cone.bottom = 1
+        self.assert_bounds(bounds.localBounds(cone), [(-1, -1, -1), (1, -1, 1)])
+
+    def test_indexed(self):
+        coord = basenodes.Coordinate(point=[(0, 0, 0), (1, 2, 3), (9, 9, 9)])
+        faceSet = basenodes.IndexedFaceSet(coord=coord, coordIndex=[0, 1, 0, -1])
+        self.assert_bounds(bounds.localBounds(faceSet), [(0, 0, 0), (1, 2, 3)])
+        coord.point = [(0, 0, 0), (-1, 2, 3), (9, 9, 9)]
+        self.assert_bounds(bounds.localBounds(faceSet), [(-1, 0, 0), (0, 2, 3)])
+        assert bounds.localBounds(basenodes.IndexedFaceSet()) is None
+
+    def test_elevation_grid(self):
+        grid = basenodes.ElevationGrid(
+            xDimension=3,
+            zDimension=2,
+            xSpacing=0.5,
+            zSpacing=2,
+            height=[0, 1, 2, -1, 0, 5],
+        )
+        self.assert_bounds(bounds.localBounds(grid), [(0, -1, 0), (1, 5, 2)])
+
+    def test_extrusion(self):
+        # default extrusion is a unit square extruded from y=0 to y=1
+        extrusion = basenodes.Extrusion()
+        self.assert_bounds(bounds.localBounds(extrusion), [(-1, 0, -1), (1, 1, 1)])
+        # spine along +X, the SCP Y axis is the spine direction
+        extrusion.spine = [(0, 0, 0), (3, 0, 0)]
+        extrusion.scale = [(0.5, 0.5)]
+        self.assert_bounds(
+            bounds.localBounds(extrusion), [(0, -0.5, -0.5), (3, 0.5, 0.5)]
+        )
+        # a circular (closed) spine
+        angles = np.linspace(0, 2 * np.pi, 9)
+        spine = np.column_stack((np.cos(angles), np.zeros(9), np.sin(angles)))
+        spine[-1] = spine[0]
+        extrusion.spine = spine
+        extrusion.crossSection = [(0.1, 0), (0, 0.1), (-0.1, 0), (0, -0.1)]
+        extrusion.scale = [(1, 1)]
+        points = bounds.extrusionPoints(extrusion)
+        # cross-sections are perpendicular to the spine
+        frames = bounds.spineFrames(spine)
+        assert np.allclose(np.einsum('sij,skj->sik', frames, frames), np.eye(3))
+        distances = np.linalg.norm(points - spine[:, np.newaxis], axis=-1)
+        assert np.allclose(distances, 0.1)
+
+    def test_transforms(self):
+        shape = basenodes.Shape(geometry=basenodes.Box(size=(2, 2, 2)))
+        inner = basenodes.Transform(
+            translation=(5, 0, 0), rotation=(0, 0, 1, np.pi / 4), children=[shape]
+        )
+        outer = basenodes.Transform(scale=(2, 2, 2), children=[inner])
+        group = basenodes.Group(children=[outer, basenodes.PointLight()])
+        half = np.sqrt(2)
+        self.assert_bounds(bounds.localBounds(inner), [(-1, -1, -1), (1, 1, 1)])
+        self.assert_bounds(
+            bounds.localBounds(group),
+            [(2 * (5 - half), -2 * half, -2), (2 * (5 + half), 2 * half, 2)],
+        )
+        path = nodepath.NodePath([group, outer, inner])
+        self.assert_bounds(bounds.worldBounds(path), bounds.localBounds(group))
+        # changes invalidate the bounds of every ancestor
+        inner.translation = (0, 0, 0)
+        self.assert_bounds(
+            bounds.localBounds(group),
+            [(-2 * half, -2 * half, -2), (2 * half, 2 * half, 2)],
+        )
+        shape.geometry.size = (4, 4, 4)
+        self.assert_bounds(
+            bounds.localBounds(group),
+            [(-4 * half, -4 * half, -4), (4 * half, 4 * half, 4)],
+        )
+        outer.children = []
+        assert bounds.localBounds(group) is None
+
+    def test_billboard(self):
+        # off-centre on two axes, the farthest corner is (-1, 1, 0)
+        coord = basenodes.Coordinate(point=[(-1, 0, 0), (0, 1, 0)])
+        billboard = basenodes.Billboard(
+            children=[
+                basenodes.Shape(
+                    geometry=basenodes.IndexedLineSet(coord=coord, coordIndex=[0, 1])
+                )
+            ]
+        )
+        radius = np.sqrt(2)
+        self.assert_bounds(
+            bounds.localBounds(billboard), [(-radius,) * 3, (radius,) * 3]
+        )
+
+    def test_switch_scene(self):
+        switch = basenodes.Switch(
+            choice=[
+                basenodes.Shape(geometry=basenodes.Sphere(radius=1)),
+                basenodes.Shape(geometry=basenodes.Sphere(radius=3)),
+            ]
+        )
+        assert bounds.localBounds(switch) is None
+        switch.whichChoice = 1
+        self.assert_bounds(bounds.localBounds(switch), [(-3, -3, -3), (3, 3, 3)])
+        scene = SceneGraph()
+        scene.children = [
+            switch,
+            basenodes.Transform(
+                translation=(10, 0, 0),
+                children=[basenodes.Shape(geometry=basenodes.Box())],
+            ),
+        ]
+        self.assert_bounds(bounds.sceneBounds(scene), [(-3, -3, -3), (11, 3, 3)])
@@ -0,0 +1,102 @@
+import unittest
+from vrml.vrml97 import basenodes, bvh
+from vrml.vrml97.scenegraph import SceneGraph
+import numpy as np
+
+
+def random_boxes(count, seed=1):
+    rng = np.random.default_rng(seed)
+    centers = rng.random((count, 3)) * 100
+    extents = rng.random((count, 3))
+    return np.stack([centers - extents, centers + extents], axis=1)
+
+
+def brute_overlapping(boxes, box):
+    return np.flatnonzero(
+        np.all(boxes[:, 0] <= box[1], axis=1) & np.all(boxes[:, 1] >= box[0], axis=1)
+    )
+
+
+class TestBVH(unittest.TestCase):
+    def check_tree(self, tree):
+        # every node encloses its items
+        leaves = tree.bounds[tree.itemLeaves]
+        assert np.all(leaves[:, 0] <= tree.boxes[:, 0])
+        assert np.all(leaves[:, 1] >= tree.boxes[:, 1])
+        parents = tree.parents[1:]
+        assert np.all(tree.bounds[parents, 0] <= tree.bounds[1:, 0])
+        assert np.all(tree.bounds[parents, 1] >= tree.bounds[1:, 1])
+        assert np.array_equal(np.sort(tree.order), np.arange(len(tree)))
+        assert np.all(tree.counts[tree.leaves] <= tree.leafSize)
+
+    def test_queries(self):
+        boxes = random_boxes(2000)
+        query = np.array([(10, 10, 10), (30, 40, 50)], 'd')
+        for method in ('sah', 'median'):
+            tree = bvh.BVH(boxes, method=method)
+            self.check_tree(tree)
+            assert np.array_equal(
+                tree.overlapping(query), brute_overlapping(boxes, query)
+            ), method
+            near = tree.near((50, 50, 50), 5)
+            offset = np.maximum(boxes[:, 0] - 50, 0) + np.maximum(50 - boxes[:, 1], 0)
+            expected = np.flatnonzero(np.sum(offset * offset, axis=1) <= 25)
+            assert np.array_equal(near, expected), method
+
+    def test_degenerate(self):
+        empty = bvh.BVH(np.zeros((0, 2, 3)))
+        assert len(empty.overlapping([(0, 0, 0), (1, 1, 1)])) == 0
+        # coincident boxes still split down to leafSize
+        tree = bvh.BVH(np.zeros((50, 2, 3)))
+        self.check_tree(tree)
+        assert len(tree.overlapping([(0, 0, 0), (0, 0, 0)])) == 50
+
+    def test_refit(self):
+        boxes = random_boxes(500)
+        tree = bvh.BVH(boxes)
+        moved = np.array([3, 17, 400])
+        tree.boxes[moved] += 200
+        tree.refit(moved)
+        self.check_tree(tree)
+        query = np.array([(190, 190, 190), (400, 400, 400)], 'd')
+        assert np.array_equal(tree.overlapping(query), moved)
+
+
+class TestSceneBVH(unittest.TestCase):
+    def setUp(self):
+        self.transforms = [
+            basenodes.Transform(
+                translation=(index * 10, 0, 0),
+                children=[basenodes.Shape(geometry=basenodes.Box())],
+            )
+            for index in range(20)
+        ]
+        self.light = basenodes.PointLight()
+        self.scene = SceneGraph()
+        self.scene.children = [
+            basenodes.Group(children=self.transforms[:10]),
+            basenodes.Transform(scale=(1, 2, 1), children=self.transforms[10:]),
+            self.light,
+        ]
+        self.bvh = bvh.SceneBVH(self.scene)
+
+    def test_leaves(self):
+        assert len(self.bvh) == 20
+        found = self.bvh.overlapping([(29, 0, 0), (31, 0, 0)])
+        assert list(found) == [3], found
+        path = self.bvh.path(found[0])
+        assert path[-1] is self.transforms[3].children[0]
+        assert np.allclose(self.bvh.world[15], [(149, -2, -1), (151, 2, 1)])
+
+    def test_update(self):
+        assert len(self.bvh.update()) == 0
+        self.transforms[3].translation = (0, 100, 0)
+        self.transforms[12].children[0].geometry.size = (10, 10, 10)
+        changed = self.bvh.update()
+        assert list(changed) == [3, 12], changed
+        assert list(self.bvh.overlapping([(-1, 99, -1), (1, 101, 1)])) == [3]
+        assert list(self.bvh.overlapping([(116, 0, 0), (117, 0, 0)])) == [12]
+        assert list(self.bvh.near((30, 0, 0), 2)) == []
+        self.scene.children[0].children = self.transforms[:5]
+        self.bvh.update()
+        assert len(self.bvh) == 15
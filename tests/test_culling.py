@@ -0,0 +1,100 @@
+import unittest
+from vrml import arrays
+from vrml.vrml97 import basenodes, bvh, culling, transformmatrix
+from vrml.vrml97.scenegraph import SceneGraph
+import numpy as np
+
+# axis-aligned frustum (box) from -10 to 10 on each axis
+PLANES = np.array(
+    [
+        (1, 0, 0, 10),
+        (-1, 0, 0, 10),
+        (0, 1, 0, 10),
+        (0, -1, 0, 10),
+        (0, 0, 1, 10),
+        (0, 0, -1, 10),
+    ],
+    'd',
+)
+
+
+def random_boxes(count, seed=2):
+    rng = np.random.default_rng(seed)
+    centers = rng.random((count, 3)) * 60 - 30
+    extents = rng.random((count, 3))
+    return np.stack([centers - extents, centers + extents], axis=1)
+
+
+def brute_visible(boxes, planes):
+    center = (boxes[:, 0] + boxes[:, 1]) * 0.5
+    extent = (boxes[:, 1] - boxes[:, 0]) * 0.5
+    distance = center @ planes[:, :3].T + planes[:, 3]
+    radius = extent @ np.abs(planes[:, :3]).T
+    return ~np.any(distance + radius < 0, axis=1)
+
+
+class TestCulling(unittest.TestCase):
+    def _box_cull(self, boxCull):
+        boxes = random_boxes(1000)
+        count = len(boxes)
+        culled, masks = boxCull(
+            PLANES, boxes, np.full(count, 63, 'int64'), np.full(count, -1, 'int64')
+        )
+        assert np.array_equal(culled < 0, brute_visible(boxes, PLANES))
+        # boxes entirely inside intersect no planes
+        inside = np.all(boxes[:, 0] >= -10, axis=1) & np.all(boxes[:, 1] <= 10, axis=1)
+        assert np.array_equal(masks == 0, inside | (culled >= 0))
+        # untested planes do not cull
+        culled, masks = boxCull(
+            PLANES, boxes, np.zeros(count, 'int64'), np.full(count, -1, 'int64')
+        )
+        assert np.all(culled < 0) and np.all(masks == 0)
+        # the first plane takes precedence
+        corner = np.array([[(20, 20, 20), (21, 21, 21)]], 'd')
+        for first in (-1, 1, 3):
+            culled, masks = boxCull(
+                PLANES, corner, np.array([63], 'int64'), np.array([first], 'int64')
+            )
+            assert culled[0] == max(first, 1), (first, culled)
+
+    def test_box_cull(self):
+        self._box_cull(culling._boxCull)
+
+    if getattr(arrays.frustcullaccel, 'boxCull', None) is not None:
+
+        def test_box_cull_accel(self):
+            self._box_cull(arrays.frustcullaccel.boxCull)
+
+    def test_hierarchical(self):
+        boxes = random_boxes(5000)
+        culler = culling.FrustumCuller(bvh.BVH(boxes))
+        expected = brute_visible(boxes, PLANES)
+        for repeat in range(2):
+            assert np.array_equal(culler.cull(PLANES), expected)
+        assert np.any(culler.nodePlanes >= 0)
+        shifted = PLANES.copy()
+        shifted[:, 3] += shifted[:, :3] @ (15, 0, 0)
+        assert np.array_equal(culler.cull(shifted), brute_visible(boxes, shifted))
+
+    def test_frustum_planes(self):
+        projection = transformmatrix.perspectiveMatrix(np.pi / 2, 1.0, 1.0, 100.0)
+        planes = culling.frustumPlanes(projection)
+        inside = np.array([(0, 0, -5, 1), (4, -4, -5, 1), (0, 0, -99, 1)], 'd')
+        outside = np.array([(0, 0, 5, 1), (6, 0, -5, 1), (0, 0, -101, 1)], 'd')
+        assert np.all(inside @ planes.T >= 0)
+        assert np.all(np.any(outside @ planes.T < 0, axis=1))
+
+    def test_scene(self):
+        shapes = [basenodes.Shape(geometry=basenodes.Sphere()) for index in range(10)]
+        scene = SceneGraph()
+        scene.children = [
+            basenodes.Transform(translation=(index * 5, 0, 0), children=[shape])
+            for index, shape in enumerate(shapes)
+        ]
+        culler = culling.SceneCuller(scene)
+        visible = culler.visible(PLANES)
+        assert [path[-1] for path in visible] == shapes[:3], visible
+        scene.children[9].translation = (0, 0, 0)
+        assert np.array_equal(np.flatnonzero(culler.cull(PLANES)), [0, 1, 2, 9])
+        paths = culling.frustumCull(PLANES, scene)
+        assert [path[-1] for path in paths] == shapes[:3] + shapes[9:]
@@ -18,3 +18,37 @@ class TestFieldTypes( unittest.TestCase ):
             result = field.coerce(value),value 
             
         
+    def test_mf_vrmlstr(self):
+        """Bulk number formatting matches per-element str() by default"""
+        from vrml.vrml97 import linearise
+        values = array([[1.5,-0.1,1e7],[2,3,4],[1e-5,0,12345678]]*40,'f')
+        field = fieldtypes.MFVec3f(name="moo")
+        expected = ('[%s]'%('\n'.join([
+            ', '.join([
+                ','.join([str(x) for x in vector])
+                for vector in values[i:i+33]
+            ])
+            for i in range(0,len(values),33)
+        ])))
+        assert field.vrmlstr(values) == expected, field.vrmlstr(values)[:200]
+        assert fieldtypes.MFInt32(name='moo').vrmlstr([1,2,3]) == '[ 1,2,3 ]'
+        shortest = field.vrmlstr(values,linearise.Lineariser(precision='shortest'))
+        assert shortest.startswith('[1.5,-0.1,1e+07, 2,3,4, 1e-05,0,12345678, 1.5'), shortest[:60]
+        parsed = array(shortest.strip('[]').replace(',',' ').split(),'f')
+        assert (parsed == values.ravel()).all()
+        short = field.vrmlstr(values,linearise.Lineariser(precision=3))
+        assert short.startswith('[1.5,-0.1,1e+07, 2,3,4, 1e-05,0,1.23e+07, '), short[:60]
+
+    def test_float32_text(self):
+        """float32 text is assembled without str() but matches it"""
+        import numpy
+        from vrml import numberformat
+        bits = numpy.random.default_rng(3).integers(0,2**32,50000,dtype='u8')
+        special = array([
+            0,-0.0,1e-4,0.00010000001,1e6,999999.94,1e-5,1.5,-0.1,
+            3.4028235e38,1.1754944e-38,1e-45,numpy.inf,-numpy.inf,numpy.nan,
+        ],'f')
+        powers = numpy.ldexp(numpy.float32(1),numpy.arange(-126,128)).astype('f')
+        for values in (bits.astype('u4').view('f'),special,powers,-powers):
+            expected = [str(x) for x in values]
+            assert numberformat.formatArray(values) == expected
@@ -0,0 +1,66 @@
+import unittest
+from vrml.vrml97 import basenodes, hashing
+from vrml.vrml97.parser import buildParser
+import numpy as np
+
+
+def shape(points, color=(1, 0, 0)):
+    return basenodes.Shape(
+        geometry=basenodes.IndexedFaceSet(
+            coord=basenodes.Coordinate(point=points),
+            coordIndex=[0, 1, 2, -1],
+        ),
+        appearance=basenodes.Appearance(
+            material=basenodes.Material(diffuseColor=color),
+        ),
+    )
+
+
+POINTS = [(0, 0, 0), (1, 0, 0), (1, 1, 0)]
+
+
+class TestHashing(unittest.TestCase):
+    def test_equivalent(self):
+        first = basenodes.Transform(DEF='First', children=[shape(POINTS)])
+        second = basenodes.Transform(children=[shape(POINTS)])
+        assert hashing.structuralHash(first) == hashing.structuralHash(second)
+        assert hashing.equivalent(first, second)
+        assert not hashing.equivalent(first, shape(POINTS))
+        other = basenodes.Transform(children=[shape(POINTS, color=(0, 1, 0))])
+        assert not hashing.equivalent(first, other)
+        # explicitly set default values hash as the default
+        assert hashing.equivalent(
+            basenodes.Transform(), basenodes.Transform(translation=(0, 0, 0))
+        )
+
+    def test_invalidation(self):
+        child = shape(POINTS)
+        parent = basenodes.Transform(children=[basenodes.Group(children=[child])])
+        original = hashing.structuralHash(parent)
+        coord = child.geometry.coord
+        coord.point = [(0, 0, 0), (2, 0, 0), (1, 1, 0)]
+        changed = hashing.structuralHash(parent)
+        assert changed != original
+        coord.point = POINTS
+        assert hashing.structuralHash(parent) == original
+
+    def test_arrays(self):
+        data = np.arange(12, dtype='f')
+        assert hashing.arrayHash(data) == hashing.arrayHash(data.copy())
+        assert hashing.arrayHash(data) != hashing.arrayHash(data.astype('d'))
+        assert hashing.arrayHash(data) != hashing.arrayHash(data.reshape((4, 3)))
+
+    def test_cycle(self):
+        source = '''#VRML V2.0 utf8
+DEF Body Transform {
+    children [
+        DEF Sc Script {
+            field SFNode target USE Body
+        }
+    ]
+}
+'''
+        success, result, parsed = buildParser().parse(source)
+        scene = result[1]
+        first = hashing.structuralHash(scene)
+        assert first == hashing.structuralHash(scene)
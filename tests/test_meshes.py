@@ -0,0 +1,205 @@
+import unittest
+from vrml.vrml97 import basenodes, meshes
+import numpy as np
+
+POINTS = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (2, 2, 0)]
+
+
+def faceSet(**named):
+    named.setdefault('coord', basenodes.Coordinate(point=POINTS))
+    named.setdefault('coordIndex', [0, 1, 2, 3, -1, 1, 4, 2])
+    return basenodes.IndexedFaceSet(**named)
+
+
+def areas(triangles):
+    triangles = np.asarray(triangles, 'd').reshape((-1, 3, 3))
+    edges = np.cross(
+        triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    )
+    return edges[:, 2] / 2.0
+
+
+def area(triangles):
+    return areas(triangles).sum()
+
+
+class TestTriangleMesh(unittest.TestCase):
+    def test_fan(self):
+        mesh = meshes.triangleMesh(faceSet())
+        assert len(mesh) == 3
+        assert mesh.faces.tolist() == [0, 0, 1]
+        assert np.allclose(
+            mesh.vertices[:6], [POINTS[i] for i in (0, 1, 2, 0, 2, 3)]
+        )
+        assert np.allclose(area(mesh.vertices), 1.5)
+        assert mesh.colors is None and mesh.texCoords is None
+        # normal is NULL, so normals are generated
+        assert np.allclose(mesh.normals, (0, 0, 1))
+
+    def test_attributes(self):
+        colors = [(1, 0, 0), (0, 1, 0), (0, 0, 1)]
+        mesh = meshes.triangleMesh(
+            faceSet(
+                color=basenodes.Color(color=colors),
+                colorPerVertex=0,
+                colorIndex=[2, 0],
+                texCoord=basenodes.TextureCoordinate(point=[(0, 0), (1, 1)]),
+                texCoordIndex=[0, 1, 1, 0, -1, 1, 1, 1],
+            )
+        )
+        assert np.allclose(mesh.colors[:6], colors[2])
+        assert np.allclose(mesh.colors[6:], colors[0])
+        assert np.allclose(mesh.texCoords[:3], [(0, 0), (1, 1), (1, 1)])
+
+    def test_indexed(self):
+        node = faceSet(
+            color=basenodes.Color(color=[(1, 0, 0), (0, 1, 0)]), colorPerVertex=0
+        )
+        flat = meshes.triangleMesh(node)
+        indexed = meshes.triangleMesh(node, indexed=True)
+        # the two polygons share vertices 1 and 2, but not colours
+        assert len(indexed.vertices) == 7, indexed.vertices
+        assert np.allclose(indexed.vertices[indexed.indices.ravel()], flat.vertices)
+        assert np.allclose(indexed.colors[indexed.indices.ravel()], flat.colors)
+
+    def test_concave(self):
+        points = [(0, 0, 0), (2, 0, 0), (2, 2, 0), (1, 0.5, 0), (0, 2, 0)]
+        node = faceSet(
+            coord=basenodes.Coordinate(point=points),
+            coordIndex=[0, 1, 2, 3, 4, -1],
+            convex=0,
+        )
+        mesh = meshes.triangleMesh(node)
+        assert len(mesh) == 3
+        # fan triangulation would produce an inverted triangle
+        assert (areas(mesh.vertices) > 0).all(), areas(mesh.vertices)
+        assert np.allclose(area(mesh.vertices), 2.5)
+        node.ccw = 0
+        assert np.allclose(area(meshes.triangleMesh(node).vertices), -2.5)
+
+    def test_concave_floor(self):
+        # an L-shaped floor (area 3) facing +Y, the notch is not covered
+        points = [(0, 0, 0), (0, 0, 2), (2, 0, 2), (2, 0, 1), (1, 0, 1), (1, 0, 0)]
+        node = faceSet(
+            coord=basenodes.Coordinate(point=points),
+            coordIndex=[0, 1, 2, 3, 4, 5, -1],
+            convex=0,
+        )
+        mesh = meshes.triangleMesh(node)
+        assert len(mesh) == 4
+        triangles = mesh.vertices.reshape((-1, 3, 3))
+        normals = np.cross(
+            triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+        )
+        assert (normals[:, 1] > 0).all(), normals
+        assert np.allclose(normals[:, 1].sum() / 2, 3)
+        centres = triangles.mean(axis=1)
+        assert not ((centres[:, 0] > 1) & (centres[:, 2] < 1)).any()
+
+    def test_cache(self):
+        node = faceSet()
+        mesh = meshes.triangleMesh(node)
+        assert meshes.triangleMesh(node) is mesh
+        node.coord.point = np.array(POINTS) * 2
+        changed = meshes.triangleMesh(node)
+        assert changed is not mesh
+        assert np.allclose(area(changed.vertices), 6.0)
+        node.coord = basenodes.Coordinate(point=POINTS)
+        assert np.allclose(area(meshes.triangleMesh(node).vertices), 1.5)
+        node.coord.point = np.array(POINTS) * 3
+        assert np.allclose(area(meshes.triangleMesh(node).vertices), 13.5)
+
+
+CUBE_POINTS = [
+    (x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)
+]
+CUBE_INDEX = [
+    0, 1, 3, 2, -1,
+    4, 6, 7, 5, -1,
+    0, 4, 5, 1, -1,
+    2, 3, 7, 6, -1,
+    0, 2, 6, 4, -1,
+    1, 5, 7, 3, -1,
+]
+
+
+class TestNormals(unittest.TestCase):
+    def cube(self, **named):
+        return basenodes.IndexedFaceSet(
+            coord=basenodes.Coordinate(point=CUBE_POINTS),
+            coordIndex=CUBE_INDEX,
+            **named
+        )
+
+    def test_flat(self):
+        cube = self.cube(creaseAngle=0.5)
+        normals, indices = meshes.generatedNormals(cube)
+        assert len(normals) == 6
+        mesh = meshes.triangleMesh(cube)
+        # outward facing, perpendicular to each triangle
+        centres = mesh.vertices.reshape((-1, 3, 3)).mean(axis=1)
+        first = mesh.normals.reshape((-1, 3, 3))[:, 0]
+        assert np.allclose(np.abs(first).sum(axis=1), 1)
+        assert (np.sum(first * centres, axis=1) > 0).all()
+
+    def test_smooth(self):
+        cube = self.cube(creaseAngle=np.pi)
+        normals, indices = meshes.generatedNormals(cube)
+        assert len(normals) == 8
+        assert np.allclose(np.abs(normals), 1 / np.sqrt(3))
+        corners = normals[indices]
+        cube.ccw = 0
+        normals, indices = meshes.generatedNormals(cube)
+        assert np.allclose(normals[indices], -corners)
+
+    def test_crease(self):
+        # two quads folded by 10 degrees along x == 1, and a third at 90
+        angle = np.radians(10)
+        points = [
+            (0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0),
+            (1 + np.cos(angle), 0, np.sin(angle)),
+            (1 + np.cos(angle), 1, np.sin(angle)),
+            (1, 0, -1), (1, 1, -1),
+        ]
+        index = [0, 1, 2, 3, -1, 1, 4, 5, 2, -1, 1, 2, 7, 6, -1]
+        node = basenodes.IndexedFaceSet(
+            coord=basenodes.Coordinate(point=points),
+            coordIndex=index,
+            creaseAngle=0.5,
+        )
+        normals, indices = meshes.generatedNormals(node)
+        corners = normals[indices]
+        # corner 1 (first quad) and corner 4 (second quad) share vertex 1
+        assert np.allclose(corners[1], corners[4])
+        assert not np.allclose(corners[1], corners[0])
+        # the third quad is beyond the crease angle
+        assert np.allclose(np.abs(corners[8]), (1, 0, 0))
+        node.creaseAngle = 0
+        normals, indices = meshes.generatedNormals(node)
+        assert np.allclose(normals[indices][1], (0, 0, 1))
+
+    def test_high_valence(self):
+        # a cone of 100000 triangles meeting at its apex, opposite
+        # triangles are 90 degrees apart but each is within the crease
+        # angle of its neighbours, so the apex is smoothed as one
+        count = 100000
+        angles = np.linspace(0, 2 * np.pi, count, endpoint=False)
+        points = np.column_stack((np.cos(angles), np.zeros(count), np.sin(angles)))
+        points = np.concatenate(([(0, 1, 0)], points))
+        rim = np.arange(1, count + 1)
+        index = np.column_stack(
+            (np.zeros(count, 'i'), np.roll(rim, -1), rim, -np.ones(count, 'i'))
+        )
+        polygons = meshes.Polygons(index.ravel())
+        normals, indices = meshes.computeNormals(points, polygons, 0.5)
+        corners = normals[indices]
+        apex = corners[polygons.values == 0]
+        assert np.allclose(apex, (0, 1, 0), atol=1e-5)
+        # the rim vertices are each shared by two smoothed triangles
+        assert len(np.unique(indices)) == count + 1
+        # half the cone is smoothed towards +Z
+        polygons = meshes.Polygons(index[: count // 2].ravel())
+        normals, indices = meshes.computeNormals(points, polygons, 0.5)
+        apex = normals[indices][polygons.values == 0]
+        assert np.allclose(apex, apex[0])
+        assert apex[0][2] > 0.4
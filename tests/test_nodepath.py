@@ -78,3 +78,53 @@ class TestNodePath( unittest.TestCase ):
         matrix = path.transformMatrix()
         projected = dot( array([ 0,0,1,1],'f'),matrix )
         assert allclose( projected, array([1,0,0,1],'f'),atol=.0001), projected
+
+    def test_world_matrices( self ):
+        from vrml.vrml97.scenegraph import SceneGraph
+        from vrml.vrml97.basenodes import Group
+        leaf = Transform( center=(1,2,3), scale=(2,1,.5), scaleOrientation=(1,1,0,.3), rotation=(0,1,1,.7) )
+        outer = Transform( translation=(3,0,0), rotation=(1,0,0,pi/3), children=[
+            Group( children=[ leaf ] ),
+        ])
+        sg = SceneGraph( children=[ outer, Transform( translation=(0,1,0) ) ] )
+        paths, forward, inverse = nodepath.worldMatrices( sg )
+        assert [path[-1] for path in paths] == [outer, leaf, sg.children[1]], paths
+        for path, matrix, imatrix in zip( paths, forward, inverse ):
+            assert allclose( matrix, path.transformMatrix(), atol=.0001 ), (matrix, path)
+            assert allclose( imatrix, path.transformMatrix( inverse=True ), atol=.0001 ), (imatrix, path)
+
+    def test_transform_hierarchy( self ):
+        from vrml.vrml97.scenegraph import SceneGraph
+        inner = Transform( scale=(2,2,2) )
+        middle = Transform( rotation=(0,1,0,1), children=[ inner ] )
+        other = Transform( translation=(0,0,5) )
+        sg = SceneGraph( children=[ Transform( translation=(1,0,0), children=[ middle ] ), other ] )
+        hierarchy = nodepath.TransformHierarchy( sg )
+        hierarchy.update()
+        middle.translation = (0,3,0)
+        assert list( hierarchy.dirty ) == [False,True,True,False], hierarchy.dirty
+        matrix = hierarchy.transformMatrix( inner )
+        assert not hierarchy.dirty.any(), hierarchy.dirty
+        paths, forward, inverse = nodepath.worldMatrices( sg )
+        assert allclose( matrix, forward[2] ), (matrix, forward[2])
+        inner.children = [ Transform( translation=(1,1,1) ) ]
+        paths, forward, inverse = hierarchy.update()
+        assert len( paths ) == 5, paths
+        assert allclose( inverse, nodepath.worldMatrices( sg )[2] )
+
+    def test_transform_arrays( self ):
+        points = array( [[0,0,10],[1,2,3],[-4,0,1]], 'f' )
+        matrix = self.fourth_child.transformMatrix()
+        homogeneous = array( [list(point)+[1] for point in points], 'f' )
+        expected = dot( homogeneous, matrix )[:,:3]
+        result = self.fourth_child.transformPoints( points )
+        assert allclose( result, expected, atol=.0001 ), (result, expected)
+        back = self.fourth_child.transformPoints( result, inverse=True, out=result )
+        assert back is result
+        assert allclose( back, points, atol=.0001 ), back
+        # normal of the x=z plane must stay perpendicular to transformed in-plane vectors
+        normals = self.fourth_child.transformNormals( array( [[1,0,-1]], 'f' ) )
+        inplane = self.fourth_child.transformPoints( array( [[1,0,1],[0,0,0]], 'f' ) )
+        assert allclose( dot( inplane[0]-inplane[1], normals[0] ), 0, atol=.0001 ), normals
+        bounds = self.fourth_child.transformBounds( array( [[0,0,0],[1,1,10]], 'f' ) )
+        assert allclose( bounds, [[5,0,-2],[25,1,0]], atol=.0001 ), bounds
@@ -0,0 +1,154 @@
+import unittest
+from vrml.vrml97 import basenodes, nurbs, nurbseval, picking
+from vrml.vrml97.scenegraph import SceneGraph
+import numpy as np
+
+
+def cox_de_boor(knots, i, degree, u):
+    """Reference (recursive) value of basis function i at u"""
+    if degree == 0:
+        return 1.0 if knots[i] <= u < knots[i + 1] else 0.0
+    value = 0.0
+    if knots[i + degree] > knots[i]:
+        value += (
+            (u - knots[i])
+            / (knots[i + degree] - knots[i])
+            * cox_de_boor(knots, i, degree - 1, u)
+        )
+    if knots[i + degree + 1] > knots[i + 1]:
+        value += (
+            (knots[i + degree + 1] - u)
+            / (knots[i + degree + 1] - knots[i + 1])
+            * cox_de_boor(knots, i + 1, degree - 1, u)
+        )
+    return value
+
+
+def patch(**named):
+    """A 4x5 cubic by quadratic surface over the unit square"""
+    rng = np.random.default_rng(2)
+    u, v = np.meshgrid(np.linspace(0, 1, 4), np.linspace(0, 1, 5))
+    points = np.column_stack((u.ravel(), rng.random(20) * 0.2, -v.ravel()))
+    return nurbs.NurbsSurface(
+        uDimension=4,
+        vDimension=5,
+        uOrder=4,
+        vOrder=3,
+        controlPoint=points,
+        **named
+    )
+
+
+class TestNurbsEval(unittest.TestCase):
+    def test_basis(self):
+        knots = np.array([0, 0, 0, 1, 2, 2, 3, 3, 3], 'd')
+        u = np.linspace(0, 2.999, 50)
+        spans, basis = nurbseval.basisFunctions(knots, 2, 6, u)
+        assert np.allclose(basis.sum(axis=1), 1)
+        for value, span, row in zip(u, spans, basis):
+            expected = [
+                cox_de_boor(knots, index, 2, value)
+                for index in range(span - 2, span + 1)
+            ]
+            assert np.allclose(row, expected), (value, row, expected)
+        # the end of the domain is in the last span
+        spans, basis = nurbseval.basisFunctions(knots, 2, 6, [3.0])
+        assert spans[0] == 5 and np.allclose(basis, [[0, 0, 1]])
+
+    def test_curve(self):
+        # a degree 1 curve is its control polygon
+        points = [(0, 0, 0), (1, 0, 0), (1, 2, 0), (0, 2, 3)]
+        curve = nurbs.NurbsCurve(
+            order=2, controlPoint=points, knot=[0, 0, 1, 2, 3, 3], tessellation=3
+        )
+        polyline = nurbseval.curvePolyline(curve)
+        assert np.allclose(polyline.points, points)
+        assert polyline.colors is None
+        assert nurbseval.curvePolyline(curve) is polyline
+        # a rational quadratic quarter circle (invalid knots are replaced)
+        curve = nurbs.NurbsCurve2D(
+            controlPoint=[(1, 0), (1, 1), (0, 1)],
+            weight=[1, np.sqrt(0.5), 1],
+            knot=[0, 1],
+            tessellation=16,
+        )
+        points = nurbseval.curvePolyline(curve).points
+        assert len(points) == 17
+        assert np.allclose(np.linalg.norm(points, axis=1), 1, atol=1e-6)
+        assert np.allclose(points[[0, -1]], [(1, 0), (0, 1)])
+        # changing a field recalculates
+        curve.tessellation = -2
+        assert len(nurbseval.curvePolyline(curve)) == 7
+
+    def test_surface(self):
+        surface = patch(color=np.tile([(1, 0, 0), (0, 0, 1)], (10, 1)))
+        mesh = nurbseval.surfaceMesh(surface)
+        # 2 segments per control point by default
+        assert len(mesh) == 8 * 10 * 2
+        assert len(mesh.vertices) == 9 * 11
+        uKnots = nurbseval.defaultKnots(4, 4)
+        vKnots = nurbseval.defaultKnots(5, 3)
+        controlPoints = np.asarray(surface.controlPoint, 'd').reshape((5, 4, 3))
+        interior = np.all(mesh.texCoords < 1, axis=1)
+        for (s, t), found in zip(mesh.texCoords[interior], mesh.vertices[interior]):
+            expected = sum(
+                cox_de_boor(uKnots, i, 3, s)
+                * cox_de_boor(vKnots, j, 2, t)
+                * controlPoints[j, i]
+                for i in range(4)
+                for j in range(5)
+            )
+            assert np.allclose(found, expected, atol=1e-5), (s, t)
+        # the surface interpolates its corner control points
+        corners = np.all((mesh.texCoords == 0) | (mesh.texCoords == 1), axis=1)
+        found = mesh.vertices[corners][np.lexsort(mesh.texCoords[corners].T)]
+        assert np.allclose(found, controlPoints[[0, 0, -1, -1], [0, -1, 0, -1]])
+        assert np.all((mesh.colors[:, 1] == 0) & (mesh.colors.min(axis=1) >= 0))
+        # counterclockwise about du x dv, +Y for this patch
+        triangles = mesh.vertices[mesh.indices]
+        normals = np.cross(
+            triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+        )
+        assert np.all(normals[:, 1] > 0)
+        assert np.all(mesh.normals[:, 1] > 0)
+        surface.uTessellation = 3
+        surface.vTessellation = -1
+        assert len(nurbseval.surfaceMesh(surface)) == 3 * 5 * 2
+        assert len(nurbseval.surfaceMesh(surface, scale=2.0)) == 6 * 10 * 2
+        # inconsistent dimensions give an empty mesh
+        surface.uDimension = 3
+        assert len(nurbseval.surfaceMesh(surface)) == 0
+
+    def test_trimming(self):
+        surface = patch(uTessellation=20, vTessellation=20)
+        square = nurbs.Polyline2D(
+            point=[(0.25, 0.25), (0.75, 0.25), (0.75, 0.75), (0.25, 0.75)]
+        )
+        trimmed = nurbs.TrimmedSurface(
+            surface=surface, trimmingContour=[nurbs.Contour2D(children=[square])]
+        )
+        mesh = nurbseval.surfaceMesh(trimmed)
+        assert len(mesh) == 10 * 10 * 2
+        centres = mesh.texCoords[mesh.indices].mean(axis=1)
+        assert np.all((centres > 0.25) & (centres < 0.75))
+        # changes to the contour reach the trimmed surface
+        square.point = [(0, 0), (0.5, 0), (0.5, 1), (0, 1)]
+        assert len(nurbseval.surfaceMesh(trimmed)) == 10 * 20 * 2
+
+    def test_tessellation_scale(self):
+        surface = patch()
+        group = nurbs.NurbsGroup(
+            tessellationScale=0.5, children=[basenodes.Shape(geometry=surface)]
+        )
+        path = [group, group.children[0], surface]
+        assert nurbseval.tessellationScale(path) == 0.5
+        assert nurbseval.segmentCount(0, 4, 0.5) == 4
+        assert nurbseval.segmentCount(-3, 4) == 12
+        assert nurbseval.segmentCount(5, 4, 0.01) == 1
+
+    def test_picking(self):
+        scene = SceneGraph()
+        scene.children = [basenodes.Shape(geometry=patch())]
+        hits = picking.pick(scene, [(0.5, 10, -0.5), (2, 10, 0)], (0, -1, 0))
+        assert np.array_equal(hits.leaves, [0, -1])
+        assert 9.7 < hits.distances[0] < 10
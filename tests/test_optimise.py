@@ -0,0 +1,171 @@
+import unittest
+from vrml.protofunctions import protoName
+from vrml.vrml97 import basenodes, optimise, picking
+from vrml.vrml97.parser import buildParser
+from vrml.vrml97.scenegraph import SceneGraph
+import numpy as np
+
+POINTS = np.arange(300, dtype='f').reshape((-1, 3))
+
+
+def shape(color=(1, 0, 0), DEF=''):
+    return basenodes.Shape(
+        geometry=basenodes.IndexedFaceSet(
+            coord=basenodes.Coordinate(point=POINTS.copy(), DEF=DEF),
+            coordIndex=[0, 1, 2, -1],
+        ),
+        appearance=basenodes.Appearance(
+            material=basenodes.Material(diffuseColor=color),
+        ),
+    )
+
+
+class TestDeduplicate(unittest.TestCase):
+    def test_deduplicate(self):
+        scene = SceneGraph()
+        shapes = [shape(), shape(), shape(color=(0, 0, 1))]
+        scene.children = [basenodes.Transform(children=shapes)]
+        report = optimise.deduplicate(scene)
+        assert report.removed == {
+            'Appearance': 1,
+            'Coordinate': 2,
+            'Material': 1,
+        }, report.removed
+        # the coordinates and a diffuseColor
+        assert report.saved == 2 * POINTS.nbytes + 12, str(report)
+        first, second, third = scene.children[0].children
+        assert first.appearance is second.appearance
+        assert third.appearance is not first.appearance
+        coords = set([id(item.geometry.coord) for item in (first, second, third)])
+        assert len(coords) == 1
+        # different IndexedFaceSet instances are not in the default types
+        assert first.geometry is not second.geometry
+
+        content = scene.toString()
+        assert 'USE Coordinate_1' in content, content
+        assert 'USE Appearance_1' in content, content
+        success, result, parsed = buildParser().parse(content + '\n')
+        assert success and parsed == len(content) + 1
+        loaded = result[1].children[0].children
+        assert loaded[0].appearance is loaded[1].appearance
+
+    def test_protected(self):
+        scene = SceneGraph()
+        scene.children = [shape(DEF='Target'), shape()]
+        scene.regDefName('Target', scene.children[0].geometry.coord)
+        scene.addRoute(
+            (
+                scene.children[0].geometry.coord,
+                'point',
+                scene.children[1].geometry.coord,
+                'point',
+            )
+        )
+        report = optimise.deduplicate(scene)
+        assert 'Coordinate' not in report.removed, report.removed
+        assert report.removed.get('Appearance') == 1
+
+    def test_def_names(self):
+        content = '''#VRML V2.0 utf8
+Shape { appearance Appearance { material Material { diffuseColor 1 0 0 } } }
+Shape { appearance Appearance { material DEF Red Material { diffuseColor 1 0 0 } } }
+Shape { appearance Appearance { material USE Red } }
+'''
+        success, result, parsed = buildParser().parse(content)
+        scene = result[1]
+        red = scene.defNames['Red']
+        optimise.deduplicate(scene)
+        # the DEF'd node is the shared one, and keeps its name
+        assert scene.defNames['Red'] is red
+        materials = [child.appearance.material for child in scene.children]
+        assert all([material is red for material in materials])
+        content = scene.toString()
+        assert 'DEF Red Material' in content, content
+        assert 'Material_1' not in content, content
+
+
+def chain(depth, leaf, DEF=''):
+    """Nest leaf in depth Transforms"""
+    current = leaf
+    for index in range(depth):
+        current = basenodes.Transform(
+            translation=(index, 0, 1),
+            rotation=(0, 1, 0, 0.3),
+            scale=(1, 1.5, 1),
+            children=[current],
+        )
+    current.DEF = DEF
+    return current
+
+
+def world_distances(scene):
+    """Distances to the scene's faces along rays towards -Z"""
+    origins = np.column_stack(
+        (np.linspace(-20, 20, 41), np.full(41, 1.0), np.full(41, 100.0))
+    )
+    hits = picking.pick(scene, origins, (0, 0, -1))
+    return hits.distances
+
+
+class TestFlatten(unittest.TestCase):
+    def test_flatten(self):
+        scene = SceneGraph()
+        quad = basenodes.Shape(
+            geometry=basenodes.IndexedFaceSet(
+                coord=basenodes.Coordinate(
+                    point=[(-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, 1, 0)]
+                ),
+                normal=basenodes.Normal(vector=[(0, 0, 1)]),
+                normalPerVertex=False,
+                coordIndex=[0, 1, 2, 3, -1],
+            )
+        )
+        # the quad is also used directly and in a kept (DEF'd) Transform
+        kept = chain(1, quad, DEF='Kept')
+        scene.regDefName('Kept', kept)
+        mirrored = basenodes.Transform(scale=(-1, 1, 1), children=[quad])
+        scene.children = [
+            chain(12, quad),
+            chain(3, basenodes.Group(children=[chain(2, quad)])),
+            quad,
+            kept,
+            mirrored,
+        ]
+        expected = world_distances(scene)
+        report = optimise.flattenTransforms(scene)
+        assert report.collapsed == 12 + 3 + 2 + 1, str(report)
+        assert report.depthBefore == 15 and report.depthAfter == 4, str(report)
+        assert report.nodesAfter < report.nodesBefore
+        found = world_distances(scene)
+        assert np.allclose(found, expected, atol=1e-4), (found, expected)
+        # the untransformed and kept uses still share the original
+        assert scene.children[2] is quad and scene.children[-2] is kept
+        assert kept.children[0] is quad
+        assert np.array_equal(quad.geometry.coord.point[0], (-1, -1, 0))
+        assert report.copied['Coordinate'] == 3, report.copied
+        # normals are transformed with the inverse transpose
+        flat = scene.children[0].geometry
+        vertices = np.asarray(flat.coord.point)
+        normal = np.cross(vertices[1] - vertices[0], vertices[2] - vertices[0])
+        normal /= np.linalg.norm(normal)
+        assert np.allclose(flat.normal.vector[0], normal, atol=1e-5)
+        # mirroring reverses the winding
+        assert not scene.children[-1].geometry.ccw
+        content = scene.toString()
+        success, result, parsed = buildParser().parse(content + '\n')
+        assert success and parsed == len(content) + 1
+
+    def test_protected(self):
+        scene = SceneGraph()
+        inner = chain(3, shape())
+        routed = basenodes.Transform(children=[inner])
+        interpolator = basenodes.PositionInterpolator()
+        scene.children = [interpolator, routed, chain(2, basenodes.Viewpoint())]
+        scene.addRoute((interpolator, 'value_changed', routed, 'set_translation'))
+        report = optimise.flattenTransforms(scene)
+        # the routed Transform is kept, the chain below it collapses
+        assert scene.children[1] is routed
+        assert protoName(routed.children[0]) == 'Shape'
+        assert report.collapsed == 3 and report.copied == {}, str(report)
+        # non-geometry children block collapsing
+        assert protoName(scene.children[2]) == 'Transform'
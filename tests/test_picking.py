@@ -0,0 +1,101 @@
+import unittest
+from vrml.vrml97 import basenodes, picking
+from vrml.vrml97.scenegraph import SceneGraph
+import numpy as np
+
+
+def quad(z):
+    """A 2x2 square IndexedFaceSet at depth z facing +Z"""
+    return basenodes.Shape(
+        geometry=basenodes.IndexedFaceSet(
+            coord=basenodes.Coordinate(
+                point=[(-1, -1, z), (1, -1, z), (1, 1, z), (-1, 1, z)]
+            ),
+            coordIndex=[0, 1, 2, 3, -1],
+        )
+    )
+
+
+def brute_pick(origins, directions, triangles):
+    count = len(origins)
+    pairs = np.repeat(np.arange(count), len(triangles))
+    t, u, v = picking.rayTriangles(
+        origins[pairs], directions[pairs], np.tile(triangles, (count, 1, 1))
+    )
+    return t.reshape((count, -1)).min(axis=1)
+
+
+class TestPicking(unittest.TestCase):
+    def test_ray_triangles(self):
+        triangle = np.array([[(0, 0, 0), (1, 0, 0), (0, 1, 0)]] * 4, 'd')
+        origins = np.array([(0.25, 0.5, 1), (0.25, 0.5, -1), (1, 1, 1), (0, 0, 1)], 'd')
+        directions = np.array([(0, 0, -2), (0, 0, 1), (0, 0, -1), (1, 0, 0)], 'd')
+        t, u, v = picking.rayTriangles(origins, directions, triangle)
+        assert np.allclose(t[:2], [0.5, 1]), t
+        assert np.allclose(u[:2], 0.25) and np.allclose(v[:2], 0.5)
+        # outside the triangle, and parallel to its plane
+        assert np.all(np.isinf(t[2:])), t
+
+    def test_scene(self):
+        front, back = quad(1), quad(-1)
+        scene = SceneGraph()
+        scene.children = [
+            basenodes.Transform(translation=(0, 0, -5), children=[back, front]),
+            basenodes.Transform(translation=(5, 0, 0), children=[front]),
+        ]
+        picker = picking.Picker(scene, workers=1)
+        origins = np.array([(0.5, 0.5, 0), (5.5, 0, 5), (9, 9, 0), (0, 0, -10)], 'd')
+        directions = np.array([(0, 0, -1), (0, 0, -1), (0, 0, -1), (0, 0, 1)], 'd')
+        hits = picker.intersect(origins, directions)
+        assert np.array_equal(hits.hit, [True, True, False, True])
+        assert np.allclose(hits.distances[[0, 1, 3]], [4, 4, 4]), hits.distances
+        assert np.allclose(hits.points[0], (0.5, 0.5, -4))
+        assert np.allclose(hits.barycentrics.sum(axis=1)[hits.hit], 1)
+        for index in np.flatnonzero(hits.hit):
+            leaf = hits.leaves[index]
+            triangle = picker.triangles[picker.offsets[leaf] + hits.triangles[index]]
+            point = hits.barycentrics[index] @ triangle
+            assert np.allclose(point, hits.points[index])
+        paths = hits.paths()
+        assert paths[0][-1] is front and paths[0][-2] is scene.children[0]
+        assert paths[1][-2] is scene.children[1]
+        assert paths[2] is None
+        assert paths[3][-1] is back
+        assert hits.faces()[0] == 0 and hits.faces()[2] == -1
+        # maximum distance
+        hits = picker.intersect(origins, (0, 0, -1), maxDistance=5)
+        assert np.array_equal(hits.hit, [True, True, False, False])
+        # moved transforms and changed geometry are refitted
+        scene.children[1].translation = (5, 0, -3)
+        front.geometry.coord.point = [(-3, -3, 1), (3, -3, 1), (3, 3, 1), (-3, 3, 1)]
+        hits = picker.intersect(origins, (0, 0, -1))
+        assert np.array_equal(hits.leaves[:3], [1, 2, -1]), hits.leaves
+        assert np.allclose(hits.distances[:2], [4, 7])
+
+    def test_batch(self):
+        rng = np.random.default_rng(3)
+        shapes = []
+        for index in range(20):
+            points = rng.random((30, 3)) * 10
+            shapes.append(
+                basenodes.Shape(
+                    geometry=basenodes.IndexedFaceSet(
+                        coord=basenodes.Coordinate(point=points),
+                        coordIndex=np.column_stack(
+                            (np.arange(30).reshape((10, 3)), np.full(10, -1))
+                        ).ravel(),
+                    )
+                )
+            )
+        scene = SceneGraph()
+        scene.children = shapes
+        origins = rng.random((3000, 3)) * 10
+        directions = rng.random((3000, 3)) - 0.5
+        picker = picking.Picker(scene, chunkSize=500)
+        hits = picker.intersect(origins, directions)
+        lengths = np.linalg.norm(directions, axis=1)[:, np.newaxis]
+        expected = brute_pick(origins, directions / lengths, picker.triangles)
+        assert np.allclose(hits.distances, expected)
+        single = picking.pick(scene, origins, directions)
+        assert np.array_equal(single.leaves, hits.leaves)
+        assert np.array_equal(single.triangles, hits.triangles)
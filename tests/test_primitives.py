@@ -0,0 +1,78 @@
+import unittest
+from vrml.vrml97 import basenodes, bounds, picking, primitives
+from vrml.vrml97.scenegraph import SceneGraph
+import numpy as np
+
+
+class TestPrimitives(unittest.TestCase):
+    def check_mesh(self, mesh, node):
+        triangles = mesh.vertices[mesh.indices]
+        normals = np.cross(
+            triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+        )
+        # no degenerate triangles, all wound counterclockwise (outward)
+        assert np.all(np.linalg.norm(normals, axis=1) > 1e-6)
+        vertexNormals = mesh.normals[mesh.indices].sum(axis=1)
+        assert np.all(np.einsum('ij,ij->i', normals, vertexNormals) > 0)
+        assert np.allclose(np.linalg.norm(mesh.normals, axis=1), 1, atol=1e-6)
+        assert np.all((mesh.texCoords >= 0) & (mesh.texCoords <= 1))
+        assert len(mesh.faces) == len(mesh)
+        expected = bounds.localBounds(node)
+        found = [mesh.vertices.min(axis=0), mesh.vertices.max(axis=0)]
+        assert np.allclose(found, expected, atol=1e-6), (found, expected)
+
+    def test_meshes(self):
+        for node in (
+            basenodes.Box(size=(2, 4, 6)),
+            basenodes.Sphere(radius=2),
+            basenodes.Cone(bottomRadius=2, height=3),
+            basenodes.Cone(bottom=0),
+            basenodes.Cylinder(radius=0.5, height=4),
+            basenodes.Cylinder(side=0),
+        ):
+            mesh = primitives.primitiveMesh(node, divisions=16)
+            self.check_mesh(mesh, node)
+        mesh = primitives.primitiveMesh(basenodes.Cone(side=0, bottom=0))
+        assert len(mesh) == 0
+        # the sphere's vertices lie on its surface
+        mesh = primitives.sphereMesh(3.0, 8)
+        assert np.allclose(np.linalg.norm(mesh.vertices, axis=1), 3)
+        assert len(mesh) == 8 * 4 * 2 - 2 * 8
+
+    def test_texture_coordinates(self):
+        # the seam is at the back, s=0.25 at -X, 0.5 at the front
+        mesh = primitives.cylinderMesh(1, 2, top=False, bottom=False, divisions=4)
+        expected = {0.0: (0, -1), 0.25: (-1, 0), 0.5: (0, 1), 0.75: (1, 0)}
+        for (s, t), (x, y, z) in zip(mesh.texCoords, mesh.vertices):
+            if s in expected:
+                assert np.allclose((x, z), expected[s]), (s, x, z)
+        box = primitives.boxMesh((2, 2, 2))
+        front = box.faces == 0
+        corners = box.indices[front].ravel()
+        assert np.allclose(box.texCoords[corners], box.vertices[corners, :2] / 2 + 0.5)
+
+    def test_sharing(self):
+        spheres = [basenodes.Sphere(radius=2) for index in range(100)]
+        meshes = [primitives.primitiveMesh(sphere) for sphere in spheres]
+        assert all(mesh is meshes[0] for mesh in meshes)
+        assert not meshes[0].vertices.flags.writeable
+        assert primitives.primitiveMesh(spheres[0], divisions=8) is not meshes[0]
+        # changing a field re-keys the node's mesh
+        spheres[0].radius = 3
+        mesh = primitives.primitiveMesh(spheres[0])
+        assert mesh is not meshes[0]
+        assert np.allclose(np.linalg.norm(mesh.vertices, axis=1), 3)
+        assert primitives.primitiveMesh(basenodes.Sphere(radius=3.0)) is mesh
+
+    def test_picking(self):
+        scene = SceneGraph()
+        scene.children = [
+            basenodes.Shape(geometry=basenodes.Sphere(radius=2)),
+            basenodes.Transform(
+                translation=(10, 0, 0),
+                children=[basenodes.Shape(geometry=basenodes.Box())],
+            ),
+        ]
+        hits = picking.pick(scene, [(0, 0, 10), (10, 0, 10)], (0, 0, -1))
+        assert np.array_equal(hits.leaves, [0, 1])
+        assert np.allclose(hits.distances, [8, 9], atol=0.05), hits.distances
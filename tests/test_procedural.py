@@ -0,0 +1,159 @@
+import unittest
+from vrml.vrml97 import basenodes, bounds, meshes, picking, procedural
+from vrml.vrml97.scenegraph import SceneGraph
+import numpy as np
+
+
+def corner_normals(mesh, ccw=True):
+    """Per-corner normals of each quad (triangles 2q and 2q+1)"""
+    corners = [0, 1, 2, 5] if ccw else [2, 1, 0, 3]
+    indices = mesh.indices.reshape((-1, 6))[:, corners]
+    return mesh.vertices[indices], mesh.normals[indices]
+
+
+class TestProcedural(unittest.TestCase):
+    def check_winding(self, mesh):
+        triangles = mesh.vertices[mesh.indices]
+        normals = np.cross(
+            triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+        )
+        vertexNormals = mesh.normals[mesh.indices].sum(axis=1)
+        assert np.all(np.einsum('ij,ij->i', normals, vertexNormals) > 0)
+
+    def test_elevation_grid(self):
+        rng = np.random.default_rng(4)
+        grid = basenodes.ElevationGrid(
+            xDimension=7,
+            zDimension=5,
+            xSpacing=0.5,
+            zSpacing=2,
+            height=rng.random(35),
+        )
+        mesh = procedural.elevationGridMesh(grid)
+        assert len(mesh) == 6 * 4 * 2
+        self.check_winding(mesh)
+        assert np.all(mesh.normals[:, 1] > 0)
+        found = [mesh.vertices.min(axis=0), mesh.vertices.max(axis=0)]
+        assert np.allclose(found, bounds.localBounds(grid))
+        assert np.allclose(mesh.texCoords.min(axis=0), 0)
+        assert np.allclose(mesh.texCoords.max(axis=0), 1)
+        assert procedural.elevationGridMesh(grid) is mesh
+        # generated normals match those of the equivalent IndexedFaceSet
+        points = np.column_stack(
+            (
+                np.tile(np.arange(7) * 0.5, 5),
+                grid.height,
+                np.repeat(np.arange(5) * 2.0, 7),
+            )
+        )
+        quads = procedural.quadCorners(5, 7)[:, ::-1]
+        for creaseAngle in (0.0, 0.2, 0.5, 4.0):
+            grid.creaseAngle = creaseAngle
+            mesh = procedural.elevationGridMesh(grid)
+            normals, indices = meshes.computeNormals(
+                points,
+                meshes.Polygons(np.column_stack((quads, np.full(24, -1))).ravel()),
+                creaseAngle,
+            )
+            expected = normals[indices].reshape((-1, 4, 3))[:, ::-1]
+            # the grid's quads are clockwise seen from +Y
+            found = corner_normals(mesh, False)[1]
+            assert np.allclose(found, expected, atol=1e-5), creaseAngle
+        grid.ccw = False
+        mesh = procedural.elevationGridMesh(grid)
+        self.check_winding(mesh)
+        assert np.all(mesh.normals[:, 1] < 0)
+
+    def test_elevation_grid_attributes(self):
+        grid = basenodes.ElevationGrid(
+            xDimension=3,
+            zDimension=2,
+            xSpacing=1,
+            zSpacing=1,
+            height=[0, 0, 0, 0, 0, 0],
+            color=basenodes.Color(color=[(1, 0, 0), (0, 1, 0)]),
+            colorPerVertex=False,
+            creaseAngle=1.0,
+        )
+        mesh = procedural.elevationGridMesh(grid)
+        colors = mesh.colors[mesh.indices[:, 0]]
+        assert np.array_equal(colors, [(1, 0, 0)] * 2 + [(0, 1, 0)] * 2)
+        grid.color.color = [(0, 0, 1)] * 6
+        grid.colorPerVertex = True
+        mesh = procedural.elevationGridMesh(grid)
+        assert len(mesh.vertices) == 6
+        assert np.all(mesh.colors == (0, 0, 1))
+        # too few values are ignored
+        grid.texCoord = basenodes.TextureCoordinate(point=[(0, 0)])
+        assert procedural.elevationGridMesh(grid).texCoords.shape == (6, 2)
+
+    def test_extrusion(self):
+        extrusion = basenodes.Extrusion()
+        mesh = procedural.extrusionMesh(extrusion)
+        # 4 side quads and 2 square caps
+        assert len(mesh) == 4 * 2 + 2 * 2
+        assert mesh.faces.max() == 5
+        self.check_winding(mesh)
+        found = [mesh.vertices.min(axis=0), mesh.vertices.max(axis=0)]
+        assert np.allclose(found, bounds.localBounds(extrusion))
+        caps = mesh.faces >= 4
+        capNormals = mesh.normals[mesh.indices[caps, 0]]
+        assert np.allclose(capNormals, [(0, -1, 0)] * 2 + [(0, 1, 0)] * 2)
+        extrusion.beginCap = extrusion.endCap = False
+        assert len(procedural.extrusionMesh(extrusion)) == 8
+        # a smooth circular crossSection around a closed spine
+        angles = np.linspace(0, 2 * np.pi, 17)
+        section = np.column_stack((np.cos(angles), -np.sin(angles))) * 0.1
+        section[-1] = section[0]
+        spine = np.column_stack((np.cos(angles), np.zeros(17), np.sin(angles)))
+        spine[-1] = spine[0]
+        extrusion.crossSection = section
+        extrusion.spine = spine
+        extrusion.creaseAngle = 1.0
+        mesh = procedural.extrusionMesh(extrusion)
+        self.check_winding(mesh)
+        positions, normals = corner_normals(mesh)
+        # normals point away from the spine (a torus)
+        ring = positions.copy()
+        ring[..., 1] = 0
+        ring /= np.linalg.norm(ring, axis=-1)[..., np.newaxis]
+        expected = positions - ring
+        expected /= np.linalg.norm(expected, axis=-1)[..., np.newaxis]
+        assert np.all(np.einsum('...i,...i', normals, expected) > 0.95)
+        # including across the seams
+        assert len(mesh.vertices) == 17 * 17
+        assert np.allclose(mesh.normals[::17], mesh.normals[16::17], atol=1e-6)
+        assert np.allclose(mesh.normals[:17], mesh.normals[-17:], atol=1e-6)
+        # concave (L-shaped, area 3) caps facing -Y and +Y
+        extrusion = basenodes.Extrusion(
+            crossSection=[(0, 0), (0, 2), (2, 2), (2, 1), (1, 1), (1, 0), (0, 0)],
+            convex=False,
+        )
+        mesh = procedural.extrusionMesh(extrusion)
+        self.check_winding(mesh)
+        triangles = mesh.vertices[mesh.indices[mesh.faces >= 6]]
+        normals = np.cross(
+            triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+        )
+        bottom, top = normals[:, 1] < 0, normals[:, 1] > 0
+        assert bottom.sum() == top.sum() == 4
+        assert np.allclose(normals[bottom, 1].sum() / 2, -3)
+        assert np.allclose(normals[top, 1].sum() / 2, 3)
+
+    def test_picking(self):
+        scene = SceneGraph()
+        scene.children = [
+            basenodes.Shape(
+                geometry=basenodes.ElevationGrid(
+                    xDimension=2,
+                    zDimension=2,
+                    xSpacing=4,
+                    zSpacing=4,
+                    height=[1, 1, 1, 1],
+                )
+            ),
+            basenodes.Shape(geometry=basenodes.Extrusion()),
+        ]
+        hits = picking.pick(scene, [(3, 10, 3), (0, 10, 0.5)], (0, -1, 0))
+        assert np.array_equal(hits.leaves, [0, 1])
+        assert np.allclose(hits.distances, [9, 9])
@@ -48,3 +48,201 @@ class TestToString(unittest.TestCase):
         scene = self.parsed_content(source)
         content = scene.toString()
         assert 'Material' in content, content
+
+    def test_stream(self):
+        from vrml.vrml97 import linearise
+        import io
+
+        source = open(os.path.join(HERE, 'fixtures', 'proto_is_simple.wrl')).read()
+        scene = self.parsed_content(source)
+        expected = scene.toString()
+
+        class Chunks(object):
+            def __init__(self):
+                self.chunks = []
+
+            def write(self, data):
+                self.chunks.append(data)
+
+        target = Chunks()
+        count = linearise.Lineariser().stream(scene, target, bufferSize=64)
+        assert ''.join(target.chunks) == expected
+        assert count == len(expected), (count, len(expected))
+        assert len(target.chunks) > 1
+        assert max([len(chunk) for chunk in target.chunks]) < 256
+
+        # undeclared re-use is linearised again rather than read back
+        shared = Transform(translation=(1, 2, 3))
+        scene.children.extend([shared, shared])
+        target = io.BytesIO()
+        linearise.Lineariser().stream(scene, target, encoding='utf-8')
+        content = target.getvalue().decode('utf-8')
+        assert content.count('Node duplicated') == 1, content
+        assert content.count('translation\t1,2,3') == 2, content
+        self.parsed_content(content)
+
+    def test_default_fields(self):
+        from vrml.vrml97 import linearise
+        from vrml import arrays, field, protofunctions
+
+        untouched = Transform()
+        content = linearise.linearise(untouched)
+        assert content.endswith('Transform { }'), content
+        # defaults were not materialised on the node
+        assert 'translation' not in untouched.__dict__, untouched.__dict__
+        explicit = Transform(translation=(0, 0, 0), scale=(1, 2, 1))
+        content = linearise.linearise(explicit)
+        assert 'translation' not in content, content
+        assert 'scale\t1,2,1' in content, content
+        # fields explicitly set to their default are omitted too
+        from vrml.vrml97.basenodes import Box, Material
+
+        assert linearise.linearise(Box(size=(2, 2, 2))).endswith('Box { }')
+        content = linearise.linearise(Material(diffuseColor=(0.8, 0.8, 0.8)))
+        assert content.endswith('Material { }'), content
+        content = linearise.linearise(Box(size=(2, 2, 3)))
+        assert content.endswith('Box {\n\t\tsize\t2,2,3\n\t}'), content
+
+        assert not arrays.safeCompare(arrays.array([1, 2]), arrays.array([1, 3]))
+        assert arrays.safeCompare(arrays.array([1, 2]), arrays.array([1, 2]))
+
+        Weighted = type(str('Weighted'), (Transform,), {'PROTO': 'Weighted'})
+        assert linearise.linearise(Weighted()).endswith('Weighted { }')
+        protofunctions.addField(Weighted, field.newField('weight', 'SFFloat', 1, 1.0))
+        content = linearise.linearise(Weighted(weight=2))
+        assert 'weight\t2' in content, content
+        protofunctions.removeField(Weighted, 'weight')
+        assert 'weight' not in linearise.linearise(Weighted()), content
+
+    def test_incremental(self):
+        from vrml.vrml97 import linearise, incremental
+        from vrml.vrml97.basenodes import Group, Shape, Appearance, Material, Box
+
+        shared = Material(DEF='Shared', diffuseColor=(1, 0, 0))
+        shapes = [
+            Shape(appearance=Appearance(material=shared), geometry=Box())
+            for i in range(4)
+        ]
+        branches = [Transform(children=[shape]) for shape in shapes]
+        scene = Group(children=branches)
+        lineariser = incremental.IncrementalLineariser()
+        assert lineariser.linear(scene) == linearise.linearise(scene)
+        cached = dict(lineariser.fragments)
+
+        # only the edited subtree and its ancestors are regenerated
+        shapes[1].geometry = Box(size=(1, 2, 3))
+        assert lineariser.linear(scene) == linearise.linearise(scene)
+        for branch in (branches[0], branches[2], branches[3]):
+            assert lineariser.fragments[id(branch)] is cached[id(branch)]
+        assert lineariser.fragments[id(branches[1])] is not cached[id(branches[1])]
+        assert lineariser.fragments[id(scene)] is not cached[id(scene)]
+        # parents refer to their children's fragments rather than copying the text
+        (fragment,) = lineariser.fragments[id(scene)].values()
+        children = [p for p in fragment.parts if isinstance(p, incremental.Fragment)]
+        assert children == [
+            child
+            for branch in branches
+            for child in lineariser.fragments[id(branch)].values()
+        ]
+
+        # moving the DEF'd occurrence changes the DEF/USE decisions
+        scene.children = branches[::-1]
+        content = lineariser.linear(scene)
+        assert content == linearise.linearise(scene), content
+        shared.diffuseColor = (0, 1, 0)
+        assert lineariser.linear(scene) == linearise.linearise(scene)
+
+        # edits within a prototype's scenegraph invalidate the PROTO block
+        source = open(os.path.join(HERE, 'fixtures', 'proto_is_simple.wrl')).read()
+        scene = self.parsed_content(source)
+        lineariser.linear(scene)
+        from vrml.protofunctions import getSceneGraph
+
+        body = getSceneGraph(scene.protoTypes['X'])
+        body.getDEF('T').translation = (7, 7, 7)
+        content = lineariser.linear(scene)
+        assert content == linearise.linearise(scene), content
+        assert '7,7,7' in content, content
+
+    def test_parallel(self):
+        from vrml.vrml97 import linearise
+        from vrml.vrml97.basenodes import Shape, Appearance, Material, Box, Sphere
+
+        shared = Material(DEF='Shared', diffuseColor=(1, 0, 0))
+        plain = Box(size=(1, 2, 3))
+        scene = SceneGraph(
+            children=[
+                Transform(
+                    translation=(i, 0, 0),
+                    children=[
+                        Shape(
+                            appearance=Appearance(material=shared),
+                            geometry=plain if i % 10 == 3 else Sphere(radius=i + 1),
+                        )
+                    ],
+                )
+                for i in range(60)
+            ]
+        )
+        expected = linearise.linearise(scene)
+        content = linearise.linearise(scene, processes=2)
+        assert content == expected, content
+        assert content.count('DEF Shared') == 1, content
+        self.parsed_content(content)
+
+    def test_field_precision(self):
+        from vrml.vrml97 import linearise
+        from vrml.vrml97.basenodes import (
+            Shape,
+            IndexedFaceSet,
+            Coordinate,
+            Normal,
+            ElevationGrid,
+        )
+
+        points = np.random.random((300, 3)) * 1000 - 500
+        normals = np.random.standard_normal((300, 3))
+        normals /= np.sqrt((normals**2).sum(-1))[:, None]
+        heights = np.random.random(400) * 2500
+        nodes = [
+            Shape(
+                geometry=IndexedFaceSet(
+                    coord=Coordinate(point=points), normal=Normal(vector=normals)
+                )
+            ),
+            Shape(geometry=ElevationGrid(xDimension=20, zDimension=20, height=heights)),
+        ]
+        precision = {'coordinates': 0.01, 'normals': 4}
+        # doubles print 17 digits and shrink by more than 2x, single-precision
+        # coordinates only print ~8 significant digits (about 10 characters
+        # with sign and separator), so 0.01 steps on values of up to 500
+        # (~7 characters) fall short of 2x, at about 1.45x
+        for node, ratio in zip(nodes, (1.4, 2)):
+            full = linearise.linearise(node)
+            small = linearise.linearise(node, fieldPrecision=precision)
+            assert len(small) * ratio < len(full), (len(small), len(full))
+        content = linearise.linearise(nodes[0], fieldPrecision=precision)
+        # closing #EndNode comment needs a newline to parse
+        result = self.parsed_content(content + '\n').children[0].geometry
+        assert np.abs(result.coord.point - points).max() <= 0.005 + 1e-4
+        assert np.abs(result.normal.vector - normals).max() <= 0.0005 + 1e-6
+        assert ' 0.' not in content and ',0.' not in content, content
+        assert ', ' not in content, content
+
+    def test_compact(self):
+        from vrml.vrml97 import linearise
+
+        # precision alone does not compact SF or MF fields
+        node = Transform(translation=(0.5, 1, 0))
+        content = linearise.linearise(node, precision=4)
+        assert 'translation\t0.5,1,0' in content, content
+        content = linearise.linearise(node, precision=4, compact=True)
+        assert 'translation\t.5,1,0' in content, content
+
+    def test_list_values(self):
+        from vrml import fieldtypes
+
+        # lists keep each element's own str(), as before bulk formatting
+        field = fieldtypes.MFFloat('values')
+        assert field.vrmlstr([1.0, 2, 3.5]) == '[ 1.0,2,3.5 ]'
+        assert field.vrmlstr(np.array([1.0, 2, 3.5])) == '[ 1.0,2.0,3.5 ]'
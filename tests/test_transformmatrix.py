@@ -1,7 +1,7 @@
 import unittest,sys
 from vrml.arrays import pi,array
 from vrml.vrml97 import transformmatrix
-from vrml.arrays import allclose,dot
+from vrml.arrays import allclose,dot,identity
 DEGTORAD = transformmatrix.DEGTORAD
 try:
     from vrml.vrml97 import _transformmatrix_accel
@@ -23,6 +23,36 @@ class TestTransformMatrix( unittest.TestCase ):
             else:
                 assert allclose( result, expected, 0, 0.000001 ),(name,matrix,point,expected,result)
     
+    def _batch_calculations( self, module ):
+        """Run the calculation tests through module's batched constructors"""
+        def single( batch ):
+            return lambda source: tuple([ stack[0] for stack in batch( [source] ) ])
+        for (matrix,point, expected, name) in self._create_test_matrix(
+            single( module.transMatrices ),
+            single( module.rotMatrices ),
+            single( module.scaleMatrices ),
+        ):
+            result = dot( point,matrix)
+            assert allclose( result, expected, 0, 0.000001 ),(name,matrix,point,expected,result)
+        rotations = array( [(0,1,0,pi/3),(1,1,0,-.5),(0,0,0,1),(0,0,1,0)], 'd' )
+        vectors = array( [(1,2,3),(-1,.5,0),(0,0,0),(2,2,2)], 'd' )
+        for batch,sources in (
+            (module.rotMatrices,rotations),
+            (module.scaleMatrices,vectors),
+            (module.transMatrices,vectors),
+        ):
+            forward,inverse = batch( sources )
+            assert forward.shape == inverse.shape == (len(sources),4,4), (forward.shape,inverse.shape)
+            for f,i,source in zip( forward, inverse, sources ):
+                if batch is module.scaleMatrices and not source.all():
+                    continue
+                assert allclose( dot( f, i ), identity( 4 ), atol=0.000001 ), (source, f, i)
+        R,R1 = module.rotMatrices( rotations[:2] )
+        for matrix,source in zip( R, rotations ):
+            assert allclose( matrix, _transformmatrix.rotMatrix( source )[0], atol=0.000001 ), (matrix,source)
+    def test_batch_calculations( self ):
+        self._batch_calculations( _transformmatrix )
+
     def _create_test_matrix( self, transMatrix,rotMatrix,scaleMatrix ):
         return [
             (transMatrix( (1,0,0) )[0], (0, 0,0,1), (1,0,0,1), "Simple translation"),
@@ -67,7 +97,33 @@ class TestTransformMatrix( unittest.TestCase ):
         unprojected = dot( inverse, projected )
         assert allclose( unprojected, test ), (unprojected, test)
     
+    def _check_local_matrices( self, localMatrices ):
+        for (translation,center,rotation,scale,scaleOrientation) in [
+            ((1,2,3),None,None,None,None),
+            ((1,2,3),(3,2,1),(0,1,0,pi/2),(2,1,.5),(1,0,0,pi/4)),
+            (None,(1,0,0),(1,1,0,-.5),None,None),
+            ((0,0,0),(0,1,0),None,(1,3,1),(0,0,1,.3)),
+            ((0,0,0),(5,1,0),(0,0,-2,-(pi/2)),(1,1,1),(0,1,0,1.2)),
+        ]:
+            T,T1 = _transformmatrix.transMatrix( translation )
+            C,C1 = _transformmatrix.transMatrix( center )
+            R,R1 = _transformmatrix.rotMatrix( rotation )
+            SO,SO1 = _transformmatrix.rotMatrix( scaleOrientation )
+            S,S1 = _transformmatrix.scaleMatrix( scale )
+            expected = transformmatrix.compressMatrices( T,C,R,SO,S,SO1,C1 )
+            iexpected = transformmatrix.compressMatrices( C,SO,S1,SO1,R1,C1,T1 )
+            forward,inverse = localMatrices( translation,center,rotation,scale,scaleOrientation )
+            assert allclose( forward, expected, atol=0.00001 ), (forward,expected)
+            assert allclose( inverse, iexpected, atol=0.00001 ), (inverse,iexpected)
+        assert localMatrices( (0,0,0),(1,2,3),(0,1,0,0),(1,1,1),(1,0,0,.2) ) == (None,None)
+    def test_local_matrices( self ):
+        self._check_local_matrices( _transformmatrix.localMatrices )
+
     if _transformmatrix_accel:
+        def test_batch_calculations_accel( self ):
+            self._batch_calculations( _transformmatrix_accel )
+        def test_local_matrices_accel( self ):
+            self._check_local_matrices( _transformmatrix_accel.localMatrices )
         def test_cross_check( self ):
             first = self._create_test_matrix(
                 _transformmatrix_accel.transMatrix,
@@ -7,9 +7,7 @@ Numeric tends to be a bit flaky...
 from numpy import *
 
 try:
-    # TODO: don't import this here, as it's not
-    # actually *used* in pyvrml97, it's just used
-    # in OpenGLContext...
+    # used by vrml.vrml97.culling and OpenGLContext
     from vrml_accelerate import frustcullaccel
 except ImportError as err:
     frustcullaccel = None
@@ -72,10 +70,12 @@ def safeCompare(first, second):
             return False
     elif second is None:
         return False
+    if first is second:
+        return True
     if isinstance(first, (int, float, str)):
         return first == second
     if isinstance(first, ArrayType) and isinstance(second, ArrayType):
-        return bool(any(first == second))
+        return first.shape == second.shape and bool(all(first == second))
     elif type(first) != type(second):
         return False
     return bool(first == second)
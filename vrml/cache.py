@@ -248,3 +248,26 @@ class CacheHolder( object ):
         except RuntimeError:
             traceback.print_exc()
             
+
+class DependentHolder( CacheHolder ):
+    """CacheHolder which also clears the holders derived from it
+
+    Used for values which are calculated from the (cached) values
+    of other nodes, such as the structural hash or bounds of a
+    grouping node, clearing a child's value clears its parents'.
+
+    Attributes:
+        dependents -- weak set of objects with a clear() method
+            (normally holders for the values which include our
+            data), each is cleared when we are cleared
+    """
+    def __init__( self, *args, **named ):
+        super( DependentHolder, self ).__init__( *args, **named )
+        self.dependents = weakref.WeakSet()
+    def clear( self, signal=None, sender=None ):
+        """Clear this object's held value and those of our dependents"""
+        dependents = list( self.dependents )
+        self.dependents.clear()
+        super( DependentHolder, self ).clear( signal, sender )
+        for holder in dependents:
+            holder.clear()
@@ -10,7 +10,7 @@ We use Numeric Python arrays whereever possible.
 """
 
 import operator
-from vrml import field, csscolors, arrays
+from vrml import field, csscolors, arrays, numberformat
 from ._bytes import unicode, long
 
 try:
@@ -118,13 +118,21 @@ def SFFloat_vrmlstr(value, lineariser=None):
 def MFSimple_vrmlstr(value, lineariser=None):
     """Convert value to a VRML97 representation"""
     linvalues = _linvalues(lineariser)
-    stringreps = [str(obj) for obj in value]
-    stringsets = []
-    setLength = 100  # 100 is arbitrary
-    while stringreps:
-        stringsets.append(linvalues['numsep'].join(stringreps[:setLength]))
-        del stringreps[:setLength]
-    return '[ %s ]' % ('\n'.join(stringsets))
+    if linvalues.get('precision') is None and not isinstance(value, arrays.ArrayType):
+        # lists keep each element's own str(), e.g. integers in MFFloats
+        stringreps = [str(obj) for obj in value]
+        if linvalues.get('compact'):
+            stringreps = numberformat.compactStrings(stringreps)
+    else:
+        stringreps = numberformat.formatArray(
+            value, linvalues.get('precision'), linvalues.get('compact')
+        )
+    return '[ %s ]' % numberformat.joinFormatted(
+        stringreps,
+        numsep=linvalues['numsep'],
+        subelspacer=linvalues['numsep'],
+        perLine=100,  # 100 is arbitrary
+    )
 
 
 if str is bytes:
@@ -552,7 +560,14 @@ class _SFVec(object):
 
     def vrmlstr(self, value, lineariser=None):
         """Convert the given value to a VRML97 representation"""
-        return _linvalues(lineariser)['numsep'].join(
+        linvalues = _linvalues(lineariser)
+        if linvalues.get('precision') is not None:
+            return linvalues['numsep'].join(
+                numberformat.formatArray(
+                    value, linvalues['precision'], linvalues.get('compact')
+                )
+            )
+        return linvalues['numsep'].join(
             [SFFloat_vrmlstr(obj, lineariser) for obj in value]
         )
 
@@ -689,21 +704,21 @@ class _MFVec(_SFArray):
             # numpy arrays can't be tested for null-ity, should be a typeerror, but whatever
             pass
         linvalues = _linvalues(lineariser)
-        sets = [
-            linvalues['numsep'].join([str(obj) for obj in vector.ravel()])
-            for vector in value
-        ]
-        setLength = int(100 / self.length)  # 100 is arbitrary
-
-        # now process the string chunk representations
-        if len(sets) < setLength:  # again, arbitrary
-            return '[%s]' % (linvalues['subelspacer'].join(sets))
-        else:  # greater than setLength elements...
-            stringsets2 = []
-            while sets:
-                stringsets2.append(linvalues['subelspacer'].join(sets[:setLength]))
-                del sets[:setLength]
-            return '[%s]' % ('\n'.join(stringsets2))
+        value = arrays.asarray(value)
+        stringreps = numberformat.formatArray(
+            value, linvalues.get('precision'), linvalues.get('compact')
+        )
+        subelspacer = linvalues['subelspacer']
+        if linvalues.get('compact'):
+            # commas are whitespace in VRML97, one character separates vectors
+            subelspacer = numberformat.COMPACT_SEPARATOR
+        return '[%s]' % numberformat.joinFormatted(
+            stringreps,
+            width=len(stringreps) // len(value),
+            numsep=linvalues['numsep'],
+            subelspacer=subelspacer,
+            perLine=int(100 / self.length),  # 100 is arbitrary
+        )
 
     def copyValue(self, value, copier=None):
         """Copy a value for copier"""
@@ -0,0 +1,329 @@
+"""Bulk conversion of numeric arrays to VRML97 text
+
+The field-types' vrmlstr methods originally called str()
+for each number in an array and then joined the results
+in small chunks.  The functions here convert whole arrays
+to text in one pass, using C-level string formatting of
+the array's values and a single join with pre-computed
+separators.  numpy formats float32 values one scalar at a
+time, so their default text is built with array operations
+instead: the shortest round-tripping digits are calculated
+in float64 and the text assembled as a byte matrix (see
+_float32Strings).  Other non-double float types still use
+str() for each element.
+
+precision values (the lineariser's 'precision' linvalue):
+
+    None -- compatibility mode, produces exactly the same
+        text as str() on each element
+    'shortest' -- shortest text which round-trips to the
+        same value in the array's data-type
+    integer -- that many significant digits, the relative
+        error is at most 5*10**-digits
+    float -- absolute quantization step, values are rounded
+        to the nearest multiple of the step, the error is at
+        most step/2 for powers of ten (e.g. .001), at most
+        step otherwise (e.g. 1/1024.)
+
+compact -- strip leading zeros ("0.5" -> ".5"), trailing
+    zeros ("2.50" -> "2.5", "3.000" -> "3") and negative
+    zeros ("-0" -> "0"), MF vector fields also separate their
+    vectors with COMPACT_SEPARATOR rather than ", "
+"""
+import math, re
+from vrml import arrays
+
+SHORTEST = 'shortest'
+# separator between the vectors of compact MF vector fields
+COMPACT_SEPARATOR = ' '
+# separator which cannot occur in formatted numbers
+_SPLIT = '\x00'
+_TRAILING_ZEROS = re.compile(r'(\.\d*?)0+(?=\D|$)')
+_TRAILING_POINT = re.compile(r'\.(?=\D|$)')
+_LEADING_ZERO = re.compile(r'(?<![\d.])0\.(?=\d)')
+_NEGATIVE_ZERO = re.compile(r'(?<![\w.+-])-0(?=\D|$)')
+# powers of ten for float32 digit calculations (see _float32Digits)
+_POWER_OFFSET = 64
+_POWERS = 10.0 ** arrays.arange( -_POWER_OFFSET, _POWER_OFFSET + 1 )
+_INTEGER_POWERS = 10 ** arrays.arange( 9 )
+_DIGIT_POWERS = _INTEGER_POWERS[::-1].astype( arrays.uint32 )
+_LOW_BITS = arrays.uint64( 2**29 - 1 )
+_HALF_BITS = 2**28
+# layout of _float32Text's per-row character table, 9 digits then
+_TABLE_CONSTANTS = arrays.frombuffer( b'0.-e+00 \x00', arrays.uint8 )
+_ZERO, _POINT, _MINUS, _EXPONENT = 9, 10, 11, 12
+_END, _PAD = 16, 17
+_TABLE_WIDTH = 18
+# longest text (-0.000123456789) and its terminator
+_WIDTH = 17
+# float32 decimal exponents (of normal values) are within +-40
+_EXPONENT_OFFSET = 40
+_EXPONENTS = 81
+_CHUNK = 65536
+
+def _format( template, values ):
+    """Format each value (python number) with template in a single operation"""
+    if not values:
+        return []
+    return ((template+_SPLIT)*len(values) % tuple(values)).split( _SPLIT )[:-1]
+
+def _shortest( values ):
+    """Shortest round-tripping representation of a (non-double) float array"""
+    flat = values.tolist()
+    result = _format( '%.6g', flat )
+    remaining = arrays.nonzero( arrays.array( result, values.dtype ) != values )[0]
+    for digits in (7,8,9):
+        if not len(remaining):
+            break
+        indices = remaining.tolist()
+        strings = _format( '%%.%dg'%(digits,), [flat[i] for i in indices] )
+        for index,string in zip( indices, strings ):
+            result[index] = string
+        remaining = remaining[ arrays.array( strings, values.dtype ) != values[remaining] ]
+    return result
+
+def _float32Digits( magnitude ):
+    """Shortest round-tripping digits of positive normal float32 values
+
+    magnitude -- (N,) float64 array of the (exact) float32 values
+
+    A value's text round-trips when it lies within half the gap to
+    the neighbouring float32 values.  More digits always fit if
+    fewer do, so the fewest digits is found by counting the numbers
+    of digits whose unit has a multiple inside that interval, the
+    digits are the nearest such multiple.
+
+    returns ((N,) digits as an integer, (N,) number of digits,
+    (N,) decimal exponent of the first digit, (N,) boolean array,
+    true where float64 rounding error could change the result)
+    """
+    count = len( magnitude )
+    exponent = arrays.floor( arrays.log10( magnitude ) ).astype( 'l' )
+    scale = _POWERS[ 8 - exponent + _POWER_OFFSET ]
+    # log10 may be out by one next to powers of ten
+    scaled = magnitude * scale
+    exponent += (scaled >= 1e9).astype( 'l' ) - (scaled < 1e8)
+    scale = _POWERS[ 8 - exponent + _POWER_OFFSET ]
+    # the value and its round-trip interval in units of the 9th digit
+    scaled = magnitude * scale
+    target = magnitude.astype( arrays.float32 )
+    lower = magnitude - arrays.nextafter( target, 0 ).astype( arrays.float64 )
+    with arrays.errstate( over='ignore' ):
+        upper = arrays.spacing( target ).astype( arrays.float64 )
+    # the largest float32 has no upper neighbour
+    upper = arrays.where( arrays.isinf( upper ), lower, upper )
+    upper = scaled + upper * scale * 0.5
+    lower = scaled - lower * scale * 0.5
+
+    def inside( places ):
+        """(an integer multiple of the places' unit is inside, unreliable)"""
+        unit = _POWERS[ places - 9 + _POWER_OFFSET ]
+        high, low = upper * unit, lower * unit
+        top = arrays.floor( high )
+        # the ends are only inside for even mantissas, and float64
+        # error could move an end past an integer
+        unsure = arrays.absolute( high - top - 0.5 ) > 0.5 - 1e-6
+        unsure |= arrays.absolute( low - arrays.floor( low ) - 0.5 ) > 0.5 - 1e-6
+        return top >= low, unsure
+
+    length = arrays.full( count, 10, 'l' )
+    for places in range( 1, 10 ):
+        unit = 10.0**(places - 9)
+        length -= arrays.floor( upper * unit ) >= lower * unit
+    ambiguous = length > 9
+    length = arrays.minimum( length, 9 )
+    # more digits always fit if fewer do, so checking the count found
+    # and the one below (reliably) confirms it is the fewest
+    fits, unsure = inside( length )
+    ambiguous |= unsure | ~fits
+    fits, unsure = inside( length - 1 )
+    ambiguous |= (unsure | fits) & (length > 1)
+    unit = _POWERS[ length - 9 + _POWER_OFFSET ]
+    current = scaled * unit
+    result = arrays.floor( current + 0.5 )
+    # two multiples may be equally near
+    ambiguous |= arrays.absolute( current - result + 0.5 ) < 1e-6
+    # the nearest multiple may be outside an uneven interval
+    result -= result > upper * unit
+    result += result < lower * unit
+    carry = result >= _POWERS[ length + _POWER_OFFSET ]
+    result = arrays.where( carry, result // 10, result ).astype( 'l' )
+    return result, length, exponent + carry, ambiguous
+
+def _float32Strings( values ):
+    """str() of each element of a float32 array, without per-value formatting
+
+    numpy writes float32 scalars with their shortest round-tripping
+    digits, positionally (with at least one decimal) when the value
+    is 0 or 1e-4 <= abs(value) < 1e6, in exponent form otherwise.
+    The text is assembled in a byte matrix from _float32Digits, the
+    (rare) values where that is unreliable, and infinite, nan and
+    subnormal values, fall back to str().
+    """
+    wide = values.astype( arrays.float64 )
+    magnitude = arrays.absolute( wide )
+    zero = magnitude == 0
+    special = ~arrays.isfinite( wide ) | (
+        (magnitude < arrays.finfo( arrays.float32 ).tiny) & ~zero
+    )
+    normal = arrays.flatnonzero( ~(special | zero) )
+    count = len( values )
+    digits = arrays.zeros( count, 'l' )
+    length = arrays.ones( count, 'l' )
+    first = arrays.zeros( count, 'l' )
+    if len( normal ):
+        found = _float32Digits( magnitude[normal] )
+        digits[normal], length[normal], first[normal] = found[:3]
+        special[normal[found[3]]] = True
+    positional = zero | ((magnitude >= 1e-4) & (magnitude < 1e6))
+    negative = arrays.signbit( wide )
+    chunks = []
+    for start in range( 0, count, _CHUNK ):
+        part = slice( start, start + _CHUNK )
+        chunks.append(
+            _float32Text(
+                digits[part], length[part], first[part],
+                negative[part], positional[part],
+            )
+        )
+    result = b''.join( chunks ).decode( 'ascii' ).split( ' ' )[:-1]
+    for index in arrays.flatnonzero( special ).tolist():
+        result[index] = str( values[index] )
+    return result
+
+def _float32Layouts():
+    """Column layouts of float32 text for each _float32Text key
+
+    The key combines whether the text is positional, the decimal
+    exponent of the first digit, the number of digits and the sign.
+
+    returns (K,_WIDTH) array, each row's text is the _float32Text
+    table's characters in the columns listed
+    """
+    key = arrays.arange( 2 * _EXPONENTS * 9 * 2 )
+    negative, key = key % 2, key // 2
+    length, key = key % 9 + 1, key // 9
+    first, positional = key % _EXPONENTS - _EXPONENT_OFFSET, key // _EXPONENTS
+    length, first = length[:, None], first[:, None]
+    column = arrays.arange( _WIDTH )[None, :] - negative[:, None]
+    # positional: the digit for each power of ten either side of the point
+    integral = arrays.maximum( first + 1, 1 )
+    power = arrays.where( column < integral, integral - 1 - column, integral - column )
+    index = first - power
+    index = arrays.where( (index >= 0) & (index < 9), index, _ZERO )
+    index[ column == integral ] = _POINT
+    end = integral + 1 + arrays.maximum( length - 1 - first, 1 )
+    # exponent form: d[.ddd]e+XX
+    mantissa = arrays.where( length > 1, length + 1, 1 )
+    scientific = arrays.where( column > 0, column - 1, 0 )
+    scientific[ (column == 1) & (mantissa > 1) ] = _POINT
+    offset = column - mantissa
+    scientific = arrays.where(
+        (offset >= 0) & (offset < 4), _EXPONENT + offset, scientific
+    )
+    positional = positional[:, None] == 1
+    index = arrays.where( positional, index, scientific )
+    end = arrays.where( positional, end, mantissa + 4 )
+    index[ column == -1 ] = _MINUS
+    index[ column == end ] = _END
+    index[ column > end ] = _PAD
+    return index.astype( arrays.intp )
+
+_LAYOUTS = _float32Layouts()
+
+def _float32Text( digits, length, first, negative, positional ):
+    """Space terminated text of float32 values from _float32Digits' results"""
+    count = len( digits )
+    # the characters each row's text is taken from: its 9 digits
+    # ('0' past its length), '0.-e', the exponent's sign and digits,
+    # the terminating space and padding (removed)
+    table = arrays.empty( (count, _TABLE_WIDTH), arrays.uint8 )
+    aligned = (digits * _INTEGER_POWERS[ 9 - length ]).astype( arrays.uint32 )
+    table[:, :9] = aligned[:, None] // _DIGIT_POWERS % 10 + ord( '0' )
+    table[:, 9:] = _TABLE_CONSTANTS
+    exponent = arrays.absolute( first )
+    table[:, _EXPONENT + 1] = arrays.where( first < 0, ord( '-' ), ord( '+' ) )
+    table[:, _EXPONENT + 2] = exponent // 10 + ord( '0' )
+    table[:, _EXPONENT + 3] = exponent % 10 + ord( '0' )
+    key = positional * _EXPONENTS + first + _EXPONENT_OFFSET
+    key = (key * 9 + length - 1) * 2 + negative
+    rows = arrays.arange( 0, count * _TABLE_WIDTH, _TABLE_WIDTH )
+    text = table.ravel()[ _LAYOUTS[ key ] + rows[:, None] ]
+    return text.tobytes().translate( None, b'\x00' )
+
+def _quantized( values, step ):
+    """Round values to multiples of step and format with enough decimals"""
+    decimals = max( 0, int( math.ceil( -math.log10( step ) - 1e-9 ) ) )
+    if not arrays.allclose( step, 10.0**-decimals ):
+        values = arrays.around( values / step ) * step
+    return _format( '%%.%df'%(decimals,), values.tolist() )
+
+def compactStrings( strings ):
+    """Strip redundant zeros from formatted numbers (see module docstring)"""
+    if not strings:
+        return strings
+    text = _SPLIT.join( strings )
+    text = _TRAILING_ZEROS.sub( r'\1', text )
+    text = _TRAILING_POINT.sub( '', text )
+    text = _LEADING_ZERO.sub( '.', text )
+    text = _NEGATIVE_ZERO.sub( '0', text )
+    return text.split( _SPLIT )
+
+def formatArray( value, precision=None, compact=False ):
+    """Convert every element of numeric array value to a string
+
+    value -- numeric array (of any shape, it will be flattened)
+    precision -- see module docstring
+    compact -- if true, strip redundant zeros (see module docstring)
+
+    returns list of strings, one per element
+    """
+    value = arrays.asarray( value )
+    flat = value.ravel()
+    kind = flat.dtype.kind
+    if kind in 'iub':
+        return list( map( str, flat.tolist() ) )
+    if precision is None:
+        if flat.dtype == arrays.float64:
+            # python's float repr is numpy's float64 str
+            result = list( map( repr, flat.tolist() ) )
+        elif flat.dtype == arrays.float32:
+            result = _float32Strings( flat )
+        else:
+            result = list( map( str, flat ) )
+    elif precision == SHORTEST:
+        if flat.dtype == arrays.float64:
+            result = list( map( repr, flat.tolist() ) )
+        else:
+            result = _shortest( flat )
+    elif isinstance( precision, float ):
+        result = _quantized( flat.astype( arrays.float64 ), precision )
+    else:
+        result = _format( '%%.%dg'%(int(precision),), flat.tolist() )
+    if compact:
+        result = compactStrings( result )
+    return result
+
+def joinFormatted( strings, width=1, numsep=',', subelspacer=', ', perLine=100 ):
+    """Join formatted numbers with VRML97 separators in a single pass
+
+    strings -- flat list of formatted numbers
+    width -- number of values per (vector) element
+    numsep -- separator between values within an element
+    subelspacer -- separator between elements
+    perLine -- number of elements per line
+
+    The result is equivalent to joining each element's values with
+    numsep, elements with subelspacer and lines with newlines.
+    """
+    count = len(strings)
+    if not count:
+        return ''
+    separators = [numsep]*count
+    separators[width-1::width] = [subelspacer]*len(separators[width-1::width])
+    step = width*perLine
+    separators[step-1::step] = ['\n']*len(separators[step-1::step])
+    result = [None]*(count*2-1)
+    result[::2] = strings
+    result[1::2] = separators[:-1]
+    return ''.join( result )
@@ -14,6 +14,12 @@ module.
 
 from __future__ import unicode_literals
 
+from pydispatch import dispatcher
+
+# sent (with the class as sender) when addField/removeField change
+# a prototype's fields, so caches of per-prototype data can be cleared
+FIELDS_CHANGED = 'prototypeFieldsChanged'
+
 
 def _getcls(cls):
     """Utility function returns class when passed instance or class"""
@@ -86,6 +92,7 @@ def addField(cls, field):
     At present this just calls setattr(cls,field.name,field)
     """
     setattr(_getcls(cls), field.name, field)
+    dispatcher.send(FIELDS_CHANGED, sender=_getcls(cls))
 
 
 def removeField(cls, field):
@@ -98,6 +105,7 @@ def removeField(cls, field):
         delattr(_getcls(cls), field)
     else:
         delattr(_getcls(cls), field.name)
+    dispatcher.send(FIELDS_CHANGED, sender=_getcls(cls))
 
 
 def getField(cls, field):
@@ -1,6 +1,6 @@
 """transformmatrix forward/backward calculation without accelerate support"""
-from math import pi
-from vrml.arrays import array, cos, sin, tan
+from math import pi, sqrt, sin as fsin, cos as fcos
+from vrml.arrays import array, asarray, cos, sin, tan, zeros, identity, where, newaxis, sqrt as asqrt
 # used to determine whether angles are non-null
 TWOPI = pi * 2.0
 # used to determine the center point of a transform
@@ -95,6 +95,186 @@ def transMatrix( source=None ):
     T1 = array( [ [1,0,0,0], [0,1,0,0], [0,0,1,0], [-x,-y,-z,1] ], 'f' )
     return T, T1
 
+def _quaternionMatrix( source ):
+    """Convert a VRML rotation to a 3x3 (row-vector) rotation matrix via quaternion
+
+    Returns None if the angle is an exact multiple of 2pi
+    """
+    if source is None:
+        return None
+    (x,y,z,a) = [float(v) for v in source]
+    if not a % TWOPI:
+        return None
+    length = sqrt( x*x + y*y + z*z )
+    if not length:
+        x,y,z,length = 0.0,1.0,0.0,1.0
+    s = fsin( a/2.0 )/length
+    w = fcos( a/2.0 )
+    x,y,z = x*s,y*s,z*s
+    xx,yy,zz = x*x,y*y,z*z
+    xy,xz,yz = x*y,x*z,y*z
+    wx,wy,wz = w*x,w*y,w*z
+    return (
+        (1-2*(yy+zz), 2*(xy+wz), 2*(xz-wy)),
+        (2*(xy-wz), 1-2*(xx+zz), 2*(yz+wx)),
+        (2*(xz+wy), 2*(yz-wx), 1-2*(xx+yy)),
+    )
+
+def _scaled( orientation, x,y,z ):
+    """Calculate SO' * S * SO for 3x3 orientation matrix SO and scale x,y,z"""
+    if orientation is None:
+        return ((x,0.0,0.0),(0.0,y,0.0),(0.0,0.0,z))
+    scale = (x,y,z)
+    return tuple([
+        tuple([
+            sum([orientation[k][i]*scale[k]*orientation[k][j] for k in (0,1,2)])
+            for j in (0,1,2)
+        ])
+        for i in (0,1,2)
+    ])
+
+def _product( first, second ):
+    """Multiply two 3x3 matrices (either may be None for identity)"""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return tuple([
+        tuple([
+            first[i][0]*second[0][j] + first[i][1]*second[1][j] + first[i][2]*second[2][j]
+            for j in (0,1,2)
+        ])
+        for i in (0,1,2)
+    ])
+
+def localMatrices( translation=None, center=None, rotation=None, scale=None, scaleOrientation=None ):
+    """Calculate (forward,inverse) VRML Transform matrices in closed form
+
+    Rather than building and dot'ing the seven T,C,R,SO,S,SO',C'
+    matrices, the rotations are converted (via quaternions) to 3x3
+    matrices and the linear portion and translation row of each
+    result are calculated directly, so each 4x4 result is a single
+    allocation.
+
+    Returns (forward, inverse) 4x4 matrices
+        or
+    None,None if the parameters describe an identity transform
+    """
+    R = _quaternionMatrix( rotation )
+    linear = ilinear = None
+    if scale is not None:
+        (x,y,z) = [float(v) for v in scale[:3]]
+        if not x == y == z == 1.0:
+            SO = _quaternionMatrix( scaleOrientation )
+            linear = _scaled( SO, x,y,z )
+            ilinear = _scaled(
+                SO, 1./(x or VERY_SMALL), 1./(y or VERY_SMALL), 1./(z or VERY_SMALL),
+            )
+    if R is not None:
+        linear = _product( linear, R )
+        ilinear = _product( tuple(zip(*R)), ilinear )
+    if translation is not None:
+        (tx,ty,tz) = [float(v) for v in translation[:3]]
+    else:
+        tx = ty = tz = 0.0
+    if linear is None:
+        if not (tx or ty or tz):
+            return None, None
+        return (
+            array( [ [1,0,0,0], [0,1,0,0], [0,0,1,0], [tx,ty,tz,1] ], 'd' ),
+            array( [ [1,0,0,0], [0,1,0,0], [0,0,1,0], [-tx,-ty,-tz,1] ], 'd' ),
+        )
+    if center is not None:
+        (cx,cy,cz) = [float(v) for v in center[:3]]
+    else:
+        cx = cy = cz = 0.0
+    (a,b,c) = linear
+    (ia,ib,ic) = ilinear
+    ox,oy,oz = cx+tx,cy+ty,cz+tz
+    forward = array( [
+        [a[0],a[1],a[2],0],
+        [b[0],b[1],b[2],0],
+        [c[0],c[1],c[2],0],
+        [
+            ox - (cx*a[0] + cy*b[0] + cz*c[0]),
+            oy - (cx*a[1] + cy*b[1] + cz*c[1]),
+            oz - (cx*a[2] + cy*b[2] + cz*c[2]),
+            1,
+        ],
+    ], 'd' )
+    inverse = array( [
+        [ia[0],ia[1],ia[2],0],
+        [ib[0],ib[1],ib[2],0],
+        [ic[0],ic[1],ic[2],0],
+        [
+            cx - (ox*ia[0] + oy*ib[0] + oz*ic[0]),
+            cy - (ox*ia[1] + oy*ib[1] + oz*ic[1]),
+            cz - (ox*ia[2] + oy*ib[2] + oz*ic[2]),
+            1,
+        ],
+    ], 'd' )
+    return forward, inverse
+
+def _stack( count ):
+    """Create an (N,4,4) stack of identity matrices"""
+    result = zeros( (count,4,4), 'd' )
+    result[:] = identity( 4, 'd' )
+    return result
+
+def rotMatrices( sources ):
+    """Convert (N,4) VRML rotations to rotation matrix stacks
+
+    Returns (R, R') as (N,4,4) double arrays, null rotation
+    vectors are treated as rotations about the y axis.
+    """
+    sources = asarray( sources, 'd' ).reshape( (-1,4) )
+    axis = sources[:,:3]
+    length = asqrt( (axis*axis).sum( -1 ) )
+    null = length == 0
+    axis = axis / where( null, 1.0, length )[:,newaxis]
+    axis[null] = (0,1,0)
+    x,y,z = axis[:,0],axis[:,1],axis[:,2]
+    a = sources[:,3]
+    c = cos( a )
+    s = sin( a )
+    t = 1-c
+    R = _stack( len(sources) )
+    R[:,0,0] = t*x*x+c
+    R[:,0,1] = t*x*y+s*z
+    R[:,0,2] = t*x*z-s*y
+    R[:,1,0] = t*x*y-s*z
+    R[:,1,1] = t*y*y+c
+    R[:,1,2] = t*y*z+s*x
+    R[:,2,0] = t*x*z+s*y
+    R[:,2,1] = t*y*z-s*x
+    R[:,2,2] = t*z*z+c
+    return R, R.transpose( 0,2,1 ).copy()
+
+def scaleMatrices( sources ):
+    """Convert (N,3) VRML scales to scale matrix stacks
+
+    Returns (S, S') as (N,4,4) double arrays
+    """
+    sources = asarray( sources, 'd' ).reshape( (-1,3) )
+    S = _stack( len(sources) )
+    S1 = _stack( len(sources) )
+    for i in range(3):
+        S[:,i,i] = sources[:,i]
+        S1[:,i,i] = 1./where( sources[:,i] == 0, VERY_SMALL, sources[:,i] )
+    return S, S1
+
+def transMatrices( sources ):
+    """Convert (N,3) VRML translations to translation matrix stacks
+
+    Returns (T, T') as (N,4,4) double arrays
+    """
+    sources = asarray( sources, 'd' ).reshape( (-1,3) )
+    T = _stack( len(sources) )
+    T1 = _stack( len(sources) )
+    T[:,3,:3] = sources
+    T1[:,3,:3] = -sources
+    return T, T1
+
 def perspectiveMatrix( fovy, aspect, zNear, zFar, inverse=False ):
     """Create a perspective matrix from given parameters
     
@@ -59,5 +59,45 @@ def transMatrix( source=None ):
     if x == y == z == 0.0:
         return None, None 
     return tmatrixaccel.transMatrix( x,y,z ),tmatrixaccel.transMatrix( -x, -y, -z )
+def localMatrices( translation=None, center=None, rotation=None, scale=None, scaleOrientation=None ):
+    """Calculate (forward,inverse) VRML Transform matrices in closed form
+
+    Returns (forward, inverse) 4x4 matrices
+        or
+    None,None if the parameters describe an identity transform
+    """
+    args = []
+    null = True
+    if translation is not None:
+        (x,y,z) = translation[:3]
+        null = null and x == y == z == 0.0
+        args.extend( (x,y,z) )
+    else:
+        args.extend( (0.0,0.0,0.0) )
+    if center is not None:
+        args.extend( center[:3] )
+    else:
+        args.extend( (0.0,0.0,0.0) )
+    if rotation is not None:
+        null = null and not rotation[3] % TWOPI
+        args.extend( rotation[:4] )
+    else:
+        args.extend( (0.0,1.0,0.0,0.0) )
+    if scale is not None:
+        (x,y,z) = scale[:3]
+        null = null and x == y == z == 1.0
+        args.extend( (x,y,z) )
+    else:
+        args.extend( (1.0,1.0,1.0) )
+    if scaleOrientation is not None:
+        args.extend( scaleOrientation[:4] )
+    else:
+        args.extend( (0.0,1.0,0.0,0.0) )
+    if null:
+        return None, None
+    return tmatrixaccel.localMatrices( *args )
+rotMatrices = tmatrixaccel.rotMatrices
+scaleMatrices = tmatrixaccel.scaleMatrices
+transMatrices = tmatrixaccel.transMatrices
 perspectiveMatrix = tmatrixaccel.perspectiveMatrix
 orthoMatrix = tmatrixaccel.orthoMatrix
@@ -0,0 +1,161 @@
+"""Scene archives with memory-mapped .npy array payloads
+
+An archive holds the structure table of vrml.vrml97.binary (as
+TABLE) and one .npy file per large numeric MF field value (see
+binary.ARRAY_THRESHOLD, smaller values are stored in the table),
+either as a directory or as an uncompressed (stored) zip file.
+
+When an archive is read the array payloads are memory-mapped
+read-only rather than read, so the scene-graph's structure can
+be walked without paging in the vertex data, and processes
+opening the same archive share the operating system's page
+cache for the payloads.
+
+Array payloads from an archive are read-only, changing a value
+means setting a new array on the node (through the field's
+__set__), which replaces the mapped array for that node without
+changing the archive, e.g.::
+
+    coord.point = coord.point * 2.0
+
+Note:
+    members of zip archives are aligned by the writer so that
+    the payloads have the same alignment as in memory, zip files
+    written by other tools work, but may produce unaligned arrays,
+    compressed members are decompressed into memory
+"""
+
+from __future__ import unicode_literals
+
+import mmap, os, struct, zipfile
+from numpy.lib import format as npyformat
+from vrml import arrays
+from vrml.vrml97 import binary
+
+TABLE = 'scene.json'
+# zip local file header, see zipfile.structFileHeader
+_FILE_HEADER = struct.Struct('<4s2B4HL2L2H')
+# "extensible data padding" extra field id used to align members
+_PADDING_ID = 0xD935
+
+
+def write(value, path, **namedargs):
+    """Write value (scene-graph or node) to an archive at path
+
+    path -- directory name, or filename ending in .zip
+    """
+    return Writer(**namedargs).save(value, path)
+
+
+def read(path, **namedargs):
+    """Read the scene-graph from the archive at path"""
+    return Reader(**namedargs).read(path)
+
+
+class Writer(binary.Writer):
+    """Writes the structure table and .npy payloads of a scene-graph"""
+
+    def _array(self, value):
+        """Register numeric array payload, return its index"""
+        value = arrays.ascontiguousarray(value)
+        index = len(self.arrays)
+        self.arrays.append(('%d.npy' % (index,), value.dtype.str, list(value.shape)))
+        self.payloads.append(value)
+        return index
+
+    def save(self, value, path):
+        """Save value to a directory or (if path ends in .zip) zip file"""
+        table = self.table(value)
+        if path.lower().endswith('.zip'):
+            with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+                archive.writestr(TABLE, table)
+                for (name, dtype, shape), payload in zip(self.arrays, self.payloads):
+                    info = self._alignedInfo(archive, name, payload.nbytes)
+                    with archive.open(info, 'w') as member:
+                        npyformat.write_array(member, payload)
+        else:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            with open(os.path.join(path, TABLE), 'wb') as file:
+                file.write(table)
+            for (name, dtype, shape), payload in zip(self.arrays, self.payloads):
+                with open(os.path.join(path, name), 'wb') as file:
+                    npyformat.write_array(file, payload)
+        return path
+
+    def _alignedInfo(self, archive, name, nbytes):
+        """Member info padded so the member's data is aligned"""
+        info = zipfile.ZipInfo(name)
+        info.compress_type = zipfile.ZIP_STORED
+        # .npy headers are padded to a multiple of 64 bytes
+        info.file_size = nbytes + binary.ALIGNMENT
+        start = archive.fp.tell() + _FILE_HEADER.size + len(name.encode('utf-8'))
+        if info.file_size * 1.05 > zipfile.ZIP64_LIMIT:
+            # zip64 sizes extra field
+            start += 20
+        padding = -(start + 4) % binary.ALIGNMENT
+        info.extra = struct.pack('<HH', _PADDING_ID, padding) + b'\x00' * padding
+        return info
+
+
+class Reader(binary.Reader):
+    """Reads archives, memory-mapping the array payloads"""
+
+    def __init__(self, basePrototypes=None, mmapThreshold=65536):
+        """Initialise the reader
+
+        basePrototypes -- see vrml.vrml97.parseprocessor.ParseProcessor
+        mmapThreshold -- payloads in directory archives smaller than
+            this many bytes are read rather than each getting a
+            separate memory-mapping (they are still read-only)
+        """
+        super(Reader, self).__init__(basePrototypes)
+        self.mmapThreshold = mmapThreshold
+
+    def read(self, path):
+        """Read the scene-graph from the archive at path"""
+        self.path = path
+        if os.path.isdir(path):
+            self.archive = None
+            with open(os.path.join(path, TABLE), 'rb') as file:
+                return self.load(file.read())
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.archive = zipfile.ZipFile(path)
+        try:
+            return self.load(self.archive.read(TABLE))
+        finally:
+            self.archive.close()
+
+    def _array(self, index):
+        name, dtype, shape = self.arrays[index]
+        if self.archive is None:
+            filename = os.path.join(self.path, name)
+            size = arrays.dtype(dtype).itemsize
+            for dimension in shape:
+                size *= dimension
+            if size >= self.mmapThreshold:
+                return arrays.load(filename, mmap_mode='r')
+            value = arrays.load(filename)
+            value.setflags(write=False)
+            return value
+        info = self.archive.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            with self.archive.open(info) as member:
+                value = npyformat.read_array(member)
+            value.setflags(write=False)
+            return value
+        header = _FILE_HEADER.unpack_from(self.buffer, info.header_offset)
+        start = info.header_offset + _FILE_HEADER.size + header[10] + header[11]
+        with self.archive.open(info) as member:
+            version = npyformat.read_magic(member)
+            if version == (1, 0):
+                shape, fortran, dtype = npyformat.read_array_header_1_0(member)
+            else:
+                shape, fortran, dtype = npyformat.read_array_header_2_0(member)
+            start += member.tell()
+        count = 1
+        for dimension in shape:
+            count *= dimension
+        value = arrays.frombuffer(self.buffer, dtype, count, start)
+        return value.reshape(shape, order='F' if fortran else 'C')
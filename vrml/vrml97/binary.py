@@ -0,0 +1,596 @@
+"""Binary scene-graph format with memory-mapped array payloads
+
+The VRML97 text format (see vrml.vrml97.linearise) is slow to
+write and slow to re-parse for large worlds, as every number has
+to be converted to and from text.  The binary format stores:
+
+    the structure of the scene (prototypes, nodes, DEF/USE
+    sharing, routes and IS maps) as a small JSON table, with
+    one entry per prototype and node
+
+    the numeric values of MF fields of at least ARRAY_THRESHOLD
+    bytes (coordinates, colours, indices, etc.) as raw arrays,
+    each aligned to ALIGNMENT bytes, which the reader
+    memory-maps and wraps with numpy.frombuffer
+
+so loading costs roughly the number of nodes rather than the
+number of numbers in the world.
+
+File layout:
+
+    HEADER -- MAGIC, table offset, table length (little-endian)
+    array payloads, each starting on an ALIGNMENT boundary
+    table -- utf-8 encoded JSON, zlib-compressed unless the
+        writer's compression is 0
+
+The table has the keys:
+
+    version -- VERSION
+    arrays -- [(offset, dtype, shape)] for each payload
+    items -- prototypes and nodes in creation order (each
+        entry only refers to earlier entries), a prototype is
+        a dictionary with a 'PROTO' key, a node is a list
+        [prototype, {fieldName: value}] or, for Script nodes,
+        [prototype, {fieldName: value}, [declarations]]
+    scenes -- scene-graphs, the first is the root, the others
+        are prototype bodies
+
+Prototypes of nodes are referenced by item index, or by name for
+built-in node types (by "module:name" for built-in node types
+not in the base namespace).  SFNode/MFNode values are item
+indices (None for NULL), numeric array payloads are
+{'a': arrayIndex}, smaller MF arrays are {'l': nestedList,
+'t': dtype, 's': shape}, SF values and other values are stored
+as JSON values (single-precision floats with their shortest
+round-tripping text).
+
+Arrays loaded from a file are views onto a copy-on-write mapping
+of the file, modifying them in-place does not alter the file.
+"""
+
+from __future__ import unicode_literals
+
+import functools, importlib, json, mmap, struct, weakref, zlib
+from vrml import arrays, field, node, numberformat
+from vrml.protofunctions import *
+from vrml.vrml97 import script
+from .._bytes import unicode
+
+MAGIC = b'VRMLBIN\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sQQ')
+ALIGNMENT = 64
+# MF arrays smaller than this many bytes are stored in the table, as
+# padding each to ALIGNMENT would make them larger than their text
+ARRAY_THRESHOLD = 1024
+
+
+class _Reference(object):
+    """Index of a node whose entry is still being written (a cycle)"""
+
+    index = None
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _listValue(value):
+    """Nested list of array value's numbers for the table
+
+    Single-precision floats are converted through their shortest
+    round-tripping text, rather than written with the 17 digits
+    of their double-precision value, and integral floats are
+    written as integers ("1" rather than "1.0").
+    """
+    if value.dtype.kind != 'f':
+        return value.tolist()
+    if value.dtype.itemsize < 8:
+        strings = numberformat.formatArray(value, numberformat.SHORTEST)
+        value = arrays.array(strings, 'd').reshape(value.shape)
+    numbers = [
+        int(number) if number.is_integer() else number
+        for number in value.ravel().tolist()
+    ]
+    if value.ndim == 1:
+        return numbers
+    return arrays.array(numbers, object).reshape(value.shape).tolist()
+
+
+def _setField(prototype, declaration):
+    """Declare a Script field (as the parser does)"""
+    setattr(prototype, declaration.name, declaration)
+
+
+def write(value, file, **namedargs):
+    """Write the given scene-graph (or node) to file
+
+    file -- filename or binary file-like object (need not be seekable)
+    """
+    if isinstance(file, (str, unicode)):
+        with open(file, 'wb') as target:
+            return Writer(**namedargs).write(value, target)
+    return Writer(**namedargs).write(value, file)
+
+
+def read(source, **namedargs):
+    """Read a scene-graph from filename, file-like object or bytes
+
+    Files with a fileno are memory-mapped, other sources are
+    read into memory.
+    """
+    return Reader(**namedargs).read(source)
+
+
+class Writer(object):
+    """Collects the structure table and array payloads for a scene-graph"""
+
+    def __init__(
+        self, basePrototypes=None, arrayThreshold=ARRAY_THRESHOLD, compression=6
+    ):
+        """Initialise the writer
+
+        basePrototypes -- name: prototype mapping for built-in
+            node types, if None, uses
+            vrml.vrml97.basenamespaces.basePrototypes
+        arrayThreshold -- MF arrays of at least this many bytes
+            are written as payloads, smaller ones in the table
+        compression -- zlib level for the table written by write,
+            0 writes plain JSON
+        """
+        self.arrayThreshold = arrayThreshold
+        self.compression = compression
+        if basePrototypes is None:
+            from vrml.vrml97 import basenamespaces
+
+            basePrototypes = basenamespaces.basePrototypes
+        self.basePrototypes = basePrototypes
+        self.items = []
+        self.scenes = []
+        self.arrays = []
+        self.payloads = []
+        self.offset = _aligned(HEADER.size)
+        # id(node/prototype): item index
+        self.indices = {}
+        # id(node): _Reference for nodes being written
+        self.pending = {}
+        self.sceneStack = []
+
+    def write(self, value, file):
+        """Write value (a sceneGraph or node) to file"""
+        table = self.table(value)
+        if self.compression:
+            table = zlib.compress(table, self.compression)
+        file.write(HEADER.pack(MAGIC, self.offset, len(table)))
+        position = HEADER.size
+        for (offset, dtype, shape), payload in zip(self.arrays, self.payloads):
+            file.write(b'\x00' * (offset - position))
+            file.write(memoryview(payload).cast('B'))
+            position = offset + payload.nbytes
+        file.write(b'\x00' * (self.offset - position))
+        file.write(table)
+        return self.offset + len(table)
+
+    def table(self, value):
+        """Collect the payloads of value, return the encoded structure table"""
+        if protoName(value) == 'sceneGraph':
+            self._scene(value)
+        else:
+            # wrap bare nodes in a scene-graph
+            self.scenes.append({})
+            self.sceneStack.append(0)
+            try:
+                self.scenes[0].update(
+                    protos=[], children=[self._node(value)], routes=[], defs={}
+                )
+            finally:
+                self.sceneStack.pop()
+        return json.dumps(
+            {
+                'version': VERSION,
+                'arrays': self.arrays,
+                'items': self.items,
+                'scenes': self.scenes,
+            },
+            separators=(',', ':'),
+            default=lambda reference: reference.index,
+        ).encode('utf-8')
+
+    def _array(self, value):
+        """Register numeric array payload, return its index"""
+        value = arrays.ascontiguousarray(value)
+        index = len(self.arrays)
+        self.arrays.append((self.offset, value.dtype.str, list(value.shape)))
+        self.payloads.append(value)
+        self.offset = _aligned(self.offset + value.nbytes)
+        return index
+
+    def _value(self, field, value):
+        """Encode a field value for the table"""
+        typeName = field.typeName()
+        if typeName == 'SFNode':
+            return self._node(value)
+        elif typeName == 'MFNode':
+            return [self._node(item) for item in value or ()]
+        elif isinstance(value, arrays.ArrayType) and value.dtype.kind in 'biuf':
+            if typeName.startswith('SF'):
+                return _listValue(value)
+            elif value.nbytes < self.arrayThreshold:
+                return {
+                    'l': _listValue(value),
+                    't': value.dtype.str,
+                    's': list(value.shape),
+                }
+            return {'a': self._array(value)}
+        elif isinstance(value, arrays.generic):
+            return value.item()
+        elif isinstance(value, arrays.ArrayType):
+            return value.tolist()
+        elif isinstance(value, tuple):
+            return list(value)
+        return value
+
+    def _declaration(self, declaration):
+        """Encode a field/event declaration for the table"""
+        if isinstance(declaration, field.Event):
+            return [
+                'event',
+                declaration.typeName(),
+                declaration.name,
+                declaration.direction,
+            ]
+        return [
+            'field',
+            declaration.typeName(),
+            declaration.name,
+            declaration.exposure,
+            self._value(declaration, declaration.getDefault()),
+        ]
+
+    def _declarations(self, prototype):
+        """Field/event declarations made by prototype itself"""
+        return [
+            self._declaration(value)
+            for value in list(prototype.__dict__.values())
+            if isinstance(value, (field.Field, field.Event))
+        ]
+
+    def _prototype(self, prototype):
+        """Encode a reference to the prototype, writing it if necessary"""
+        if builtin(prototype):
+            key = protoName(prototype)
+            if self.basePrototypes.get(key) is prototype:
+                return key
+            return '%s:%s' % (prototype.__module__, prototype.__name__)
+        index = self.indices.get(id(prototype))
+        if index is None:
+            index = self._proto(prototype)
+        return index
+
+    def _proto(self, prototype):
+        """Write a (non-builtin) prototype declaration, return its item index"""
+        record = {
+            'PROTO': name(prototype),
+            'fields': self._declarations(prototype),
+        }
+        url = getExternalURL(prototype)
+        sceneGraph = getSceneGraph(prototype)
+        if url:
+            record['url'] = list(url)
+        elif sceneGraph:
+            record['scene'] = self._scene(sceneGraph)
+        record['ismaps'] = dict(
+            [
+                (
+                    key,
+                    [(self._node(target), fieldName) for target, fieldName in mappings],
+                )
+                for key, mappings in node.ismaps(prototype).items()
+            ]
+        )
+        index = self.indices[id(prototype)] = len(self.items)
+        self.items.append(record)
+        return index
+
+    def _node(self, clientNode):
+        """Write a node (if not yet written), return its item index"""
+        if clientNode is None or clientNode is node.NULL:
+            return None
+        key = id(clientNode)
+        index = self.indices.get(key)
+        if index is not None:
+            return index
+        if key in self.pending:
+            # e.g. a Script field USEing one of the Script's parents
+            return self.pending[key]
+        reference = self.pending[key] = _Reference()
+        try:
+            prototype = getPrototype(clientNode)
+            if issubclass(prototype, script._Script):
+                record = [protoName(prototype), {}, self._declarations(prototype)]
+            else:
+                record = [self._prototype(prototype), {}]
+            values = record[1]
+            for field in getFields(clientNode):
+                if field.name in clientNode.__dict__ and (
+                    field.name == ' DEF' or not field.name.startswith(' ')
+                ):
+                    values[field.name] = self._value(field, field.fget(clientNode))
+        finally:
+            del self.pending[key]
+        index = reference.index = self.indices[key] = len(self.items)
+        self.items.append(record)
+        return index
+
+    def _scene(self, sceneGraph):
+        """Write a scene-graph and its prototypes, return the scene index"""
+        index = len(self.scenes)
+        record = {'parent': self.sceneStack[-1] if self.sceneStack else None}
+        self.scenes.append(record)
+        self.sceneStack.append(index)
+        try:
+            record['protos'] = [
+                self._prototype(prototype)
+                for prototype in list(sceneGraph.protoTypes.values())
+                if isinstance(prototype, type)
+                and issubclass(prototype, node.Node)
+                and not builtin(prototype)
+            ]
+            record['children'] = [self._node(child) for child in sceneGraph.children]
+            record['routes'] = [
+                (
+                    self._node(route.source),
+                    route.sourceField,
+                    self._node(route.destination),
+                    route.destinationField,
+                )
+                for route in sceneGraph.routes
+            ]
+            record['defs'] = dict(
+                [
+                    (key, self._node(value))
+                    for key, value in sceneGraph.defNames.items()
+                    if key and value is not None
+                ]
+            )
+            record['baseURI'] = sceneGraph.baseURI
+        finally:
+            self.sceneStack.pop()
+        return index
+
+
+class Reader(object):
+    """Rebuilds a scene-graph from the binary format"""
+
+    def __init__(self, basePrototypes=None):
+        """Initialise the reader
+
+        basePrototypes -- see vrml.vrml97.parseprocessor.ParseProcessor
+        """
+        if basePrototypes is None:
+            from vrml.vrml97 import basenamespaces
+
+            basePrototypes = basenamespaces.basePrototypes.copy()
+        self.basePrototypes = basePrototypes
+
+    def read(self, source):
+        """Read the scene-graph from source (see read)"""
+        if isinstance(source, (str, unicode)):
+            with open(source, 'rb') as file:
+                return self.read(file)
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            buffer = bytearray(source)
+        else:
+            try:
+                fileno = source.fileno()
+            except (AttributeError, IOError, ValueError):
+                buffer = bytearray(source.read())
+            else:
+                buffer = mmap.mmap(fileno, 0, access=mmap.ACCESS_COPY)
+        magic, offset, length = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("""Not a binary VRML97 scene-graph: %r""" % (magic,))
+        self.buffer = buffer
+        return self.load(bytes(buffer[offset : offset + length]))
+
+    def load(self, table):
+        """Build the scene-graph from the encoded structure table"""
+        if table[:1] != b'{':
+            table = zlib.decompress(table)
+        table = json.loads(table.decode('utf-8'))
+        if table['version'] > VERSION:
+            raise ValueError(
+                """Unsupported binary VRML97 version %s""" % (table['version'],)
+            )
+        self.arrays = table['arrays']
+        self.sceneTable = table['scenes']
+        self.scenes = {}
+        self.objects = []
+        # prototype: {field.name: field}
+        self.fieldTables = {}
+        # (setter, typeName, value) for values referring to later entries
+        self.fixups = []
+        root = self._sceneGraph(0)
+        self.rootRef = weakref.ref(root)
+        for item in table['items']:
+            if isinstance(item, dict):
+                self.objects.append(self._proto(item))
+            else:
+                self.objects.append(self._node(*item))
+        for setter, typeName, value in self.fixups:
+            setter(self._value(typeName, value))
+        self._fill(0)
+        return root
+
+    def _sceneGraph(self, index):
+        """Get (creating if necessary) the scene-graph for index"""
+        current = self.scenes.get(index)
+        if current is None:
+            parent = self.sceneTable[index].get('parent')
+            if parent is None:
+                current = self.basePrototypes.get('sceneGraph')(
+                    protoTypes=self.basePrototypes,
+                )
+            else:
+                current = self.basePrototypes.get('sceneGraph')(
+                    root=self._sceneGraph(parent),
+                )
+            self.scenes[index] = current
+        return current
+
+    def _fill(self, index):
+        """Add the children, routes, DEFs and prototypes to a scene-graph"""
+        record = self.sceneTable[index]
+        sceneGraph = self._sceneGraph(index)
+        sceneGraph.baseURI = record.get('baseURI', '')
+        for proto in record['protos']:
+            sceneGraph.addProto(self._prototype(proto))
+        objects = self.objects
+        sceneGraph.children = [objects[child] for child in record['children']]
+        ROUTE = self.basePrototypes.get('ROUTE')
+        for source, sourceField, destination, destinationField in record['routes']:
+            sceneGraph.addRoute(
+                ROUTE(
+                    source=objects[source],
+                    sourceField=sourceField,
+                    destination=objects[destination],
+                    destinationField=destinationField,
+                )
+            )
+        for key, value in record['defs'].items():
+            sceneGraph.defNames[key] = objects[value]
+        return sceneGraph
+
+    def _array(self, index):
+        offset, dtype, shape = self.arrays[index]
+        dtype = arrays.dtype(dtype)
+        count = 1
+        for dimension in shape:
+            count *= dimension
+        return arrays.frombuffer(self.buffer, dtype, count, offset).reshape(shape)
+
+    def _value(self, typeName, value):
+        """Decode a field value of type typeName from the table"""
+        if typeName == 'SFNode':
+            if value is None:
+                return node.NULL
+            return self.objects[value]
+        elif typeName == 'MFNode':
+            objects = self.objects
+            return [objects[item] for item in value]
+        elif isinstance(value, dict):
+            if 'a' in value:
+                return self._array(value['a'])
+            return arrays.array(value['l'], value['t']).reshape(value['s'])
+        return value
+
+    def _forward(self, typeName, value):
+        """Does value refer to a node which has not yet been created?"""
+        if typeName == 'SFNode':
+            return value is not None and value >= len(self.objects)
+        elif typeName == 'MFNode':
+            count = len(self.objects)
+            for item in value:
+                if item >= count:
+                    return True
+        return False
+
+    def _set(self, setter, typeName, value):
+        """Call setter with the decoded value, now or once it is available"""
+        if self._forward(typeName, value):
+            self.fixups.append((setter, typeName, value))
+        else:
+            setter(self._value(typeName, value))
+
+    def _fieldTable(self, prototype):
+        """Get {field.name: field} for the prototype"""
+        table = self.fieldTables.get(prototype)
+        if table is None:
+            table = self.fieldTables[prototype] = dict(
+                [(field.name, field) for field in getFields(prototype)]
+            )
+        return table
+
+    def _declare(self, prototype, record, add=addField):
+        """Add a field/event from its table declaration to prototype"""
+        if record[0] == 'event':
+            kind, typeName, fieldName, direction = record
+            return add(prototype, field.newEvent(fieldName, typeName, direction))
+        kind, typeName, fieldName, exposure, default = record
+
+        def declare(default):
+            add(prototype, field.newField(fieldName, typeName, exposure, default))
+
+        if self._forward(typeName, default):
+            # re-declared with the default once the node is available
+            add(prototype, field.newField(fieldName, typeName, exposure))
+        self._set(declare, typeName, default)
+
+    def _prototype(self, reference):
+        """Resolve a prototype reference"""
+        if isinstance(reference, int):
+            return self.objects[reference]
+        prototype = self.basePrototypes.get(reference)
+        if prototype is None and ':' in reference:
+            module, className = reference.split(':')
+            prototype = getattr(importlib.import_module(module), className)
+        if prototype is None:
+            raise NameError("""Prototype %s is not available""" % (reference,))
+        return prototype
+
+    def _proto(self, record):
+        """Create a prototype from its table entry"""
+        proto = node.prototype(record['PROTO'])
+        for declaration in record['fields']:
+            self._declare(proto, declaration)
+        if 'url' in record:
+            setExternalURL(proto, record['url'])
+        elif 'scene' in record:
+            setSceneGraph(proto, self._fill(record['scene']))
+        mappings = node.ismaps(proto)
+        objects = self.objects
+        for key, targets in record['ismaps'].items():
+            mappings[key] = [
+                (objects[target], fieldName) for target, fieldName in targets
+            ]
+        return proto
+
+    def _node(self, prototype, values, declarations=None):
+        """Create a node from its table entry"""
+        if declarations is not None:
+            newNode = self.basePrototypes.get('Script')(())
+            prototype = newNode.__class__
+            for declaration in declarations:
+                self._declare(prototype, declaration, _setField)
+        else:
+            prototype = self._prototype(prototype)
+            if not builtin(prototype):
+                # prototyped nodes get IS-value updates
+                newNode = prototype()
+                root(newNode, self.rootRef())
+                fields = self._fieldTable(prototype)
+                for key, value in values.items():
+                    target = fields[key]
+                    self._set(
+                        functools.partial(target.fset, newNode),
+                        target.typeName(),
+                        value,
+                    )
+                return newNode
+            newNode = prototype.__new__(prototype)
+        # as for node.Node.copy, the values are already of the correct types
+        dictionary = newNode.__dict__
+        fields = self._fieldTable(prototype)
+        for key, value in values.items():
+            target = fields[key]
+            typeName = target.typeName()
+            if isinstance(value, list) and typeName.startswith('SF'):
+                # SF arrays are stored as plain lists
+                value = target.coerce(value)
+            self._set(
+                functools.partial(dictionary.__setitem__, key),
+                typeName,
+                value,
+            )
+        dictionary[' root'] = self.rootRef
+        return newNode
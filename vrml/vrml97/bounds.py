@@ -0,0 +1,415 @@
+"""Axis-aligned bounding boxes for VRML97 nodes and scene-graphs
+
+Bounds are (2,3) double arrays of (minimum,maximum) corners, or
+None for nodes which have no geometry (lights, sensors, empty
+groups, an IndexedFaceSet without a coord...).
+
+localBounds(node) -- bounds in the node's own coordinate system,
+    for a Transform that is the coordinate system of its children
+    (the space in which its bboxCenter/bboxSize are declared)
+worldBounds(path) -- bounds of the last node of a
+    vrml.vrml97.nodepath.NodePath in the path's root coordinates
+sceneBounds(sceneGraph) -- bounds of a whole scene-graph
+
+Geometry bounds are exact (calculated from the coordinates
+actually referenced), grouping nodes take the union of their
+children's bounds, transformed by the children's local matrices.
+
+The local bounds of each node are memoized in vrml.cache.CACHE,
+the holder for a node is cleared when the fields it was
+calculated from change, and clearing a node's bounds clears the
+bounds of the nodes containing it (see BoundsHolder), so after
+an edit only the edited node's ancestors are re-calculated.
+
+GEOMETRY maps geometry node protoNames to (function, fields),
+where function(node) calculates the node's bounds and fields
+are the names of the fields on which the result depends, add
+entries to support other geometry types.
+
+Note:
+    as with vrml.cache, only notifications are tracked, modifying
+    an MFNode list or an array in-place will not invalidate the
+    memoized bounds
+
+    Text nodes have no bounds (font metrics are not available),
+    Inline nodes use their declared bboxCenter/bboxSize, and the
+    bounds of a Billboard enclose every rotation of its children
+"""
+
+from __future__ import unicode_literals
+
+from vrml import arrays, cache, node
+from vrml.protofunctions import *
+from vrml.vrml97 import nodepath, nodetypes, transformmatrix
+
+CACHE_KEY = 'localBounds'
+# Transform fields affecting the local matrix of a child
+MATRIX_FIELDS = ('translation', 'center', 'scale', 'scaleOrientation', 'rotation')
+
+
+class BoundsHolder(cache.DependentHolder):
+    """CacheHolder for bounds which also clears the bounds containing them
+
+    dependents -- the BoundsHolders of nodes whose bounds include
+        our client's bounds
+    """
+
+
+def box(minimum, maximum):
+    """Create bounds from minimum and maximum corners"""
+    return arrays.array([minimum, maximum], 'd')
+
+
+def pointBounds(points):
+    """Bounds of the (N,3) points, None if there are no points"""
+    points = arrays.asarray(points).reshape((-1, 3))
+    if not len(points):
+        return None
+    return box(points.min(axis=0), points.max(axis=0))
+
+
+def union(boxes):
+    """Bounds enclosing each of boxes (an (N,2,3) array or list of bounds)
+
+    None entries in a list of bounds are ignored, returns None if
+    there are no (non-None) boxes
+    """
+    if not isinstance(boxes, arrays.ArrayType):
+        boxes = [item for item in boxes if item is not None]
+        if not boxes:
+            return None
+        boxes = arrays.asarray(boxes)
+    if not len(boxes):
+        return None
+    return box(boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0))
+
+
+def declaredBounds(clientNode):
+    """Bounds declared by clientNode's bboxCenter/bboxSize (or None)"""
+    size = clientNode.__dict__.get('bboxSize')
+    if size is None or arrays.any(arrays.asarray(size) < 0):
+        return None
+    center = arrays.asarray(clientNode.bboxCenter, 'd')
+    half = arrays.asarray(size, 'd') * 0.5
+    return box(center - half, center + half)
+
+
+def boxBounds(geometry):
+    """Bounds of a Box"""
+    half = arrays.asarray(geometry.size, 'd') * 0.5
+    return box(-half, half)
+
+
+def sphereBounds(geometry):
+    """Bounds of a Sphere"""
+    radius = abs(geometry.radius)
+    return box((-radius,) * 3, (radius,) * 3)
+
+
+def coneBounds(geometry):
+    """Bounds of a Cone (None if neither side nor bottom is drawn)"""
+    radius, half = abs(geometry.bottomRadius), abs(geometry.height) * 0.5
+    if geometry.side:
+        return box((-radius, -half, -radius), (radius, half, radius))
+    elif geometry.bottom:
+        return box((-radius, -half, -radius), (radius, -half, radius))
+    return None
+
+
+def cylinderBounds(geometry):
+    """Bounds of a Cylinder (None if no part is drawn)"""
+    radius, half = abs(geometry.radius), abs(geometry.height) * 0.5
+    heights = []
+    if geometry.side or geometry.bottom:
+        heights.append(-half)
+    if geometry.side or geometry.top:
+        heights.append(half)
+    if not heights:
+        return None
+    return box((-radius, min(heights), -radius), (radius, max(heights), radius))
+
+
+def _points(geometry):
+    """The coord node's points for geometry (or None)"""
+    coord = geometry.coord
+    if not coord:
+        return None
+    return arrays.asarray(coord.point).reshape((-1, 3))
+
+
+def indexedBounds(geometry):
+    """Bounds of the points referenced by an IndexedFaceSet/IndexedLineSet"""
+    points = _points(geometry)
+    if points is None or not len(points):
+        return None
+    index = arrays.asarray(geometry.coordIndex, 'i').ravel()
+    index = index[(index >= 0) & (index < len(points))]
+    if not len(index):
+        return None
+    used = arrays.zeros(len(points), bool)
+    used[index] = True
+    if used.all():
+        return pointBounds(points)
+    return pointBounds(points[used])
+
+
+def pointSetBounds(geometry):
+    """Bounds of a PointSet"""
+    points = _points(geometry)
+    if points is None:
+        return None
+    return pointBounds(points)
+
+
+def elevationGridBounds(geometry):
+    """Bounds of an ElevationGrid (None if it has fewer than 2x2 heights)"""
+    xDimension, zDimension = geometry.xDimension, geometry.zDimension
+    height = arrays.asarray(geometry.height, 'd').ravel()[: xDimension * zDimension]
+    if xDimension < 2 or zDimension < 2 or len(height) < xDimension * zDimension:
+        return None
+    corners = arrays.array(
+        [
+            ((xDimension - 1) * geometry.xSpacing, height.min(), 0.0),
+            (0.0, height.max(), (zDimension - 1) * geometry.zSpacing),
+        ],
+        'd',
+    )
+    return box(corners.min(axis=0), corners.max(axis=0))
+
+
+def _unit(vectors):
+    """(unit vectors, mask of non-null vectors) for (N,3) vectors"""
+    lengths = arrays.sqrt(arrays.sum(vectors * vectors, axis=1))
+    valid = lengths > 1e-12
+    return vectors / arrays.where(valid, lengths, 1.0)[:, arrays.newaxis], valid
+
+
+def _fill(vectors, valid):
+    """Replace invalid vectors with the previous (else next) valid vector"""
+    if valid.all() or not valid.any():
+        return vectors
+    indices = arrays.arange(len(vectors))
+    previous = arrays.maximum.accumulate(arrays.where(valid, indices, -1))
+    following = arrays.minimum.accumulate(
+        arrays.where(valid, indices, len(vectors))[::-1]
+    )[::-1]
+    return vectors[arrays.where(previous >= 0, previous, following)]
+
+
+def spineFrames(spine):
+    """Spine-aligned cross-section planes (SCP) of an Extrusion's spine
+
+    Calculates the X, Y and Z axes of the SCP at every spine
+    point at once, following the VRML97 specification (including
+    the closed spine, collinear spine and Z-flipping rules).
+
+    returns (S,3,3) array with rows X, Y and Z for each spine point
+    """
+    spine = arrays.asarray(spine, 'd').reshape((-1, 3))
+    count = len(spine)
+    frames = arrays.zeros((count, 3, 3), 'd')
+    frames[:] = arrays.identity(3, 'd')
+    if count < 2:
+        return frames
+    closed = count > 2 and arrays.array_equal(spine[0], spine[-1])
+    y = arrays.empty((count, 3), 'd')
+    z = arrays.zeros((count, 3), 'd')
+    y[1:-1] = spine[2:] - spine[:-2]
+    z[1:-1] = arrays.cross(spine[2:] - spine[1:-1], spine[:-2] - spine[1:-1])
+    if closed:
+        y[0] = y[-1] = spine[1] - spine[-2]
+        z[0] = z[-1] = arrays.cross(spine[1] - spine[0], spine[-2] - spine[0])
+    else:
+        y[0] = spine[1] - spine[0]
+        y[-1] = spine[-1] - spine[-2]
+        if count > 2:
+            z[0] = z[1]
+            z[-1] = z[-2]
+    y, valid = _unit(y)
+    y = _fill(y, valid)
+    if not valid.any():
+        # every spine point is coincident
+        return frames
+    z, valid = _unit(z)
+    if valid.any():
+        z = _fill(z, valid)
+        flips = arrays.where(arrays.sum(z[1:] * z[:-1], axis=1) < 0, -1.0, 1.0)
+        z *= arrays.concatenate(([1.0], arrays.cumprod(flips)))[:, arrays.newaxis]
+        frames[:, 0] = arrays.cross(y, z)
+        frames[:, 1] = y
+        frames[:, 2] = z
+        return frames
+    # collinear spine, rotate the standard axes taking +Y onto y
+    axis = arrays.column_stack((y[:, 2], arrays.zeros(count), -y[:, 0]))
+    null = arrays.sum(axis * axis, axis=1) < 1e-24
+    axis[null] = (1, 0, 0)
+    angles = arrays.arccos(arrays.clip(y[:, 1], -1.0, 1.0))
+    rotations = transformmatrix.rotMatrices(
+        arrays.column_stack((axis, angles))
+    )[0]
+    return rotations[:, :3, :3].copy()
+
+
+def _perSpine(values, count, default):
+    """Expand per-spine-point values to count rows (the last is repeated)"""
+    values = arrays.asarray(values, 'd')
+    if not values.size:
+        values = arrays.asarray(default, 'd')
+    values = values.reshape((-1, len(default)))
+    return values[arrays.minimum(arrays.arange(count), len(values) - 1)]
+
+
+def extrusionPoints(geometry):
+    """Calculate the (S,C,3) vertices of an Extrusion's cross-sections"""
+    spine = arrays.asarray(geometry.spine, 'd').reshape((-1, 3))
+    section = arrays.asarray(geometry.crossSection, 'd').reshape((-1, 2))
+    count = len(spine)
+    scale = _perSpine(geometry.scale, count, (1.0, 1.0))
+    orientation = _perSpine(geometry.orientation, count, (0.0, 0.0, 1.0, 0.0))
+    local = arrays.zeros((count, len(section), 3), 'd')
+    local[..., 0] = section[:, 0] * scale[:, 0:1]
+    local[..., 2] = section[:, 1] * scale[:, 1:2]
+    rotations = transformmatrix.rotMatrices(orientation)[0][:, :3, :3]
+    local = arrays.matmul(arrays.matmul(local, rotations), spineFrames(spine))
+    return local + spine[:, arrays.newaxis, :]
+
+
+def extrusionBounds(geometry):
+    """Bounds of an Extrusion"""
+    return pointBounds(extrusionPoints(geometry))
+
+
+GEOMETRY = {
+    'Box': (boxBounds, ('size',)),
+    'Sphere': (sphereBounds, ('radius',)),
+    'Cone': (coneBounds, ('bottomRadius', 'height', 'side', 'bottom')),
+    'Cylinder': (cylinderBounds, ('radius', 'height', 'side', 'top', 'bottom')),
+    'IndexedFaceSet': (indexedBounds, ('coord', 'coordIndex')),
+    'IndexedLineSet': (indexedBounds, ('coord', 'coordIndex')),
+    'PointSet': (pointSetBounds, ('coord',)),
+    'ElevationGrid': (
+        elevationGridBounds,
+        ('height', 'xDimension', 'zDimension', 'xSpacing', 'zSpacing'),
+    ),
+    'Extrusion': (
+        extrusionBounds,
+        ('crossSection', 'spine', 'scale', 'orientation'),
+    ),
+}
+
+
+def localBounds(clientNode):
+    """Get the (cached) bounds of clientNode in its own coordinate system"""
+    holder = cache.CACHE.getHolder(clientNode, key=CACHE_KEY)
+    if holder is not None and holder.data is not None:
+        return holder.data[0]
+    if holder is None:
+        holder = BoundsHolder(clientNode, None, CACHE_KEY, cache.CACHE)
+    # data is (bounds,) as bounds may be None
+    holder.data = (_calculate(clientNode, holder),)
+    return holder.data[0]
+
+
+def _child(holder, child):
+    """Bounds of child, registering holder (if not None) as dependent on them"""
+    result = localBounds(child)
+    childHolder = cache.CACHE.getHolder(child, key=CACHE_KEY)
+    if holder is not None and childHolder is not None:
+        childHolder.dependents.add(holder)
+    return result
+
+
+def _children(holder, children):
+    """Union of the bounds of children in their parent's coordinate system
+
+    holder -- BoundsHolder of the parent, or None to not track
+        dependencies
+    """
+    boxes, matrices = [], []
+    for child in children:
+        if not isinstance(child, node.Node) or child is node.NULL:
+            continue
+        bounds = _child(holder, child)
+        if bounds is None:
+            continue
+        transforming = isinstance(child, nodetypes.Transforming)
+        if transforming and protoName(child) != 'Billboard':
+            if holder is not None:
+                for fieldName in MATRIX_FIELDS:
+                    holder.depend(child, fieldName)
+            matrix = child.localMatrices().data[0]
+            if matrix is not None:
+                boxes.append(bounds)
+                matrices.append(matrix)
+                continue
+        boxes.append(bounds)
+        matrices.append(arrays.identity(4, 'd'))
+    if not boxes:
+        return None
+    return union(
+        transformmatrix.transformBounds(arrays.asarray(boxes), arrays.asarray(matrices))
+    )
+
+
+def _calculate(clientNode, holder):
+    """Calculate the bounds of clientNode, setting up holder's dependencies"""
+    if isinstance(clientNode, node.PrototypedNode):
+        # only the first node of a PROTO's body is rendered
+        return _children(holder, clientNode.renderedChildren()[:1])
+    name = protoName(clientNode)
+    if name in GEOMETRY:
+        function, fieldNames = GEOMETRY[name]
+        for fieldName in fieldNames:
+            holder.depend(clientNode, fieldName)
+        coord = clientNode.__dict__.get('coord')
+        if coord:
+            holder.depend(coord, 'point')
+        return function(clientNode)
+    elif name == 'Shape':
+        holder.depend(clientNode, 'geometry')
+        geometry = clientNode.geometry
+        if not geometry:
+            return None
+        return _child(holder, geometry)
+    elif name == 'Inline':
+        holder.depend(clientNode, 'bboxCenter')
+        holder.depend(clientNode, 'bboxSize')
+        return declaredBounds(clientNode)
+    elif name == 'Switch':
+        holder.depend(clientNode, 'choice')
+        holder.depend(clientNode, 'whichChoice')
+        choice, which = clientNode.choice, clientNode.whichChoice
+        if 0 <= which < len(choice):
+            return _children(holder, choice[which : which + 1])
+        return None
+    elif isinstance(clientNode, nodetypes.Traversable):
+        for fieldName in nodepath.CHILD_FIELDS:
+            if hasattr(type(clientNode), fieldName):
+                holder.depend(clientNode, fieldName)
+        bounds = _children(holder, nodepath.childNodes(clientNode))
+        if bounds is not None and name == 'Billboard':
+            # the box enclosing the bounds rotated about any axis, the
+            # farthest corner takes the largest extent on each axis
+            extent = arrays.absolute(bounds).max(axis=0)
+            radius = arrays.sqrt(arrays.sum(extent * extent))
+            bounds = box((-radius,) * 3, (radius,) * 3)
+        return bounds
+    return None
+
+
+def worldBounds(path):
+    """Bounds of path's last node in the path's root coordinate system
+
+    path -- vrml.vrml97.nodepath.NodePath, the path's matrix
+        (including the last node's own transform) is applied to
+        the node's localBounds
+    """
+    bounds = localBounds(path[-1])
+    if bounds is None:
+        return None
+    return path.transformBounds(bounds)
+
+
+def sceneBounds(sceneGraph):
+    """Bounds of the children of sceneGraph (not cached)"""
+    return _children(None, sceneGraph.children)
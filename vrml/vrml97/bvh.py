@@ -0,0 +1,462 @@
+"""Bounding-volume hierarchies for spatial queries on scene-graphs
+
+BVH -- hierarchy over an (N,2,3) array of axis-aligned boxes
+    (see vrml.vrml97.bounds), stored in flat arrays so that
+    building, refitting and querying work on whole levels of the
+    tree at once rather than node-by-node
+SceneBVH -- BVH over the world-space bounds of every Shape in a
+    scene-graph, refitted incrementally as Transforms move and
+    geometry changes
+
+The tree is built top-down one level at a time, each node's
+items being partitioned with a binned surface area heuristic
+(SAH) or at the median centroid along the node's longest axis.
+
+Queries (overlapping, near, traverse) descend the tree a level
+at a time, testing every node of the frontier with one array
+operation, and return the indices of the items whose own boxes
+pass the test.
+"""
+
+from __future__ import unicode_literals
+
+from vrml import arrays, cache
+from vrml.vrml97 import bounds, nodepath, nodetypes, transformmatrix
+
+# empty boxes never overlap or contain anything
+EMPTY = arrays.array([(arrays.inf,) * 3, (-arrays.inf,) * 3], 'd')
+
+
+def _ranges(starts, counts):
+    """Concatenate the index ranges [start,start+count) for each range"""
+    total = int(counts.sum())
+    offsets = arrays.cumsum(counts) - counts
+    return arrays.arange(total) + arrays.repeat(starts - offsets, counts)
+
+
+def _areas(boxes):
+    """Surface areas of (...,2,3) boxes, 0 for empty boxes"""
+    extent = boxes[..., 1, :] - boxes[..., 0, :]
+    extent = arrays.where(extent > 0, extent, 0.0)
+    x, y, z = extent[..., 0], extent[..., 1], extent[..., 2]
+    return 2.0 * (x * y + y * z + z * x)
+
+
+class BVH(object):
+    """Bounding-volume hierarchy over (N,2,3) boxes in flat arrays
+
+    boxes -- (N,2,3) double array of item boxes
+    bounds -- (M,2,3) bounds of each node, node 0 is the root
+    children -- (M,2) (left,right) child nodes, -1 for leaves
+    parents -- (M,) parent node, -1 for the root
+    depths -- (M,) depth of each node (the root is 0)
+    starts, counts -- (M,) range of each node's items in order
+    order -- (N,) item indices, each node's items being contiguous
+    itemLeaves -- (N,) leaf node holding each item
+    """
+
+    def __init__(self, boxes, leafSize=4, method='sah', bins=16):
+        """Build the hierarchy
+
+        boxes -- (N,2,3) array of item boxes
+        leafSize -- nodes with at most this many items are leaves
+        method -- 'sah' for binned surface area heuristic splits,
+            or 'median' for median splits along the longest axis
+        bins -- number of bins per axis for 'sah'
+        """
+        if method not in ('sah', 'median'):
+            raise ValueError('Unknown BVH build method: %r' % (method,))
+        self.boxes = arrays.array(boxes, 'd').reshape((-1, 2, 3))
+        self.leafSize = max(int(leafSize), 1)
+        self.method = method
+        self.bins = max(int(bins), 2)
+        self.build()
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def build(self):
+        """Build the tree over self.boxes (top-down, one level at a time)"""
+        count = len(self.boxes)
+        capacity = max(2 * count - 1, 1)
+        starts = arrays.zeros(capacity, 'l')
+        counts = arrays.zeros(capacity, 'l')
+        parents = arrays.full(capacity, -1, 'l')
+        depths = arrays.zeros(capacity, 'l')
+        children = arrays.full((capacity, 2), -1, 'l')
+        counts[0] = count
+        order = arrays.arange(count)
+        centroids = self.boxes.sum(axis=1) * 0.5
+        total = 1
+        active = arrays.array([0], 'l')
+        while len(active):
+            active = active[counts[active] > self.leafSize]
+            if not len(active):
+                break
+            positions = _ranges(starts[active], counts[active])
+            segments = arrays.repeat(arrays.arange(len(active)), counts[active])
+            items = order[positions]
+            key, left = self.split(items, segments, counts[active], centroids)
+            items = items[arrays.argsort(segments + key)]
+            order[positions] = items
+            new = total + 2 * arrays.arange(len(active))
+            total += 2 * len(active)
+            children[active, 0] = new
+            children[active, 1] = new + 1
+            for offset, first, size in (
+                (0, starts[active], left),
+                (1, starts[active] + left, counts[active] - left),
+            ):
+                starts[new + offset] = first
+                counts[new + offset] = size
+                parents[new + offset] = active
+                depths[new + offset] = depths[active] + 1
+            active = arrays.concatenate((new, new + 1))
+        self.starts, self.counts = starts[:total], counts[:total]
+        self.parents, self.depths = parents[:total], depths[:total]
+        self.children = children[:total]
+        self.order = order
+        self.bounds = arrays.empty((total, 2, 3), 'd')
+        self.bounds[:] = EMPTY
+        self.leaves = arrays.flatnonzero(self.children[:, 0] < 0)
+        self.itemLeaves = arrays.empty(count, 'l')
+        self.itemLeaves[self.nodeItems(self.leaves)] = arrays.repeat(
+            self.leaves, self.counts[self.leaves]
+        )
+        self.refit()
+
+    def split(self, items, segments, counts, centroids):
+        """Choose how to partition each segment's items
+
+        items -- item indices of the segments being split
+        segments -- segment index for each of items
+        counts -- (S,) number of items in each segment
+
+        Segments with more items than there are bins use SAH splits
+        (if method is 'sah'), smaller segments (where the SAH makes
+        little difference) and segments without a usable SAH split
+        (e.g. coincident centroids) are split at the median.
+
+        returns (key, left) where key is in [0,1) and sorting items
+        by segments + key places the left-hand items of segment s
+        in its first left[s] positions
+        """
+        centroid = centroids[items]
+        offsets = arrays.cumsum(counts) - counts
+        low = arrays.minimum.reduceat(centroid, offsets)
+        extent = arrays.maximum.reduceat(centroid, offsets) - low
+        span = arrays.where(extent > 0, extent, 1.0)
+        # median split along the longest axis
+        axis = arrays.argmax(extent, axis=1)[segments]
+        key = centroid[arrays.arange(len(items)), axis] - low[segments, axis]
+        key *= 0.5 / span[segments, axis]
+        left = counts // 2
+        if self.method != 'sah':
+            return key, left
+        large = counts > self.bins
+        if not arrays.any(large):
+            return key, left
+        selected = arrays.flatnonzero(large[segments])
+        renumbered = (arrays.cumsum(large) - 1)[segments[selected]]
+        right, sahLeft = self._sah(
+            items[selected],
+            renumbered,
+            counts[large],
+            centroid[selected] - low[segments[selected]],
+            span[large],
+        )
+        usable = sahLeft > 0
+        split = usable[renumbered]
+        key[selected[split]] = right[split] * 0.5 + 0.25
+        left[arrays.flatnonzero(large)[usable]] = sahLeft[usable]
+        return key, left
+
+    def _sah(self, items, segments, counts, offsets, extent):
+        """Binned SAH split of each segment's items
+
+        offsets -- position of each item's centroid relative to
+            the minimum centroid of its segment
+        extent -- (S,3) extent of each segment's centroids (non-zero)
+
+        returns ((N,) bool, true for items on the right-hand side,
+        (S,) number of items on the left-hand side, 0 where there
+        is no usable split)
+        """
+        count, bins = len(counts), self.bins
+        scale = bins / extent
+        binned = arrays.clip((offsets * scale[segments]).astype('l'), 0, bins - 1)
+        # (segment, axis, bin) cell of each item on each axis
+        cells = (segments[:, arrays.newaxis] * 3 + arrays.arange(3)) * bins + binned
+        size = count * 3 * bins
+        binCounts = arrays.bincount(cells.ravel(), minlength=size)
+        binCounts = binCounts.reshape((count, 3, bins))
+        binBoxes = arrays.empty((2, 3, size), 'd')
+        binBoxes[:] = EMPTY[:, :, arrays.newaxis]
+        # ufunc.at is far faster with contiguous one-dimensional operands
+        cells = arrays.ascontiguousarray(cells.T)
+        boxes = arrays.ascontiguousarray(self.boxes[items].transpose((1, 2, 0)))
+        for axis in range(3):
+            for coordinate in range(3):
+                for side, function in ((0, arrays.minimum), (1, arrays.maximum)):
+                    function.at(
+                        binBoxes[side, coordinate], cells[axis], boxes[side, coordinate]
+                    )
+        binBoxes = binBoxes.transpose((2, 0, 1)).reshape((count, 3, bins, 2, 3))
+        below = binBoxes.copy()
+        above = binBoxes[:, :, ::-1].copy()
+        for accumulated in (below, above):
+            arrays.minimum.accumulate(
+                accumulated[..., 0, :], axis=2, out=accumulated[..., 0, :]
+            )
+            arrays.maximum.accumulate(
+                accumulated[..., 1, :], axis=2, out=accumulated[..., 1, :]
+            )
+        above = above[:, :, ::-1]
+        belowCounts = arrays.cumsum(binCounts, axis=2)[:, :, :-1]
+        aboveCounts = counts[:, arrays.newaxis, arrays.newaxis] - belowCounts
+        # cost of splitting after each bin
+        costs = _areas(below[:, :, :-1]) * belowCounts
+        costs += _areas(above[:, :, 1:]) * aboveCounts
+        costs[(belowCounts == 0) | (aboveCounts == 0)] = arrays.inf
+        costs = costs.reshape((count, -1))
+        best = arrays.argmin(costs, axis=1)
+        segmentRange = arrays.arange(count)
+        left = belowCounts.reshape((count, -1))[segmentRange, best]
+        left[~arrays.isfinite(costs[segmentRange, best])] = 0
+        bestAxis, bestBin = best // (bins - 1), best % (bins - 1)
+        right = binned[arrays.arange(len(items)), bestAxis[segments]]
+        right = right > bestBin[segments]
+        return right, left
+
+    def refit(self, items=None):
+        """Recalculate node bounds after changes to self.boxes
+
+        items -- indices of the changed items, if specified only
+            the leaves holding them and their ancestors are
+            recalculated, otherwise the whole tree is
+        """
+        if items is None:
+            leaves = self.leaves
+        else:
+            leaves = arrays.unique(self.itemLeaves[arrays.asarray(items, 'l')])
+        if not len(leaves):
+            return
+        counts = self.counts[leaves]
+        positions = _ranges(self.starts[leaves], counts)
+        boxes = self.boxes[self.order[positions]]
+        used = counts > 0
+        if arrays.any(used):
+            offsets = (arrays.cumsum(counts) - counts)[used]
+            self.bounds[leaves[used], 0] = arrays.minimum.reduceat(boxes[:, 0], offsets)
+            self.bounds[leaves[used], 1] = arrays.maximum.reduceat(boxes[:, 1], offsets)
+        # every ancestor of the changed leaves, deepest first
+        ancestors = []
+        current = leaves
+        while len(current):
+            current = arrays.unique(self.parents[current])
+            current = current[current >= 0]
+            ancestors.append(current)
+        ancestors = arrays.unique(arrays.concatenate(ancestors))
+        depths = self.depths[ancestors]
+        for depth in arrays.unique(depths)[::-1]:
+            nodes = ancestors[depths == depth]
+            first, second = self.bounds[self.children[nodes].T]
+            self.bounds[nodes, 0] = arrays.minimum(first[:, 0], second[:, 0])
+            self.bounds[nodes, 1] = arrays.maximum(first[:, 1], second[:, 1])
+
+    def nodeItems(self, nodes):
+        """Get the indices of the items under each of the given nodes"""
+        nodes = arrays.asarray(nodes, 'l')
+        return self.order[_ranges(self.starts[nodes], self.counts[nodes])]
+
+    def traverse(self, test):
+        """Find the items whose boxes pass test
+
+        test -- callable taking a (K,2,3) array of boxes and
+            returning a (K,) boolean array, it must be true for
+            any box enclosing a box for which it is true (e.g.
+            an overlap or distance test)
+
+        returns sorted array of item indices
+        """
+        if not len(self.boxes):
+            return arrays.zeros(0, 'l')
+        found = []
+        frontier = arrays.array([0], 'l')
+        while len(frontier):
+            frontier = frontier[test(self.bounds[frontier])]
+            leaf = self.children[frontier, 0] < 0
+            leaves = frontier[leaf]
+            if len(leaves):
+                items = self.nodeItems(leaves)
+                found.append(items[test(self.boxes[items])])
+            frontier = self.children[frontier[~leaf]].ravel()
+        if not found:
+            return arrays.zeros(0, 'l')
+        return arrays.sort(arrays.concatenate(found))
+
+    def overlapping(self, box):
+        """Find the items whose boxes overlap the (2,3) box"""
+        box = arrays.asarray(box, 'd')
+
+        def test(boxes):
+            return arrays.all(boxes[:, 0] <= box[1], axis=1) & arrays.all(
+                boxes[:, 1] >= box[0], axis=1
+            )
+
+        return self.traverse(test)
+
+    def near(self, point, distance):
+        """Find the items whose boxes are within distance of point"""
+        point = arrays.asarray(point, 'd')
+        limit = distance * distance
+
+        def test(boxes):
+            offset = arrays.maximum(boxes[:, 0] - point, 0.0) + arrays.maximum(
+                point - boxes[:, 1], 0.0
+            )
+            return arrays.sum(offset * offset, axis=1) <= limit
+
+        return self.traverse(test)
+
+
+class _Watcher(object):
+    """Notes changes to the bounds of a SceneBVH leaf's Shape
+
+    Registered as a dependent of the Shape's bounds.BoundsHolder,
+    which calls clear() when the Shape's bounds change.
+    """
+
+    __slots__ = ('changed', 'index', '__weakref__')
+
+    def __init__(self, changed, index):
+        self.changed = changed
+        self.index = index
+
+    def clear(self, signal=None, sender=None):
+        self.changed.add(self.index)
+
+
+class SceneBVH(object):
+    """BVH over the world-space bounds of the Shapes in a scene-graph
+
+    Uses a nodepath.TransformHierarchy to track the world matrix
+    of each Shape, update() refits the tree for the Shapes whose
+    Transforms have moved or whose bounds have changed, and
+    rebuilds it if the hierarchy's structure has changed.
+
+    paths -- list of node lists from root to each Shape (leaf),
+        a Shape which is USEd has one leaf per path
+    shapes -- the Shape of each leaf
+    local, world -- (L,2,3) local and world bounds of each leaf,
+        (see EMPTY for Shapes without bounds)
+    tree -- BVH over the world bounds of the non-empty leaves
+    items -- (T,) leaf index of each of the tree's items
+
+    Note:
+        the hierarchy belongs to the SceneBVH, as a matrix
+        calculated through it (e.g. with transformMatrix) is no
+        longer seen as dirty by update()
+    """
+
+    def __init__(self, root, leafSize=4, method='sah', pathClass=nodepath.NodePath):
+        """Build the hierarchy for root (SceneGraph or grouping node)"""
+        self.leafSize = leafSize
+        self.method = method
+        self.pathClass = pathClass
+        self.hierarchy = nodepath.TransformHierarchy(
+            root, pathClass=pathClass, leafTypes=(nodetypes.Rendering,)
+        )
+        self.rebuild()
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def rebuild(self):
+        """Rebuild the tree for the current scene structure"""
+        paths, forward, inverse = self.hierarchy.update()
+        leaves = self.hierarchy.leaves
+        self.paths = [path for path, parent in leaves]
+        self.shapes = [path[-1] for path in self.paths]
+        self.transforms = arrays.array([parent for path, parent in leaves], 'l')
+        self.changed = set()
+        self.watchers = [None] * len(self.shapes)
+        self.local = arrays.empty((len(self.shapes), 2, 3), 'd')
+        self.local[:] = EMPTY
+        self.localBounds(range(len(self.shapes)))
+        self.world = self.worldBounds(arrays.arange(len(self.shapes)), forward)
+        self.items = arrays.flatnonzero(self.local[:, 0, 0] <= self.local[:, 1, 0])
+        self.itemIndex = arrays.full(len(self.shapes), -1, 'l')
+        self.itemIndex[self.items] = arrays.arange(len(self.items))
+        self.tree = BVH(self.world[self.items], self.leafSize, self.method)
+
+    def localBounds(self, indices):
+        """Update the local bounds of the given leaves"""
+        for index in indices:
+            shape = self.shapes[index]
+            value = bounds.localBounds(shape)
+            self.local[index] = EMPTY if value is None else value
+            watcher = self.watchers[index]
+            if watcher is None:
+                watcher = self.watchers[index] = _Watcher(self.changed, index)
+            holder = cache.CACHE.getHolder(shape, key=bounds.CACHE_KEY)
+            holder.dependents.add(watcher)
+
+    def worldMatrices(self, indices, forward=None):
+        """Get the (K,4,4) world matrices of the given leaves
+
+        forward -- the hierarchy's forward matrices, by default
+            those from its last update
+        """
+        if forward is None:
+            forward = self.hierarchy.forward
+        identity = arrays.identity(4, 'd')[arrays.newaxis]
+        matrices = arrays.concatenate((forward, identity))
+        return matrices[self.transforms[indices]]
+
+    def worldBounds(self, indices, forward):
+        """Calculate the world bounds of the given leaves"""
+        return transformmatrix.transformBounds(
+            self.local[indices], self.worldMatrices(indices, forward)
+        )
+
+    def update(self):
+        """Refit the tree for moved Transforms and changed Shapes
+
+        returns the indices of the leaves whose world bounds changed
+        """
+        if self.hierarchy.structureDirty:
+            self.rebuild()
+            return arrays.arange(len(self.shapes))
+        moved = arrays.append(self.hierarchy.dirty, False)[self.transforms]
+        paths, forward, inverse = self.hierarchy.update()
+        if self.changed:
+            changed = sorted(self.changed)
+            self.changed.clear()
+            emptyBefore = self.local[changed, 0, 0] > self.local[changed, 1, 0]
+            self.localBounds(changed)
+            emptyAfter = self.local[changed, 0, 0] > self.local[changed, 1, 0]
+            if arrays.any(emptyBefore != emptyAfter):
+                self.rebuild()
+                return arrays.arange(len(self.shapes))
+            moved[changed] = True
+        indices = arrays.flatnonzero(moved)
+        if len(indices):
+            self.world[indices] = self.worldBounds(indices, forward)
+            items = self.itemIndex[indices]
+            items = items[items >= 0]
+            self.tree.boxes[items] = self.world[self.items[items]]
+            self.tree.refit(items)
+        return indices
+
+    def path(self, index):
+        """Get the pathClass path for the given leaf"""
+        return self.pathClass(self.paths[index])
+
+    def overlapping(self, box):
+        """Find the leaves whose world bounds overlap the (2,3) box"""
+        return self.items[self.tree.overlapping(box)]
+
+    def near(self, point, distance):
+        """Find the leaves whose world bounds are within distance of point"""
+        return self.items[self.tree.near(point, distance)]
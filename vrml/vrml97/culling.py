@@ -0,0 +1,209 @@
+"""Batched hierarchical frustum culling
+
+boxCull(planes, boxes, masks, first) -- test every box of an
+    (N,2,3) array against (P,4) plane equations at once
+FrustumCuller -- culls the items of a vrml.vrml97.bvh.BVH
+SceneCuller -- culls the Shapes of a scene-graph (through a
+    vrml.vrml97.bvh.SceneBVH)
+
+Plane equations follow vrml_accelerate.frustcullaccel.planeCull,
+points with a*x+b*y+c*z+d >= 0 are in front of (inside) a plane,
+and an object is culled when it is entirely behind any plane.
+frustumPlanes extracts the planes from a (row-vector) projection
+or combined model-view-projection matrix.
+
+Culling descends the BVH a level at a time:
+
+    * nodes entirely behind a plane are dropped with their subtrees
+    * nodes entirely in front of every plane make every item below
+      them visible without further tests (hierarchical early-out)
+    * only the planes a node intersects are tested for its
+      children (plane masking)
+    * the plane which culled a node (or item) is tested first on
+      the next call (plane coherency), as consecutive frames tend
+      to cull the same nodes with the same planes
+
+Uses boxCull from vrml_accelerate.frustcullaccel if available,
+which stops testing a box at the first plane culling it, otherwise
+a NumPy implementation testing every box against every plane.
+"""
+
+from __future__ import unicode_literals
+
+from vrml import arrays
+from vrml.vrml97 import bvh
+
+MAX_PLANES = 63
+
+
+def _boxCull(planes, boxes, masks, first, minDistance=0.0):
+    """NumPy implementation of frustcullaccel.boxCull"""
+    planes = arrays.asarray(planes, 'd').reshape((-1, 4))
+    boxes = arrays.asarray(boxes, 'd').reshape((-1, 2, 3))
+    masks = arrays.asarray(masks, 'int64')
+    first = arrays.asarray(first, 'int64')
+    if len(planes) > MAX_PLANES:
+        raise ValueError('At most %s planes are supported' % (MAX_PLANES,))
+    center = (boxes[:, 0] + boxes[:, 1]) * 0.5
+    extent = (boxes[:, 1] - boxes[:, 0]) * 0.5
+    distance = arrays.matmul(center, planes[:, :3].T) + planes[:, 3]
+    radius = arrays.matmul(extent, arrays.absolute(planes[:, :3]).T)
+    bits = arrays.left_shift(1, arrays.arange(len(planes), dtype='int64'))
+    tested = (masks[:, arrays.newaxis] & bits) != 0
+    outside = tested & (distance + radius < -minDistance)
+    culled = arrays.where(outside.any(axis=1), arrays.argmax(outside, axis=1), -1)
+    # the first plane takes precedence when it culls the box
+    valid = (first >= 0) & (first < len(planes))
+    coherent = arrays.flatnonzero(valid)
+    coherent = coherent[outside[coherent, first[coherent]]]
+    culled[coherent] = first[coherent]
+    intersecting = tested & (distance - radius < 0)
+    remaining = arrays.sum(arrays.where(intersecting, bits, 0), axis=1)
+    remaining[culled >= 0] = 0
+    return culled.astype('int64'), remaining.astype('int64')
+
+
+if getattr(arrays.frustcullaccel, 'boxCull', None) is not None:
+    boxCull = arrays.frustcullaccel.boxCull
+else:
+    boxCull = _boxCull
+
+
+def frustumPlanes(matrix, normalise=True):
+    """Extract the 6 frustum planes from a projection matrix
+
+    matrix -- 4x4 matrix applied to row vectors (as in
+        transformmatrix.perspectiveMatrix), if it is a combined
+        model-view-projection matrix the planes are in model
+        coordinates
+    normalise -- if true, scale the planes to unit normals so
+        that plane distances are euclidean distances
+
+    returns (6,4) array of (left,right,bottom,top,near,far) planes
+    """
+    matrix = arrays.asarray(matrix, 'd')
+    w = matrix[:, 3]
+    planes = arrays.array(
+        [
+            w + matrix[:, 0],
+            w - matrix[:, 0],
+            w + matrix[:, 1],
+            w - matrix[:, 1],
+            w + matrix[:, 2],
+            w - matrix[:, 2],
+        ],
+        'd',
+    )
+    if normalise:
+        lengths = arrays.sqrt(arrays.sum(planes[:, :3] * planes[:, :3], axis=1))
+        planes /= arrays.where(lengths, lengths, 1.0)[:, arrays.newaxis]
+    return planes
+
+
+class FrustumCuller(object):
+    """Hierarchical frustum culling of the items of a BVH
+
+    tree -- the vrml.vrml97.bvh.BVH being culled, after the tree
+        is refitted the same culler can be used, but a rebuilt
+        tree needs a new culler
+    nodePlanes, itemPlanes -- the plane which last culled each
+        node/item (-1 for none), tested first by the next cull
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.nodePlanes = arrays.full(len(tree.bounds), -1, 'int64')
+        self.itemPlanes = arrays.full(len(tree), -1, 'int64')
+
+    def cull(self, planes, minDistance=0.0):
+        """Find the items which are not culled by planes
+
+        planes -- (P,4) plane equations (at most MAX_PLANES)
+        minDistance -- minimum distance behind a plane that an
+            item must be to be culled
+
+        returns (N,) boolean array, true for the visible items
+        """
+        tree = self.tree
+        planes = arrays.asarray(planes, 'd').reshape((-1, 4))
+        visible = arrays.zeros(len(tree), bool)
+        if not len(tree):
+            return visible
+        frontier = arrays.zeros(1, 'l')
+        masks = arrays.array([(1 << len(planes)) - 1], 'int64')
+        while len(frontier):
+            culled, masks = boxCull(
+                planes,
+                tree.bounds[frontier],
+                masks,
+                self.nodePlanes[frontier],
+                minDistance,
+            )
+            self.nodePlanes[frontier[culled >= 0]] = culled[culled >= 0]
+            keep = culled < 0
+            frontier, masks = frontier[keep], masks[keep]
+            inside = masks == 0
+            if arrays.any(inside):
+                visible[tree.nodeItems(frontier[inside])] = True
+                frontier, masks = frontier[~inside], masks[~inside]
+            leaf = tree.children[frontier, 0] < 0
+            if arrays.any(leaf):
+                leaves = frontier[leaf]
+                items = tree.nodeItems(leaves)
+                culled, remaining = boxCull(
+                    planes,
+                    tree.boxes[items],
+                    arrays.repeat(masks[leaf], tree.counts[leaves]),
+                    self.itemPlanes[items],
+                    minDistance,
+                )
+                self.itemPlanes[items[culled >= 0]] = culled[culled >= 0]
+                visible[items[culled < 0]] = True
+            frontier = tree.children[frontier[~leaf]].ravel()
+            masks = arrays.repeat(masks[~leaf], 2)
+        return visible
+
+
+class SceneCuller(object):
+    """Frustum culling of the Shapes of a scene-graph
+
+    scene -- the vrml.vrml97.bvh.SceneBVH for the scene-graph,
+        which is updated (refitted) by each cull
+    """
+
+    def __init__(self, scene, **named):
+        """Initialise the culler
+
+        scene -- SceneBVH, or a root (SceneGraph or grouping node)
+            for which to build a SceneBVH (with named arguments)
+        """
+        if not isinstance(scene, bvh.SceneBVH):
+            scene = bvh.SceneBVH(scene, **named)
+        self.scene = scene
+        self.culler = None
+
+    def cull(self, planes, minDistance=0.0):
+        """Visibility mask for the scene's leaves (see SceneBVH.paths)"""
+        scene = self.scene
+        scene.update()
+        if self.culler is None or self.culler.tree is not scene.tree:
+            self.culler = FrustumCuller(scene.tree)
+        visible = arrays.zeros(len(scene), bool)
+        visible[scene.items[self.culler.cull(planes, minDistance)]] = True
+        return visible
+
+    def visible(self, planes, minDistance=0.0):
+        """Paths to the Shapes which are not culled by planes"""
+        return [
+            self.scene.path(index)
+            for index in arrays.flatnonzero(self.cull(planes, minDistance))
+        ]
+
+
+def frustumCull(planes, scene, minDistance=0.0):
+    """Visible paths of the Shapes in scene (a SceneGraph or grouping node)
+
+    Builds a SceneBVH for the scene, use a SceneCuller to cull the
+    same scene repeatedly.
+    """
+    return SceneCuller(scene).visible(planes, minDistance)
@@ -0,0 +1,242 @@
+"""Structural (Merkle) hashing of nodes and scene-graphs
+
+structuralHash(node) returns a 64-bit integer which depends only
+on the node's content: its prototype and the values of its
+(non-default) fields, with SFNode/MFNode values contributing the
+structural hashes of the child nodes.  Structurally identical
+subtrees therefore have equal hashes, whatever their DEF names
+and whether they share nodes, and the hash of a leaf field's
+array is computed over the array's raw buffer.
+
+The hash of each node is memoized in vrml.cache.CACHE, the
+CacheHolder is cleared when any field of the node changes, and
+clearing a node's hash clears the hashes of every node whose
+hash included it (as for a Merkle tree), so re-hashing a large
+scene after an edit only re-hashes the edited node's ancestors.
+
+Uses xxhash (xxh64) if it is available, otherwise a 64-bit
+combination of zlib's crc32 and adler32, hashes are therefore
+only comparable between processes using the same implementation
+(see HASH_NAME).  Equal hashes do not guarantee equal content,
+users for which a collision matters (see vrml.vrml97.optimise)
+should compare the content of nodes with equal hashes.
+
+Note:
+    as with vrml.cache, only notifications are tracked, modifying
+    an MFNode list or an array in-place will not invalidate the
+    memoized hashes
+"""
+
+from __future__ import unicode_literals
+
+import struct, weakref, zlib
+from pydispatch import dispatcher
+from vrml import arrays, cache, field, node
+from vrml.protofunctions import *
+from vrml.vrml97 import linearise
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DIGEST = struct.Struct('<Q')
+CACHE_KEY = 'structuralHash'
+
+if xxhash is not None:
+    HASH_NAME = 'xxh64'
+
+    def hashBytes(data):
+        """64-bit hash of the bytes (or buffer) data"""
+        return xxhash.xxh64(data).intdigest()
+
+else:
+    HASH_NAME = 'crc32+adler32'
+
+    def hashBytes(data):
+        """64-bit hash of the bytes (or buffer) data"""
+        high = zlib.crc32(data) & 0xFFFFFFFF
+        return high << 32 | (zlib.adler32(data) & 0xFFFFFFFF)
+
+
+def arrayHash(value):
+    """Hash of the data-type, shape and raw buffer of an array"""
+    value = arrays.ascontiguousarray(value)
+    header = ('%s%r' % (value.dtype.str, value.shape)).encode('utf-8')
+    return hashBytes(header + DIGEST.pack(hashBytes(memoryview(value).cast('B'))))
+
+
+def structuralHash(value):
+    """Get the (memoized) structural hash of node/scene-graph value"""
+    return Hasher().hash(value)
+
+
+def equivalent(first, second):
+    """Are the nodes first and second (probably) structurally identical?"""
+    return first is second or structuralHash(first) == structuralHash(second)
+
+
+class HashHolder(cache.DependentHolder):
+    """CacheHolder for a hash which also clears the hashes including it
+
+    dependents -- the HashHolders of nodes whose hash includes
+        our client's hash
+    """
+
+
+_signatures = weakref.WeakKeyDictionary()
+_scriptFields = weakref.WeakKeyDictionary()
+
+
+def clearPrototypeHashes():
+    """Discard memoized prototype signatures (prototype fields have changed)"""
+    _signatures.clear()
+    _scriptFields.clear()
+
+
+dispatcher.connect(clearPrototypeHashes, FIELDS_CHANGED)
+
+
+def _fields(prototype):
+    """(field, isDefault) for the fields contributing to a node's hash"""
+    if protoName(prototype) == 'Script':
+        try:
+            return _scriptFields[prototype]
+        except KeyError:
+            items = [
+                item
+                for item in getFields(prototype)
+                if item.name and item.name[0] != ' '
+            ]
+            items.sort()
+            fields = _scriptFields[prototype] = [(item, None) for item in items]
+            return fields
+    return [
+        (item, isDefault)
+        for item, isDefault, category in linearise.fieldTable(prototype).fields
+    ]
+
+
+class Hasher(object):
+    """Computes structural hashes, memoizing them in vrml.cache.CACHE
+
+    A Hasher is used for a single structuralHash call, it tracks
+    the nodes being hashed so that cyclic references (e.g. a
+    Script field USEing one of the Script's parents) hash as a
+    reference to the enclosing node, hashes involving such a
+    reference depend on where the hashing started and are not
+    memoized.
+    """
+
+    def __init__(self):
+        # [holder, cacheable] for the nodes being hashed
+        self.stack = []
+        # id(node): index in stack
+        self.active = {}
+
+    def hash(self, clientNode):
+        """Get the structural hash of clientNode"""
+        holder = cache.CACHE.getHolder(clientNode, key=CACHE_KEY)
+        if holder is not None and holder.data is not None:
+            return holder.data
+        position = self.active.get(id(clientNode))
+        if position is not None:
+            for entry in self.stack[position + 1 :]:
+                entry[1] = False
+            return hashBytes(('^%d' % (len(self.stack) - position,)).encode('utf-8'))
+        if holder is None:
+            holder = HashHolder(clientNode, None, CACHE_KEY, cache.CACHE)
+            holder.depend_signal(dispatcher.Any, clientNode)
+        entry = [holder, True]
+        self.active[id(clientNode)] = len(self.stack)
+        self.stack.append(entry)
+        try:
+            result = self.compute(clientNode)
+        finally:
+            self.stack.pop()
+            del self.active[id(clientNode)]
+        if entry[1]:
+            holder.data = result
+        return result
+
+    def signature(self, prototype):
+        """Hash of the prototype's name and declarations
+
+        Memoized except for Scripts, as the defaults of Script
+        fields may refer to the Script's parents.
+        """
+        try:
+            return _signatures[prototype]
+        except KeyError:
+            pass
+        script = protoName(prototype) == 'Script'
+        parts = [protoName(prototype).encode('utf-8')]
+        if script or not builtin(prototype):
+            declarations = [
+                value
+                for value in list(prototype.__dict__.values())
+                if isinstance(value, (field.Field, field.Event))
+            ]
+            declarations.sort(key=lambda value: value.name)
+            for value in declarations:
+                if isinstance(value, field.Field):
+                    parts.append(
+                        ('%s %s %s=' % (value.typeName(), value.name, value.exposure))
+                        .encode('utf-8')
+                    )
+                    parts.append(self.value(value.getDefault()))
+                else:
+                    parts.append(
+                        ('%s %s %s' % (value.typeName(), value.name, value.direction))
+                        .encode('utf-8')
+                    )
+            url = getExternalURL(prototype)
+            if url:
+                parts.append(self.value(list(url)))
+        result = DIGEST.pack(hashBytes(b'\x00'.join(parts)))
+        if not script:
+            _signatures[prototype] = result
+        return result
+
+    def compute(self, clientNode):
+        """Calculate the hash of clientNode from its fields' values"""
+        prototype = getPrototype(clientNode)
+        parts = [self.signature(prototype)]
+        if not builtin(prototype):
+            sceneGraph = getSceneGraph(prototype)
+            if sceneGraph:
+                parts.append(self.child(sceneGraph))
+        dictionary = clientNode.__dict__
+        for fieldObject, isDefault in _fields(prototype):
+            value = dictionary.get(fieldObject.name, dictionary)
+            if value is dictionary or (isDefault is not None and isDefault(value)):
+                continue
+            parts.append(fieldObject.name.encode('utf-8'))
+            parts.append(self.value(value))
+        return hashBytes(b'\x00'.join(parts))
+
+    def child(self, clientNode):
+        """Hash of a child node, registering the current node as dependent"""
+        result = self.hash(clientNode)
+        if self.stack:
+            holder = cache.CACHE.getHolder(clientNode, key=CACHE_KEY)
+            if holder is not None:
+                holder.dependents.add(self.stack[-1][0])
+        return DIGEST.pack(result)
+
+    def value(self, value):
+        """Bytes representing a field value"""
+        if isinstance(value, node.Node):
+            return self.child(value)
+        elif isinstance(value, arrays.ArrayType):
+            return DIGEST.pack(arrayHash(value))
+        elif isinstance(value, (list, tuple)):
+            if value and isinstance(value[0], node.Node):
+                return b'[' + b''.join([self.child(item) for item in value]) + b']'
+            value = [
+                item.item() if isinstance(item, arrays.generic) else item
+                for item in value
+            ]
+        elif isinstance(value, arrays.generic):
+            value = value.item()
+        return repr(value).encode('utf-8')
@@ -0,0 +1,305 @@
+"""Incremental lineariser re-using the text of unchanged subtrees
+
+The IncrementalLineariser keeps the text produced for each node
+(and each PROTO block) between calls to linear.  Field-change
+notifications from the nodes (see vrml.field) invalidate the text
+of the changed node and of every fragment which includes it, so
+that saving a large world after a small edit only re-generates
+the edited subtrees and their ancestors.  A fragment stores only
+its own text, referring to the fragments of its child subtrees, and
+the complete text is only joined when it is written.
+
+Each fragment records the nodes it declares and the nodes it
+USEs, it is only spliced into the output when the same DEF/USE
+decisions would be made at that point (see _canUse), and it is
+keyed by indentation level and enclosing PROTO so that
+indentation, IS mappings and EndComments are unchanged.
+
+Note:
+    as with vrml.cache, only notifications are tracked, modifying
+    an MFNode list in-place will not invalidate cached text
+"""
+
+from __future__ import unicode_literals
+
+import weakref
+from io import StringIO
+from pydispatch import dispatcher
+from vrml.vrml97 import linearise
+from vrml.protofunctions import *
+
+
+class Fragment(object):
+    """Cached text of a node subtree or PROTO block
+
+    parts -- the text, literal strings and the (shared) Fragments of
+        the child subtrees in between, so each level only stores its
+        own text and the whole text is only joined when written
+    declared -- [(id(node), start, stop)] for the nodes first
+        declared in our own literal parts, offsets relative to the
+        start of our text
+    used -- ids of nodes declared elsewhere which our own literal
+        parts USE
+    protos -- prototypes which our own literal parts require
+    """
+
+    def __init__(self, parts, declared=(), used=(), protos=()):
+        self.parts = parts
+        self.declared = declared
+        self.used = used
+        self.protos = protos
+
+    def walk(self):
+        """Yield this fragment and those of its child subtrees, in order"""
+        pending = [self]
+        while pending:
+            fragment = pending.pop()
+            yield fragment
+            pending.extend(
+                [part for part in fragment.parts[::-1] if isinstance(part, Fragment)]
+            )
+
+    def write(self, buffer, alreadydone=None):
+        """Write our text to buffer
+
+        alreadydone -- if not None, register the (absolute) extent
+            of each declared node in this dictionary
+        """
+        start = buffer.tell()
+        if alreadydone is not None:
+            for nodeId, first, last in self.declared:
+                alreadydone[nodeId] = (start + first, start + last)
+        for part in self.parts:
+            if isinstance(part, Fragment):
+                part.write(buffer, alreadydone)
+            else:
+                buffer.write(part)
+
+    def text(self):
+        """The complete text of the fragment"""
+        buffer = StringIO()
+        self.write(buffer)
+        return buffer.getvalue()
+
+
+class _Frame(object):
+    """Nodes, prototypes and child fragments encountered while
+    generating a fragment's own text"""
+
+    def __init__(self):
+        self.declared = []
+        self.used = []
+        self.protos = []
+        self.nodes = {}
+        # [(start, stop, key, Fragment)] for child subtrees
+        self.children = []
+
+    def parts(self, buffer, start, stop, offset=0):
+        """Literal text from buffer and child fragments between start and stop
+
+        offset -- added to the children's positions to give their
+            position in buffer
+        """
+        parts = []
+        cursor = start
+        for first, last, key, fragment in self.children:
+            first, last = first + offset, last + offset
+            if first > cursor:
+                parts.append(_read(buffer, cursor, first))
+            parts.append(fragment)
+            cursor = last
+        if stop > cursor:
+            parts.append(_read(buffer, cursor, stop))
+        return parts
+
+
+def _read(buffer, start, stop):
+    """Read back text written to buffer"""
+    index = buffer.tell()
+    buffer.seek(start)
+    text = buffer.read(stop - start)
+    buffer.seek(index)
+    return text
+
+
+class IncrementalLineariser(linearise.Lineariser):
+    """Lineariser which can be re-used, caching the text of unchanged nodes
+
+    Unlike the base Lineariser, an IncrementalLineariser is intended
+    to be used for many calls to linear (e.g. each save of an edited
+    world), with the same linvalues.
+    """
+
+    def __init__(self, linvalues=None, alreadydone=None, *args, **namedargs):
+        linearise.Lineariser.__init__(self, linvalues, alreadydone, *args, **namedargs)
+        # id(node): {(indentationlevel,id(proto)): Fragment}
+        self.fragments = {}
+        # id(proto): Fragment
+        self.protoFragments = {}
+        # key: set( keys of fragments which include key )
+        self.dependents = {}
+        # key: weakref to watched node/proto
+        self.watched = {}
+        self.frames = []
+
+    def invalidate(self, key):
+        """Discard the fragment for key and all fragments including it
+
+        key -- id(node) or ('PROTO',id(prototype))
+        """
+        pending = [key]
+        while pending:
+            key = pending.pop()
+            if isinstance(key, tuple):
+                self.protoFragments.pop(key[1], None)
+            else:
+                self.fragments.pop(key, None)
+            pending.extend(self.dependents.pop(key, ()))
+
+    def onChange(self, signal=None, sender=None):
+        """Field-change notification from a watched node"""
+        self.invalidate(id(sender))
+
+    def _watch(self, target, key):
+        """Invalidate key when target changes or is deleted"""
+        if key in self.watched:
+            return
+        self.watched[key] = weakref.ref(target, self._collected(key))
+        if not isinstance(target, type):
+            dispatcher.connect(self.onChange, sender=target)
+
+    def _collected(self, key):
+        def collected(ref):
+            self.watched.pop(key, None)
+            self.invalidate(key)
+
+        return collected
+
+    def _depend(self, key, target, frame):
+        """Register the fragment key as depending on frame's nodes
+
+        Only the nodes of the fragment's own text and its child
+        fragments are registered, changes further down reach us
+        through the child fragments' dependents.
+        """
+        self._watch(target, key)
+        children = [child for first, last, child, fragment in frame.children]
+        for nodeId in set(frame.declared + frame.used + children):
+            if nodeId == key:
+                continue
+            if nodeId in frame.nodes:
+                self._watch(frame.nodes[nodeId], nodeId)
+            self.dependents.setdefault(nodeId, set()).add(key)
+
+    def _fits(self, fragment):
+        """Would the fragment's DEF/USE decisions be made here?"""
+        alreadydone = self.alreadydone
+        local = set()
+        used = []
+        for part in fragment.walk():
+            for nodeId, start, stop in part.declared:
+                if nodeId in alreadydone:
+                    return False
+                local.add(nodeId)
+            used.extend(part.used)
+        for nodeId in used:
+            if nodeId not in alreadydone and nodeId not in local:
+                return False
+        return True
+
+    def _splice(self, key, fragment):
+        """Write a cached fragment, registering its declarations"""
+        for part in fragment.walk():
+            for proto in part.protos:
+                self._proto(proto)
+        start = self.buffer.tell()
+        fragment.write(self.buffer, self.alreadydone)
+        if self.frames:
+            self.frames[-1].children.append((start, self.buffer.tell(), key, fragment))
+
+    def _canUse(self, clientNode):
+        result = linearise.Lineariser._canUse(self, clientNode)
+        if self.frames:
+            frame = self.frames[-1]
+            frame.nodes[id(clientNode)] = clientNode
+            if type(result) == int:
+                frame.declared.append(id(clientNode))
+            else:
+                frame.used.append(id(clientNode))
+        return result
+
+    def _Node(self, clientNode, *args, **namedargs):
+        if self.streaming or id(clientNode) in self.alreadydone:
+            return linearise.Lineariser._Node(self, clientNode, *args, **namedargs)
+        context = (
+            self.indentationlevel,
+            id(self.curproto[-1]) if self.curproto else None,
+        )
+        fragment = self.fragments.get(id(clientNode), {}).get(context)
+        if fragment is not None and self._fits(fragment):
+            return self._splice(id(clientNode), fragment)
+        frame = _Frame()
+        self.frames.append(frame)
+        start = self.buffer.tell()
+        try:
+            result = linearise.Lineariser._Node(self, clientNode, *args, **namedargs)
+        finally:
+            self.frames.pop()
+        stop = self.buffer.tell()
+        declared = []
+        for nodeId in frame.declared:
+            extent = self.alreadydone.get(nodeId)
+            if type(extent) is tuple:
+                declared.append((nodeId, extent[0] - start, extent[1] - start))
+        local = set(frame.declared)
+        fragment = Fragment(
+            frame.parts(self.buffer, start, stop),
+            declared,
+            [nodeId for nodeId in frame.used if nodeId not in local],
+            frame.protos,
+        )
+        self.fragments.setdefault(id(clientNode), {})[context] = fragment
+        self._depend(id(clientNode), clientNode, frame)
+        if self.frames:
+            self.frames[-1].children.append((start, stop, id(clientNode), fragment))
+        return result
+
+    def _proto(self, clientNode):
+        if type(clientNode) != type or builtin(clientNode):
+            return linearise.Lineariser._proto(self, clientNode)
+        if self.frames:
+            self.frames[-1].protos.append(clientNode)
+        if (
+            self.streaming
+            or id(clientNode) in self.protoalreadydone
+            or self.protoalreadydone.get(name(clientNode))
+        ):
+            return linearise.Lineariser._proto(self, clientNode)
+        fragment = self.protoFragments.get(id(clientNode))
+        if fragment is not None:
+            # dependencies precede the prototype, as when generated
+            for part in fragment.walk():
+                for proto in part.protos:
+                    if proto is not clientNode:
+                        self._proto(proto)
+            self.protoalreadydone[protoName(clientNode)] = 1
+            self.protoalreadydone[id(clientNode)] = 1
+            start = self.protobuffer.tell()
+            fragment.write(self.protobuffer)
+            self.alreadydone[id(clientNode)] = (start, self.protobuffer.tell())
+            return None
+        frame = _Frame()
+        self.frames.append(frame)
+        try:
+            result = linearise.Lineariser._proto(self, clientNode)
+        finally:
+            self.frames.pop()
+        start, stop = self.alreadydone[id(clientNode)]
+        key = ('PROTO', id(clientNode))
+        # the body was written to a buffer of its own, then copied
+        self.protoFragments[id(clientNode)] = Fragment(
+            frame.parts(self.protobuffer, start, stop, offset=start),
+            protos=[proto for proto in frame.protos if proto is not clientNode],
+        )
+        self._depend(key, clientNode, frame)
+        return result
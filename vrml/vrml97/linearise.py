@@ -7,6 +7,9 @@ try:
     from cStringIO import StringIO
 except ImportError:
     from io import StringIO
+import weakref
+import multiprocessing
+from pydispatch import dispatcher
 from vrml import arrays
 from vrml.protofunctions import *
 from vrml import node
@@ -23,6 +26,20 @@ defaults = {
     # and end, put a comment at the closing bracket saying what node/proto is
     # being closed.
     'EndComments': 10,
+    # precision for numeric array fields, None reproduces str() of each value,
+    # 'shortest' gives the shortest round-tripping text, an integer gives that
+    # many significant digits (see vrml.numberformat)
+    'precision': None,
+    # number of worker processes used to linearise the children of the
+    # top-level sceneGraph, None/1 for sequential linearisation
+    'processes': None,
+    # strip redundant zeros from numeric array fields (see vrml.numberformat)
+    'compact': False,
+    # per-category precision, a dictionary mapping the FIELD_CATEGORIES
+    # categories to a precision (integer significant digits or float
+    # quantization step) for fields of that category, which are also
+    # written compactly, e.g. {'coordinates': .001, 'normals': 3, ...}
+    'fieldPrecision': None,
 }
 minimal1 = {
     'subelspacer': ', ',
@@ -45,6 +62,194 @@ def linearise(value, linvalues=defaults, **namedargs):
     return l.linear(value)
 
 
+def streamLinearise(value, file, linvalues=defaults, **namedargs):
+    """Linearise the given (node) value directly into file
+
+    file -- object with a write method, e.g. an open text
+        file or socket.makefile('w')
+
+    returns the number of characters written
+    """
+    l = Lineariser(linvalues, **namedargs)
+    return l.stream(value, file)
+
+
+# (prototype name, field name): category for the fieldPrecision linvalue,
+# SFColor and MFColor fields are always in the 'colors' category
+FIELD_CATEGORIES = {
+    ('Coordinate', 'point'): 'coordinates',
+    ('CoordinateInterpolator', 'keyValue'): 'coordinates',
+    ('PositionInterpolator', 'keyValue'): 'coordinates',
+    ('ElevationGrid', 'height'): 'coordinates',
+    ('Extrusion', 'crossSection'): 'coordinates',
+    ('Extrusion', 'spine'): 'coordinates',
+    ('Normal', 'vector'): 'normals',
+    ('NormalInterpolator', 'keyValue'): 'normals',
+    ('Color', 'color'): 'colors',
+    ('ColorInterpolator', 'keyValue'): 'colors',
+    ('TextureCoordinate', 'point'): 'texcoords',
+}
+
+
+def fieldCategory(prototype, field):
+    """Get the fieldPrecision category for prototype's field (or None)"""
+    category = FIELD_CATEGORIES.get((protoName(prototype), field.name))
+    if category is None and field.typeName() in ('SFColor', 'MFColor'):
+        category = 'colors'
+    return category
+
+
+# alreadydone marker for nodes declared by another partition (see _parallelChildren)
+_ELSEWHERE = ('elsewhere',)
+# (lineariser, partitions, first-partition mapping) inherited by forked workers
+_PARALLEL = None
+
+
+def _linearisePartition(index):
+    """Worker process: linearise partition index of the forked lineariser's children
+
+    returns (prototype text, body text)
+    """
+    lineariser, partitions, first = _PARALLEL
+    # worker writes to its own buffers, prototypes to its protobuffer
+    lineariser.streaming = False
+    lineariser.buffer = StringIO()
+    lineariser.protobuffer = StringIO()
+    lineariser.alreadydone = dict(
+        [(nodeId, _ELSEWHERE) for nodeId, owner in first.items() if owner < index]
+    )
+    separator = lineariser.linvalues['full_element_separator']
+    for child in partitions[index]:
+        lineariser._linear(child)
+        lineariser.buffer.write(separator)
+    return lineariser.protobuffer.getvalue(), lineariser.buffer.getvalue()
+
+
+class StreamBuffer(object):
+    """Write-only buffer passing its content on to a file in bounded chunks
+
+    Counts the characters written so that the lineariser's offset
+    book-keeping (tell) works without holding the output in memory.
+    """
+
+    def __init__(self, file, size=65536, encoding=None):
+        """Initialise the buffer
+
+        file -- object with a write method
+        size -- number of characters to accumulate before writing
+        encoding -- if specified, text is encoded before writing
+            (for binary files and sockets)
+        """
+        self.file = file
+        self.size = size
+        self.encoding = encoding
+        self.pending = []
+        self.pendingSize = 0
+        self.position = 0
+
+    def write(self, text):
+        """Add text to the buffer, passing it on when full"""
+        self.pending.append(text)
+        self.pendingSize += len(text)
+        self.position += len(text)
+        if self.pendingSize >= self.size:
+            self.flush()
+
+    def tell(self):
+        """Total number of characters written"""
+        return self.position
+
+    def flush(self):
+        """Write any pending text to the file"""
+        if self.pending:
+            text = ''.join(self.pending)
+            if self.encoding:
+                text = text.encode(self.encoding)
+            self.file.write(text)
+            self.pending = []
+            self.pendingSize = 0
+
+    close = flush
+
+
+class FieldTable(object):
+    """Per-prototype table of the fields written by _attrDict
+
+    fields -- sorted list of (field, isDefault, category) where
+        isDefault is None (always write the field) or a function
+        returning whether a value equals the field's canonical
+        (coerced) default, and category is the fieldCategory
+
+    Built once per prototype (see fieldTable) so that linearising
+    a node does not need to collect/sort the fields or coerce the
+    default value of every field.
+    """
+
+    SCRIPT_FIELDS = ('url', 'mustEvaluate', 'directOutput')
+
+    def __init__(self, prototype):
+        if protoName(prototype) == "Script":
+            items = [
+                field
+                for field in getFields(prototype)
+                if field.name in self.SCRIPT_FIELDS
+            ]
+        else:
+            items = [
+                field
+                for field in getFields(prototype)
+                if field.name and field.name[0] != ' '
+            ]
+        items.sort()
+        self.fields = [
+            (field, self.defaultChecker(field), fieldCategory(prototype, field))
+            for field in items
+        ]
+
+    def defaultChecker(self, field):
+        """Create the isDefault function for field (or None)"""
+        default = field.getDefault()
+        if default is None:
+            return None
+        try:
+            default = field.coerce(default)
+        except (ValueError, TypeError):
+            return None
+        if isinstance(default, arrays.ArrayType):
+
+            def isDefault(value):
+                return (
+                    isinstance(value, arrays.ArrayType)
+                    and value.shape == default.shape
+                    and bool(arrays.all(value == default))
+                )
+
+            return isDefault
+        elif isinstance(default, node.Node):
+            return lambda value: value is default
+        return lambda value: arrays.safeCompare(default, value)
+
+
+_fieldTables = weakref.WeakKeyDictionary()
+
+
+def fieldTable(prototype):
+    """Get the (cached) FieldTable for prototype"""
+    try:
+        return _fieldTables[prototype]
+    except KeyError:
+        table = _fieldTables[prototype] = FieldTable(prototype)
+        return table
+
+
+def clearFieldTables():
+    """Discard cached FieldTables (prototype fields have changed)"""
+    _fieldTables.clear()
+
+
+dispatcher.connect(clearFieldTables, FIELDS_CHANGED)
+
+
 class Lineariser:
     '''
     A data structure & methods for linearising
@@ -60,6 +265,7 @@ class Lineariser:
             linvalues = linvalues.copy()
             linvalues.update(namedargs)
         self.linvalues = linvalues
+        self.streaming = False
         if alreadydone is None:
             self.alreadydone = {}
         else:
@@ -86,6 +292,53 @@ class Lineariser:
         # protobuffer is a seperate buffer into which the prototype definitions are stored
         self.protobuffer = StringIO()
         self.protobuffer.write('#VRML V2.0 utf8\n')
+        self.buffer = buffer or StringIO()
+        self._start()
+        self._body(clientNode)
+        # side effect has filled up protobuffer for us
+        rval = self.protobuffer.getvalue() + self.buffer.getvalue()
+        self.buffer.close()
+        self.protobuffer.close()
+        return rval
+
+    def stream(
+        self,
+        clientNode,
+        file,
+        skipUnusedProtos=None,
+        bufferSize=65536,
+        encoding=None,
+    ):
+        """Linearise a node, script, or scenegraph directly into file
+
+        Rather than accumulating the prototypes and the body in
+        separate buffers, a pre-pass collects the prototypes in use
+        (dependencies first) and writes them, then the body is
+        written, passing at most about bufferSize characters at a
+        time on to file (see StreamBuffer).
+
+        Nodes without DEF names which are used more than once are
+        linearised again, as the earlier text is no longer available
+        to be copied.
+
+        returns the number of characters written
+        """
+        self.skipProtos = {}
+        self.skipUnusedProtos = skipUnusedProtos
+        self.streaming = True
+        self.buffer = self.protobuffer = StreamBuffer(
+            file, size=bufferSize, encoding=encoding
+        )
+        self.buffer.write('#VRML V2.0 utf8\n')
+        self._start()
+        for proto in self._usedProtos(clientNode):
+            self._proto(proto)
+        self._body(clientNode)
+        self.buffer.flush()
+        return self.buffer.tell()
+
+    def _start(self):
+        """Reset the working state before linearising"""
         # protoalreadydone is used in place of the scenegraph-specific
         # node alreadydone.  This allows us to push all protos up to the
         # top level of the hierarchy (thus making the process of linearisation much simpler)
@@ -96,13 +349,15 @@ class Lineariser:
             'NULL': self._nullNode,
             'sceneGraph': self._sceneGraph,
         }
-        self.buffer = buffer or StringIO()
         self.alreadydone.clear()
         self.cursceneGraph = (
             []
         )  # used to look up whether we need to output a prototype...
         self.curproto = []
         self.indentationlevel = 0
+
+    def _body(self, clientNode):
+        """Linearise the client node (or list of nodes) into the buffer"""
         if type(clientNode) in (list, tuple):
             for child in clientNode:
                 self._linear(child)
@@ -111,11 +366,67 @@ class Lineariser:
             self._linear(clientNode)
         del self.typecache  # to clear references to this node...
         self.alreadydone.clear()
-        # side effect has filled up protobuffer for us
-        rval = self.protobuffer.getvalue() + self.buffer.getvalue()
-        self.buffer.close()
-        self.protobuffer.close()
-        return rval
+
+    def _usedProtos(self, clientNode):
+        """Pre-pass collecting the prototypes _proto will be asked for
+
+        Follows the linearisation traversal (node-valued fields,
+        prototype field defaults and prototype scenegraphs) without
+        producing any text.
+
+        returns list of prototypes, each after those it depends upon
+        """
+        result = []
+        seen = {}
+
+        def nodeFields(fields):
+            return [
+                field
+                for field in fields
+                if field.name
+                and field.name[0] != ' '
+                and isinstance(field, (node.SFNode, node.MFNode))
+            ]
+
+        def visitProto(proto):
+            if type(proto) != type or builtin(proto) or id(proto) in seen:
+                return
+            seen[id(proto)] = proto
+            for field in nodeFields(getFields(proto)):
+                visit(field.getDefault())
+            if not getExternalURL(proto):
+                visit(getSceneGraph(proto))
+            result.append(proto)
+
+        def visit(value):
+            if value is None or id(value) in seen:
+                return
+            if isinstance(value, (list, tuple)):
+                for item in value:
+                    visit(item)
+                return
+            if type(value) == type:
+                return visitProto(value)
+            seen[id(value)] = value
+            pName = protoName(value)
+            if pName == 'NULL':
+                return
+            elif pName == 'sceneGraph':
+                if not self.skipUnusedProtos:
+                    for proto in value.protoTypes.values():
+                        visitProto(proto)
+                visit(value.children)
+                return
+            elif pName == 'Script':
+                for field in nodeFields(getFields(getPrototype(value))):
+                    visit(field.getDefault())
+            else:
+                visitProto(getPrototype(value))
+            for field in nodeFields(getFields(value)):
+                visit(field.fget(value))
+
+        visit(clientNode)
+        return result
 
     ### High-level constructs...
     def _sceneGraph(self, clientNode):
@@ -157,9 +468,20 @@ class Lineariser:
                 if not id(proto) in self.protoalreadydone:
                     self._proto(proto)
         # linearise the node/script children, they will include their prototypes if they are not already done
-        for child in clientNode.children:
-            self._linear(child)
-            buffer.write(self.linvalues['full_element_separator'])
+        processes = self.linvalues.get('processes')
+        if (
+            processes
+            and processes > 1
+            and len(clientNode.children) > 1
+            and len(self.cursceneGraph) == 1
+            and not self.curproto
+            and 'fork' in multiprocessing.get_all_start_methods()
+        ):
+            self._parallelChildren(clientNode.children, processes)
+        else:
+            for child in clientNode.children:
+                self._linear(child)
+                buffer.write(self.linvalues['full_element_separator'])
         # linearise the routes
         for route in clientNode.routes:
             # should check here to make sure the ROUTEs are valid
@@ -175,6 +497,68 @@ class Lineariser:
         del self.cursceneGraph[-1]
         return None
 
+    def _parallelChildren(self, children, processes):
+        """Linearise the top-level children in forked worker processes
+
+        The children are split into contiguous partitions, the results
+        are written in order.  A pre-pass finds the first partition to
+        reach each node, that partition declares (DEF) the node, later
+        partitions USE it (nodes without DEF names are linearised again,
+        as the earlier text is in another process).  Prototypes are
+        written beforehand by this process.
+        """
+        global _PARALLEL
+        count = min(len(children), processes * 4)
+        size = -(-len(children) // count)
+        partitions = [children[i : i + size] for i in range(0, len(children), size)]
+        first = {}
+        for index, partition in enumerate(partitions):
+            for nodeId in self._reachable(partition):
+                first.setdefault(nodeId, index)
+        for proto in self._usedProtos(children):
+            self._proto(proto)
+        _PARALLEL = (self, partitions, first)
+        try:
+            pool = multiprocessing.get_context('fork').Pool(processes)
+            try:
+                for protos, text in pool.imap(
+                    _linearisePartition, range(len(partitions))
+                ):
+                    self.protobuffer.write(protos)
+                    self.buffer.write(text)
+            finally:
+                pool.terminate()
+        finally:
+            _PARALLEL = None
+
+    def _reachable(self, nodes):
+        """Get ids of the nodes reached (in this scope) when linearising nodes"""
+        result = set()
+        pending = list(nodes)
+        while pending:
+            current = pending.pop()
+            if isinstance(current, (list, tuple)):
+                pending.extend(current)
+                continue
+            if current is None or type(current) == type or id(current) in result:
+                continue
+            pName = protoName(current)
+            if pName == 'NULL':
+                continue
+            result.add(id(current))
+            if pName == 'sceneGraph':
+                # children are in a separate scope
+                continue
+            values = current.__dict__
+            for field, isDefault, category in fieldTable(current.__class__).fields:
+                if isinstance(field, (node.SFNode, node.MFNode)) and field.name in values:
+                    pending.append(field.fget(current))
+            if pName == 'Script':
+                for field in getFields(getPrototype(current)):
+                    if isinstance(field, (node.SFNode, node.MFNode)):
+                        pending.append(field.getDefault())
+        return result
+
     def _proto(self, clientNode):
         """Linearise a prototype, return whether the prototype is actually linearised"""
         # check that we haven't yet done this prototype, register the fact that we've already started it
@@ -200,7 +584,12 @@ class Lineariser:
         oldindent = self.indentationlevel
         self._indent(0)
         oldbuffer = self.buffer
-        buffer = self.buffer = StringIO()  # local buffer only for this particular proto
+        if self.streaming:
+            # the pre-pass has ordered the prototypes, write directly
+            buffer = self.buffer
+        else:
+            buffer = self.buffer = StringIO()  # local buffer only for this particular proto
+        start = buffer.tell()
 
         # write header (PROTO x [, EXTERNPROTO x [ )
         # TODO: the externalURL descriptor no longer works, likely because the proto node
@@ -233,11 +622,16 @@ class Lineariser:
             if sg is not None:
                 self._sceneGraph(sg)
             if 'EndComments' in linvalues and linvalues['EndComments'] * 60 < (
-                (buffer.tell())
+                (buffer.tell() - start)
             ):
                 buffer.write('\n}#End PROTO %s\n' % (clientName))
             else:
                 buffer.write('\n}\n')
+        if self.streaming:
+            self.alreadydone[id(clientNode)] = (start, buffer.tell())
+            self._indent(oldindent)
+            self.curproto.pop()
+            return None
         self.alreadydone[id(clientNode)] = (
             self.protobuffer.tell(),
             self.protobuffer.tell() + buffer.tell(),
@@ -356,39 +750,42 @@ class Lineariser:
                         isMaps[field] = fieldName
         else:
             isMaps = {}
-        if protoName(object) == "Script":
-            items = [
-                field
-                for field in getFields(object)
-                if field.name in ('url', 'mustEvaluate', 'directOutput')
-            ]
-        else:
-            items = [
-                field
-                for field in getFields(object)
-                if field.name and field.name[0] != ' '
-            ]
-        items.sort()
-        for field in items:
-            # following slows us down, but prevents the chaff from showing up...
-            val = field.fget(object)
-            default = field.getDefault()
+        values = object.__dict__
+        fieldPrecision = linvalues.get('fieldPrecision') or {}
+        for field, isDefault, category in fieldTable(object.__class__).fields:
             if field.name in isMaps:
                 buffer.write(
                     '%(full_element_separator)s%(curindent)s%(indent)s%%s IS %%s\t'
                     % linvalues
                     % (field.name, isMaps.get(field.name))
                 )
-            elif (
-                default is not None and not arrays.safeCompare(default, val)
-            ) or default is None:
-                buffer.write(
-                    '%(full_element_separator)s%(curindent)s%(indent)s%%s\t'
-                    % linvalues
-                    % (field.name,)
-                )
+                continue
+            if isDefault is not None and field.name not in values:
+                # untouched field (fhas is false), holds the default
+                continue
+            val = field.fget(object)
+            if isDefault is not None and isDefault(val):
+                continue
+            buffer.write(
+                '%(full_element_separator)s%(curindent)s%(indent)s%%s\t'
+                % linvalues
+                % (field.name,)
+            )
+            if category in fieldPrecision:
+                self._preciseField(val, field, fieldPrecision[category])
+            else:
                 self._sffield(val, field)
 
+    def _preciseField(self, value, field, precision):
+        """Write (numeric) field value with the given precision, compactly"""
+        linvalues = self.linvalues
+        original = linvalues.get('precision'), linvalues.get('compact')
+        linvalues['precision'], linvalues['compact'] = precision, True
+        try:
+            self._sffield(value, field)
+        finally:
+            linvalues['precision'], linvalues['compact'] = original
+
     def _eventDict(self, clientNode):
         '''
         Event Dictionaries have two possible sources of information,
@@ -511,6 +908,17 @@ class Lineariser:
             if DEF:
                 return 'USE ' + DEF
             # else have to linearise again, should warn the user
+            elif self.streaming or self.alreadydone[id(clientNode)] is _ELSEWHERE:
+                # the earlier text has been written out (or is in another
+                # process), linearise again
+                keyvals = self.alreadydone[id(clientNode)]
+                if type(keyvals) is tuple or keyvals is _ELSEWHERE:
+                    self.buffer.write(
+                        '#WARNING HERE -- USE of node with no DEF name, Node duplicated\n'
+                    )
+                    ind = self.alreadydone[id(clientNode)] = self.buffer.tell()
+                    return ind
+                return '#ERROR HERE -- USE of a parent node that has no DEF name USE ignored'
             else:
                 keyvals = self.alreadydone[id(clientNode)]
                 index = self.buffer.tell()
@@ -0,0 +1,485 @@
+"""Compilation of IndexedFaceSets to flat triangle arrays
+
+triangleMesh(faceSet) expands the -1 delimited polygons of an
+IndexedFaceSet's coordIndex (and the normalIndex, colorIndex and
+texCoordIndex lists) into a TriangleMesh holding per-vertex
+arrays, resolving per-face and per-vertex colours and normals
+according to colorPerVertex and normalPerVertex, with whole-array
+operations rather than per-polygon Python loops.
+
+Convex polygons are fan-triangulated in a single vectorised
+operation, when convex is FALSE polygons with more than three
+vertices are triangulated by ear-clipping (see earClip).
+
+When the normal field is NULL, normals are generated (see
+generatedNormals) honouring creaseAngle: each polygon corner's
+normal is the (area weighted) average of the normals of the
+polygons around the corner's vertex that are reachable from the
+corner's polygon across shared edges within creaseAngle.  The
+edge adjacency is built by sorting the polygon edges, and the
+smoothing groups are labelled by a vectorised union-find, so the
+generation is vectorised and linear in the number of corners.
+
+The result is cached in vrml.cache.CACHE, the cache is cleared
+when the IndexedFaceSet's fields or the point/vector/color
+fields of its Coordinate, Normal, Color and TextureCoordinate
+nodes change.
+"""
+
+from __future__ import unicode_literals
+
+from vrml import arrays, cache
+
+FACE_SET_FIELDS = (
+    'coord',
+    'coordIndex',
+    'normal',
+    'normalIndex',
+    'normalPerVertex',
+    'color',
+    'colorIndex',
+    'colorPerVertex',
+    'texCoord',
+    'texCoordIndex',
+    'ccw',
+    'convex',
+    'creaseAngle',
+)
+# the fields on which generated normals depend
+NORMAL_FIELDS = ('coord', 'coordIndex', 'ccw', 'creaseAngle')
+# the field holding the values of each attribute node
+ATTRIBUTE_FIELDS = {
+    'coord': 'point',
+    'normal': 'vector',
+    'color': 'color',
+    'texCoord': 'point',
+}
+
+
+class TriangleMesh(object):
+    """Triangle arrays compiled from an IndexedFaceSet
+
+    vertices -- (N,3) vertex coordinates
+    normals, colors, texCoords -- (N,3), (N,3) and (N,2) per-vertex
+        arrays, or None if the IndexedFaceSet does not define them
+    indices -- (T,3) indices into the per-vertex arrays for each
+        triangle, or None for de-indexed meshes, where each three
+        consecutive vertices form a triangle
+    faces -- (T,) index of the polygon from which each triangle
+        was produced
+    """
+
+    def __init__(
+        self,
+        vertices,
+        normals=None,
+        colors=None,
+        texCoords=None,
+        indices=None,
+        faces=None,
+    ):
+        self.vertices = vertices
+        self.normals = normals
+        self.colors = colors
+        self.texCoords = texCoords
+        self.indices = indices
+        self.faces = faces
+
+    def __len__(self):
+        """Number of triangles"""
+        if self.indices is not None:
+            return len(self.indices)
+        return len(self.vertices) // 3
+
+
+class Polygons(object):
+    """The -1 delimited polygons of an index list
+
+    positions -- (C,) position in the index list of each corner
+        (polygon vertex)
+    values -- (C,) index value of each corner
+    faces -- (C,) polygon number of each corner
+    starts, counts -- (F,) first corner and number of corners of
+        each polygon
+    """
+
+    def __init__(self, index):
+        index = arrays.asarray(index, 'i').ravel()
+        separators = index == -1
+        # polygon number == number of separators before the position
+        polygonOf = arrays.cumsum(separators) - separators
+        self.positions = arrays.flatnonzero(~separators)
+        self.values = index[self.positions]
+        self.faces = polygonOf[self.positions]
+        if len(index):
+            count = int(polygonOf[-1]) + 1
+        else:
+            count = 0
+        self.counts = arrays.bincount(self.faces, minlength=count)
+        self.starts = arrays.cumsum(self.counts) - self.counts
+
+    def fan(self, polygons=None):
+        """Fan-triangulate polygons (default all with 3 or more corners)
+
+        returns ((T,3) corner numbers, (T,) polygon of each triangle)
+        """
+        if polygons is None:
+            polygons = arrays.flatnonzero(self.counts >= 3)
+        sizes = self.counts[polygons] - 2
+        owners = arrays.repeat(polygons, sizes)
+        offsets = arrays.cumsum(sizes) - sizes
+        step = arrays.arange(len(owners)) - arrays.repeat(offsets, sizes) + 1
+        first = self.starts[owners]
+        return arrays.column_stack((first, first + step, first + step + 1)), owners
+
+
+def earClip(points):
+    """Triangulate a (possibly concave) planar polygon by ear-clipping
+
+    points -- (n,3) polygon vertices in order
+
+    returns list of (a,b,c) indices into points
+    """
+    points = arrays.asarray(points, 'd')
+    count = len(points)
+    if count < 3:
+        return []
+    # Newell normal, project onto the plane of the two minor axes,
+    # taken in cyclic order so the projection keeps the winding
+    following = arrays.roll(points, -1, axis=0)
+    normal = arrays.sum(arrays.cross(points, following), axis=0)
+    axis = int(arrays.argmax(arrays.absolute(normal)))
+    planar = points[:, [(axis + 1) % 3, (axis + 2) % 3]]
+    if normal[axis] < 0:
+        planar = planar[:, ::-1]
+
+    def cross(a, b, c):
+        return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+    remaining = list(range(count))
+    result = []
+    guard = 0
+    while len(remaining) > 3 and guard < len(remaining):
+        total = len(remaining)
+        for position in range(total):
+            a, b, c = (
+                remaining[position - 1],
+                remaining[position],
+                remaining[(position + 1) % total],
+            )
+            if cross(planar[a], planar[b], planar[c]) <= 0:
+                # reflex (or degenerate) corner
+                continue
+            inside = False
+            for other in remaining:
+                if other in (a, b, c):
+                    continue
+                p = planar[other]
+                if (
+                    cross(planar[a], planar[b], p) >= 0
+                    and cross(planar[b], planar[c], p) >= 0
+                    and cross(planar[c], planar[a], p) >= 0
+                ):
+                    inside = True
+                    break
+            if not inside:
+                result.append((a, b, c))
+                del remaining[position]
+                guard = 0
+                break
+        else:
+            # no ear found (self-intersecting/degenerate), fan the rest
+            guard = len(remaining)
+    first = remaining[0]
+    for position in range(1, len(remaining) - 1):
+        result.append((first, remaining[position], remaining[position + 1]))
+    return result
+
+
+def _values(faceSet, fieldName):
+    """The values of faceSet's attribute node (Coordinate, Normal, ...) or None"""
+    attributeNode = getattr(faceSet, fieldName)
+    if not attributeNode:
+        return None
+    value = attributeNode.__dict__.get(ATTRIBUTE_FIELDS[fieldName])
+    if value is None:
+        return None
+    return arrays.asarray(value)
+
+
+def _normalise(vectors):
+    """Scale the (N,3) vectors to unit length (zero vectors are unchanged)"""
+    lengths = arrays.sqrt(arrays.sum(vectors * vectors, axis=1))
+    return vectors / arrays.where(lengths, lengths, 1.0)[:, arrays.newaxis]
+
+
+def _sums(indices, values, count):
+    """Sum the (N,3) values into count rows according to indices"""
+    return arrays.column_stack(
+        [
+            arrays.bincount(indices, weights=values[:, axis], minlength=count)
+            for axis in range(3)
+        ]
+    )
+
+
+def uniqueRows(rows):
+    """Find the distinct rows of the (N,M) array rows
+
+    Equivalent to numpy.unique(rows, axis=0, return_index=True,
+    return_inverse=True) using a stable lexsort of the columns,
+    which is considerably faster than unique's sort of the rows
+
+    returns (distinct rows, index of each's first occurrence, (N,)
+    index into the distinct rows for each row)
+    """
+    count = len(rows)
+    order = arrays.lexsort(rows.T[::-1])
+    ordered = rows[order]
+    starts = arrays.ones(count, bool)
+    starts[1:] = arrays.any(ordered[1:] != ordered[:-1], axis=1)
+    inverse = arrays.empty(count, 'l')
+    inverse[order] = arrays.cumsum(starts) - 1
+    first = order[starts]
+    return rows[first], first, inverse
+
+
+def faceNormals(points, polygons, ccw=True):
+    """Newell normal of each polygon, the length is twice the polygon's area
+
+    points -- (N,3) coordinates
+    polygons -- Polygons for the coordIndex
+    ccw -- if false, the polygons are clockwise
+    """
+    count = len(polygons.values)
+    following = arrays.arange(1, count + 1)
+    used = polygons.counts > 0
+    following[(polygons.starts + polygons.counts - 1)[used]] = polygons.starts[used]
+    current = arrays.asarray(points, 'd')[polygons.values]
+    normals = _sums(
+        polygons.faces,
+        arrays.cross(current, current[following]),
+        len(polygons.counts),
+    )
+    if not ccw:
+        normals = -normals
+    return normals
+
+
+def _components(first, second, count):
+    """Label the connected components of count nodes joined by the
+    (first[i], second[i]) links
+
+    A vectorised union-find: each round hooks the larger root of
+    every unresolved link onto the smaller and then compresses the
+    paths by pointer jumping, so the work is close to linear in the
+    number of links however the nodes are connected.
+
+    returns (count,) smallest node number in each node's component
+    """
+    labels = arrays.arange(count)
+    while len(first):
+        a, b = labels[first], labels[second]
+        unresolved = a != b
+        if not unresolved.any():
+            break
+        first, second = first[unresolved], second[unresolved]
+        a, b = a[unresolved], b[unresolved]
+        arrays.minimum.at(labels, arrays.maximum(a, b), arrays.minimum(a, b))
+        while True:
+            parents = labels[labels]
+            if arrays.array_equal(parents, labels):
+                break
+            labels = parents
+    return labels
+
+
+def computeNormals(points, polygons, creaseAngle=0.0, ccw=True):
+    """Calculate per-corner normals honouring creaseAngle
+
+    Corners at the same vertex are smoothed together when their
+    polygons share an edge and their normals are within creaseAngle,
+    and transitively through such neighbours, so each corner is only
+    ever compared with the polygons adjacent to it, however many
+    polygons share the vertex.
+
+    returns ((N,3) unit normals, (C,) index into the normals for
+    each corner of polygons)
+    """
+    weighted = faceNormals(points, polygons, ccw)
+    unit = _normalise(weighted)
+    faces = polygons.faces
+    if creaseAngle <= 0:
+        return unit.astype('f'), faces
+    vertices = polygons.values
+    if creaseAngle >= arrays.pi:
+        # every polygon sharing the vertex contributes
+        count = int(vertices.max()) + 1 if len(vertices) else 0
+        return _normalise(_sums(vertices, weighted[faces], count)).astype('f'), vertices
+    count = len(vertices)
+    # the edge from each corner to the following corner of its polygon
+    following = arrays.arange(1, count + 1)
+    used = polygons.counts > 0
+    following[(polygons.starts + polygons.counts - 1)[used]] = polygons.starts[used]
+    ends = vertices[following]
+    low = arrays.minimum(vertices, ends)
+    high = arrays.maximum(vertices, ends)
+    # neighbouring entries of the sorted edges on the same vertex pair
+    # are polygons meeting at that edge
+    order = arrays.lexsort((high, low))
+    shared = (low[order[1:]] == low[order[:-1]]) & (
+        high[order[1:]] == high[order[:-1]]
+    )
+    this, other = order[:-1][shared], order[1:][shared]
+    smooth = (
+        arrays.sum(unit[faces[this]] * unit[faces[other]], axis=1)
+        >= arrays.cos(creaseAngle)
+    ) & (faces[this] != faces[other])
+    this, other = this[smooth], other[smooth]
+    # join the corners at each end of the edge, edges may run in
+    # opposite directions in the two polygons
+    same = vertices[this] == vertices[other]
+    first = arrays.concatenate((this, following[this]))
+    second = arrays.concatenate(
+        (
+            arrays.where(same, other, following[other]),
+            arrays.where(same, following[other], other),
+        )
+    )
+    labels = _components(first, second, count)
+    normals = _normalise(_sums(labels, weighted[faces], count)).astype('f')
+    # corners with the same smoothing group have identical sums
+    normals, first, indices = uniqueRows(normals[labels])
+    return normals, indices
+
+
+def generatedNormals(faceSet):
+    """Get the (cached) generated normals for faceSet
+
+    returns (normals, per-corner indices) as for computeNormals
+    """
+    key = 'generatedNormals'
+    holder = cache.CACHE.getHolder(faceSet, key=key)
+    if holder is None:
+        holder = cache.CACHE.holder(faceSet, None, key=key)
+        for fieldName in NORMAL_FIELDS:
+            holder.depend(faceSet, fieldName)
+    elif holder.data is not None:
+        return holder.data
+    points = _values(faceSet, 'coord')
+    if points is None:
+        points = arrays.zeros((0, 3), 'f')
+    else:
+        holder.depend(faceSet.coord, 'point')
+    holder.data = computeNormals(
+        points, Polygons(faceSet.coordIndex), faceSet.creaseAngle, faceSet.ccw
+    )
+    return holder.data
+
+
+def _attributeIndices(polygons, index, perVertex):
+    """Index into an attribute node's values for each corner"""
+    index = arrays.asarray(index, 'i').ravel()
+    if perVertex:
+        if len(index):
+            return index[polygons.positions]
+        return polygons.values
+    if len(index):
+        return index[polygons.faces]
+    return polygons.faces
+
+
+def compileFaceSet(faceSet, indexed=False):
+    """Compile faceSet to a TriangleMesh (without caching)
+
+    indexed -- if true, share vertices whose coordinate and
+        attribute indices are all equal and return indices,
+        otherwise return de-indexed arrays
+    """
+    points = _values(faceSet, 'coord')
+    polygons = Polygons(faceSet.coordIndex)
+    if points is None:
+        points = arrays.zeros((0, 3), 'f')
+    triangles, owners = polygons.fan()
+    if not faceSet.convex:
+        concave = polygons.counts[owners] > 3
+        if arrays.any(concave):
+            extra, extraOwners = [], []
+            for polygon in arrays.unique(owners[concave]).tolist():
+                start = polygons.starts[polygon]
+                corners = arrays.arange(start, start + polygons.counts[polygon])
+                for a, b, c in earClip(points[polygons.values[corners]]):
+                    extra.append((corners[a], corners[b], corners[c]))
+                    extraOwners.append(polygon)
+            triangles = arrays.concatenate(
+                (triangles[~concave], arrays.array(extra, 'i').reshape((-1, 3)))
+            )
+            owners = arrays.concatenate(
+                (owners[~concave], arrays.array(extraOwners, owners.dtype))
+            )
+            order = arrays.argsort(owners, kind='stable')
+            triangles, owners = triangles[order], owners[order]
+    if not faceSet.ccw:
+        triangles = triangles[:, ::-1]
+    # (values, per-corner indices) for each attribute
+    attributes = [(points, polygons.values)]
+    for fieldName, indexName, perVertex in (
+        ('normal', 'normalIndex', faceSet.normalPerVertex),
+        ('color', 'colorIndex', faceSet.colorPerVertex),
+        ('texCoord', 'texCoordIndex', True),
+    ):
+        values = _values(faceSet, fieldName)
+        if values is None and fieldName == 'normal':
+            attributes.append(generatedNormals(faceSet))
+        elif values is None:
+            attributes.append(None)
+        else:
+            attributes.append(
+                (
+                    values,
+                    _attributeIndices(polygons, getattr(faceSet, indexName), perVertex),
+                )
+            )
+    corners = triangles.ravel()
+    if indexed:
+        keys = arrays.column_stack(
+            [indices for values, indices in [a for a in attributes if a is not None]]
+        )
+        keys, first, inverse = uniqueRows(keys[corners])
+        sources = corners[first]
+        indices = inverse.reshape((-1, 3)).astype('i')
+    else:
+        sources = corners
+        indices = None
+    arraysOut = [
+        None if attribute is None else attribute[0][attribute[1][sources]]
+        for attribute in attributes
+    ]
+    return TriangleMesh(
+        arraysOut[0],
+        normals=arraysOut[1],
+        colors=arraysOut[2],
+        texCoords=arraysOut[3],
+        indices=indices,
+        faces=owners,
+    )
+
+
+def triangleMesh(faceSet, indexed=False):
+    """Get the (cached) TriangleMesh for faceSet (see compileFaceSet)"""
+    key = ('triangleMesh', bool(indexed))
+    holder = cache.CACHE.getHolder(faceSet, key=key)
+    if holder is None:
+        holder = cache.CACHE.holder(faceSet, None, key=key)
+        for fieldName in FACE_SET_FIELDS:
+            holder.depend(faceSet, fieldName)
+    elif holder.data is not None:
+        return holder.data
+    mesh = compileFaceSet(faceSet, indexed)
+    # the attribute nodes may have been replaced since the holder was created
+    for fieldName, valueName in ATTRIBUTE_FIELDS.items():
+        attributeNode = getattr(faceSet, fieldName)
+        if attributeNode:
+            holder.depend(attributeNode, valueName)
+    holder.data = mesh
+    return mesh
@@ -1,10 +1,11 @@
 """Node-paths for VRML97 incl. transform-matrix calculation
 """
 from __future__ import generators
-from vrml import nodepath
+from vrml import nodepath, node
 from vrml.cache import CACHE
 from vrml.vrml97 import transformmatrix, nodetypes
 from vrml.arrays import *
+from pydispatch import dispatcher
 import weakref
 try:
     xrange 
@@ -50,7 +51,9 @@ class _NodePath( object ):
             return dot( p, matrix)
 
         That is, you use the homogenous coordinate, and
-        make it the first item in the dot'ing.
+        make it the first item in the dot'ing.  See transformPoints,
+        transformNormals and transformBounds for doing this for
+        whole arrays at once.
         """
         key=(['matrix','inverse_matrix'][int(bool(inverse))],translate,scale,rotate)
         holder = CACHE.getHolder( self, key=key )
@@ -84,6 +87,78 @@ class _NodePath( object ):
             matrix = identity(4, dtype='f')
         holder.data = matrix
         return holder.data
+    def transformPoints( self, points, inverse=False, out=None, **named ):
+        """Transform (N,3) points to world (or with inverse, local) space
+
+        points -- (N,3) array of local (world if inverse) coordinates
+        inverse -- if true, map world-space points into our local space
+        out -- optional (N,3) array into which to write the result,
+            may be points itself
+        named -- translate/scale/rotate flags for transformMatrix
+
+        Uses the cached path matrix, applying the linear portion and
+        the translation row directly rather than building homogeneous
+        copies of the points.
+
+        returns out (or a new (N,3) array)
+        """
+        matrix = self.transformMatrix( inverse=inverse, **named )
+        points = asarray( points )
+        if out is points:
+            result = matmul( points, matrix[:3,:3] )
+            out[...] = result
+        elif out is not None:
+            matmul( points, matrix[:3,:3].astype( out.dtype ), out=out )
+        else:
+            out = matmul( points, matrix[:3,:3] )
+        out += matrix[3,:3]
+        return out
+    def transformNormals( self, normals, inverse=False, out=None, normalize=True, **named ):
+        """Transform (N,3) normals to world (or with inverse, local) space
+
+        normals -- (N,3) array of local (world if inverse) normal vectors
+        inverse -- if true, map world-space normals into our local space
+        out -- optional (N,3) array into which to write the result
+        normalize -- if true, re-normalise the resulting vectors
+        named -- translate/scale/rotate flags for transformMatrix
+
+        Normals are transformed by the inverse-transpose of the linear
+        portion of the path matrix, so that they remain perpendicular
+        to (non-uniformly) scaled surfaces.
+
+        returns out (or a new (N,3) array)
+        """
+        matrix = self.transformMatrix( inverse=not inverse, **named )
+        normals = asarray( normals )
+        linear = matrix[:3,:3].T
+        if out is not None and out is not normals:
+            matmul( normals, linear.astype( out.dtype ), out=out )
+        else:
+            result = matmul( normals, linear )
+            if out is None:
+                out = result
+            else:
+                out[...] = result
+        if normalize:
+            lengths = sqrt( (out*out).sum( -1 ) )
+            out /= where( lengths == 0, 1.0, lengths )[...,newaxis]
+        return out
+    def transformBounds( self, bounds, inverse=False, out=None, **named ):
+        """Transform axis-aligned bounding boxes to world (or local) space
+
+        bounds -- (2,3) or (N,2,3) array of (minimum,maximum) corners
+        inverse -- if true, map world-space boxes into our local space
+        out -- optional array of bounds' shape into which to write
+        named -- translate/scale/rotate flags for transformMatrix
+
+        The result is the axis-aligned box enclosing the transformed
+        box, calculated from the box center and half-extents rather
+        than by transforming all 8 corners.
+
+        returns out (or a new array of bounds' shape)
+        """
+        matrix = self.transformMatrix( inverse=inverse, **named )
+        return transformmatrix.transformBounds( bounds, matrix, out=out )
     def transformChildren( self, reverse=0 ):
         """Yield all transforming children"""
         t = nodetypes.Transforming
@@ -133,3 +208,292 @@ class NodePath( _NodePath, nodepath.NodePath ):
     """Strong-reference version of VRML97 NodePath"""
 class WeakNodePath( _NodePath, nodepath.WeakNodePath ):
     """Weak-reference version of VRML97 NodePath"""
+
+CHILD_FIELDS = ('children','choice','level')
+
+def childNodes( item ):
+    """Get the scenegraph children of item (a SceneGraph or grouping node)
+
+    Only looks at values actually set on the node (does not
+    instantiate default values), prototyped nodes return
+    their rendered children.
+    """
+    if isinstance( item, node.PrototypedNode ):
+        return list(item.renderedChildren())
+    d = item.__dict__
+    result = []
+    for name in CHILD_FIELDS:
+        value = d.get( name )
+        if value:
+            result.extend( value )
+    return result
+
+def _flatten( root, pathClass=NodePath, leaves=None, leafTypes=() ):
+    """Flatten the Transform hierarchy under root
+
+    leaves -- if not None, a list to which (path, parent) is
+        appended for each node which is an instance of leafTypes,
+        where path is the list of nodes from root to the node and
+        parent is the index of its nearest Transforming ancestor
+
+    returns (nodes, parents, levels, paths, containers) where
+    parents[i] is the index of the nearest Transforming ancestor
+    of nodes[i] (or -1), levels[i] the number of such ancestors,
+    paths[i] the pathClass path from root to nodes[i] and containers
+    the list of every node whose children were traversed
+    """
+    isTransform = nodetypes.Transforming
+    nodes, parents, levels, paths, containers = [], [], [], [], []
+    stack = [(root, [root], -1, 0)]
+    while stack:
+        item, path, parent, level = stack.pop()
+        if isinstance( item, isTransform ):
+            index = len(nodes)
+            nodes.append( item )
+            parents.append( parent )
+            levels.append( level )
+            paths.append( pathClass( path ) )
+            parent, level = index, level+1
+        if leaves is not None and isinstance( item, leafTypes ):
+            leaves.append( (path, parent) )
+        children = childNodes( item )
+        if children or isinstance( item, nodetypes.Traversable ):
+            containers.append( item )
+        for child in children[::-1]:
+            stack.append( (child, path+[child], parent, level) )
+    return nodes, parents, levels, paths, containers
+
+def _matrixFields( translate=True, scale=True, rotate=True ):
+    """Get (fieldName, default) for the Transform fields affecting the matrix"""
+    fields = []
+    if translate:
+        fields.append( ('translation',(0,0,0)) )
+    if scale or rotate:
+        fields.append( ('center',(0,0,0)) )
+    if scale:
+        fields.append( ('scale',(1,1,1)) )
+        fields.append( ('scaleOrientation',(0,1,0,0)) )
+    if rotate:
+        fields.append( ('rotation',(0,1,0,0)) )
+    return fields
+
+def _localStacks( nodes, fields ):
+    """Build (forward,inverse) (N,4,4) local matrix stacks for nodes"""
+    if not fields or not len(nodes):
+        forward = zeros( (len(nodes),4,4), 'd' )
+        forward[:] = identity( 4, 'd' )
+        return forward, forward.copy()
+    dicts = [item.__dict__ for item in nodes]
+    return transformmatrix.localMatrixStacks( **dict([
+        (name, array( [d.get( name, default ) for d in dicts], 'd' ))
+        for (name,default) in fields
+    ]))
+
+def worldMatrices( root, translate=True, scale=True, rotate=True, pathClass=NodePath ):
+    """Calculate world matrices for every Transform path under root in one call
+
+    root -- SceneGraph (or grouping node) to traverse
+    translate, scale, rotate -- as for _NodePath.transformMatrix
+    pathClass -- path class used to construct the returned paths
+
+    The Transform hierarchy is flattened into arrays of field
+    values, every local matrix is built as a single (N,4,4) stack
+    and the parent-to-child products are propagated level by level
+    with batched matrix multiplication, so there is no per-path
+    Python dot'ing or cache-holder creation.
+
+    returns (paths, forward, inverse) where paths is a list of
+    pathClass instances from root to each Transforming node (depth
+    first order), and forward and inverse are (N,4,4) double arrays
+    equal to path.transformMatrix() and path.transformMatrix(inverse=True)
+    """
+    nodes, parents, levels, paths, containers = _flatten( root, pathClass )
+    forward, inverse = _localStacks( nodes, _matrixFields( translate, scale, rotate ) )
+    if nodes:
+        _propagate( forward, inverse, array( parents, 'l' ), array( levels, 'l' ) )
+    return paths, forward, inverse
+
+def _propagate( forward, inverse, parents, levels, indices=None ):
+    """Multiply local matrices by their parent's world matrices, level by level
+
+    indices -- if specified, only these entries are updated, their
+        parents must already hold world matrices (or be in indices)
+    """
+    if indices is None:
+        indices = arange( len(levels) )
+    if not len(indices):
+        return
+    levels = levels[indices]
+    order = argsort( levels, kind='stable' )
+    boundaries = searchsorted( levels[order], arange( levels.min()+1, levels.max()+1 ) )
+    for level in split( indices[order], boundaries ):
+        parent = parents[level]
+        rooted = parent < 0
+        if rooted.any():
+            level, parent = level[~rooted], parent[~rooted]
+        forward[level] = matmul( forward[level], forward[parent] )
+        inverse[level] = matmul( inverse[parent], inverse[level] )
+
+class TransformHierarchy( object ):
+    """Incrementally maintained world matrices for the Transforms under a root
+
+    Holds a local and world matrix for each Transform path under
+    root along with per-path dirty flags.  Changes to a Transform's
+    translation, rotation, scale, center or scaleOrientation mark
+    only that node's paths (and the paths below them) dirty, and
+    dirty matrices are recomputed lazily, top-down, re-using the
+    (still valid) parent world matrices.  Per-frame cost is thus
+    proportional to what actually moved, rather than requiring each
+    path's CACHE holder to recompute its whole chain.
+
+    Changes to children of the traversed grouping nodes cause the
+    hierarchy to be re-flattened on next access.
+
+    Note: a node which appears multiple times (DEF/USE) in the
+    hierarchy has one entry per path.
+    """
+    leaves = ()
+    def __init__( self, root, translate=True, scale=True, rotate=True, pathClass=NodePath, leafTypes=() ):
+        """Initialise the hierarchy for the given root (SceneGraph)
+
+        leafTypes -- node types (e.g. nodetypes.Rendering) for which
+            to record leaves, a list of (path, parent) where path
+            is the list of nodes from root to the leaf and parent
+            the index of the leaf's nearest Transform entry (or -1)
+        """
+        self.root = root
+        self.pathClass = pathClass
+        self.leafTypes = leafTypes
+        self.fields = _matrixFields( translate, scale, rotate )
+        self.signals = {}
+        self.rebuild()
+    def rebuild( self ):
+        """Re-flatten the hierarchy (discarding all current matrices)"""
+        leaves = [] if self.leafTypes else None
+        nodes, parents, levels, self.paths, containers = _flatten(
+            self.root, self.pathClass, leaves, self.leafTypes,
+        )
+        self.leaves = leaves or ()
+        self.nodes = nodes
+        self.parents = array( parents, 'l' )
+        self.levels = array( levels, 'l' )
+        self.children = [[] for item in nodes]
+        for index, parent in enumerate( parents ):
+            if parent >= 0:
+                self.children[parent].append( index )
+        self.entries = {}
+        for index,item in enumerate( nodes ):
+            self.entries.setdefault( id(item), [] ).append( index )
+        self.containers = dict([(id(item),item) for item in containers])
+        self.local = zeros( (len(nodes),2,4,4), 'd' )
+        self.forward = zeros( (len(nodes),4,4), 'd' )
+        self.inverse = zeros( (len(nodes),4,4), 'd' )
+        self.dirty = ones( (len(nodes),), 'bool' )
+        self.localDirty = ones( (len(nodes),), 'bool' )
+        self.structureDirty = False
+        self._connect( nodes, containers )
+    def _connect( self, nodes, containers ):
+        """Watch the matrix fields of nodes and child fields of containers"""
+        wanted = {}
+        for item in nodes:
+            for name,default in self.fields:
+                field = getattr( type(item), name, None )
+                if field is not None:
+                    wanted[id(field)] = (field, self.onTransformChange)
+        for item in containers:
+            for name in CHILD_FIELDS:
+                field = getattr( type(item), name, None )
+                if field is not None and hasattr( field, 'fget' ):
+                    wanted[id(field)] = (field, self.onStructureChange)
+        for key,(field,receiver) in wanted.items():
+            if key not in self.signals:
+                self.signals[key] = field
+                for signal in ('set','del','route'):
+                    dispatcher.connect( receiver, (signal,field) )
+    def onTransformChange( self, signal=None, sender=None, **named ):
+        """Mark the sender's entries (and their sub-trees) dirty"""
+        for index in self.entries.get( id(sender), () ):
+            self.localDirty[index] = True
+            self.markDirty( index )
+    def onStructureChange( self, signal=None, sender=None, **named ):
+        """Note that the hierarchy needs to be re-flattened"""
+        if id(sender) in self.containers:
+            self.structureDirty = True
+    def markDirty( self, index ):
+        """Mark entry index and all entries below it dirty
+
+        As a dirty entry always has dirty descendants, we only
+        descend into entries which were previously clean.
+        """
+        stack = [index]
+        dirty, children = self.dirty, self.children
+        while stack:
+            index = stack.pop()
+            if not dirty[index]:
+                dirty[index] = True
+                stack.extend( children[index] )
+    def update( self ):
+        """Recompute all dirty world matrices (batched, top-down)
+
+        returns (paths, forward, inverse) as for worldMatrices
+        """
+        if self.structureDirty:
+            self.rebuild()
+        indices = nonzero( self.localDirty )[0]
+        if len(indices):
+            forward, inverse = _localStacks( [self.nodes[i] for i in indices], self.fields )
+            self.local[indices,0] = forward
+            self.local[indices,1] = inverse
+            self.localDirty[indices] = False
+        indices = nonzero( self.dirty )[0]
+        if len(indices):
+            self.forward[indices] = self.local[indices,0]
+            self.inverse[indices] = self.local[indices,1]
+            _propagate( self.forward, self.inverse, self.parents, self.levels, indices )
+            self.dirty[indices] = False
+        return self.paths, self.forward, self.inverse
+    def index( self, path ):
+        """Find the entry index for the given path (or node, if unambiguous)"""
+        if self.structureDirty:
+            self.rebuild()
+        if isinstance( path, node.Node ):
+            entries = self.entries.get( id(path) )
+            if entries is None or len(entries) != 1:
+                raise KeyError( path )
+            return entries[0]
+        for index in self.entries.get( id(path[-1]), () ):
+            if self.paths[index] == path:
+                return index
+        raise KeyError( path )
+    def transformMatrix( self, path, inverse=False ):
+        """Get the (lazily updated) world matrix for the given path or node
+
+        Only the dirty entries between the path and its nearest clean
+        ancestor are recomputed.
+        """
+        index = self.index( path )
+        chain = []
+        current = index
+        while current >= 0 and self.dirty[current]:
+            chain.append( current )
+            current = self.parents[current]
+        for current in chain[::-1]:
+            if self.localDirty[current]:
+                d = self.nodes[current].__dict__
+                forward, backward = transformmatrix.localMatrices( **dict([
+                    (name, d.get( name )) for (name,default) in self.fields
+                ]))
+                self.local[current,0] = identity( 4 ) if forward is None else forward
+                self.local[current,1] = identity( 4 ) if backward is None else backward
+                self.localDirty[current] = False
+            parent = self.parents[current]
+            if parent >= 0:
+                self.forward[current] = dot( self.local[current,0], self.forward[parent] )
+                self.inverse[current] = dot( self.inverse[parent], self.local[current,1] )
+            else:
+                self.forward[current] = self.local[current,0]
+                self.inverse[current] = self.local[current,1]
+            self.dirty[current] = False
+        if inverse:
+            return self.inverse[index]
+        return self.forward[index]
@@ -0,0 +1,411 @@
+"""Evaluation and tessellation of the nodes in vrml.vrml97.nurbs
+
+basisFunctions(knots, degree, count, u) -- the non-zero B-spline
+    basis functions at every parameter value of u (Cox-de Boor)
+evaluateCurve, evaluateSurface -- (rational) NURBS curve points at
+    parameter values and surface points over a grid of values
+curvePolyline(node) -- get the (cached) Polyline for a NurbsCurve,
+    NurbsCurve2D, Polyline2D or Contour2D
+surfaceMesh(node) -- get the (cached) meshes.TriangleMesh for a
+    NurbsSurface or TrimmedSurface
+
+The basis functions are calculated with the triangular Cox-de Boor
+recurrence (Piegl and Tiller, "The NURBS Book", A2.2) applied to
+every parameter value at once, so the Python loops run over the
+degree of the curve, not the samples.  Surfaces are evaluated on a
+grid of (v,u) samples as two batched passes, along u for every row
+of control points, then along v.  Weights are applied through
+homogeneous coordinates, and per control point colours are
+interpolated with the points.
+
+Sample counts follow the tessellation rules of the NURBS proposal
+and X3D: a positive tessellation gives that many segments, a
+negative one -tessellation segments per control point, and 0 two
+segments per control point.  The count is multiplied by the scale
+argument, see tessellationScale for the scale of a path through
+NurbsGroups.
+
+Invalid knot vectors (of the wrong length, decreasing or with an
+empty domain) are replaced by a uniform open knot vector, and
+weights are ignored unless there is one per control point.
+
+TrimmedSurfaces are trimmed by dropping the triangles whose centre
+(in the surface's parameter space) lies outside the contours, by
+the even-odd rule, rather than by cutting triangles at the
+contours, so the trimmed edge is as fine as the tessellation.
+
+Results are cached in vrml.cache.CACHE (per node and scale), the
+cache is cleared when the fields of the node or of the nodes it
+refers to (a TrimmedSurface's surface and contours) change.
+"""
+
+from __future__ import unicode_literals
+
+from vrml import arrays, cache
+from vrml.protofunctions import protoName
+from vrml.vrml97 import meshes, procedural
+
+# fields on which each node's tessellation depends
+NURBS_FIELDS = {
+    'NurbsCurve': ('knot', 'order', 'controlPoint', 'color', 'weight', 'tessellation'),
+    'NurbsCurve2D': ('knot', 'order', 'controlPoint', 'weight', 'tessellation'),
+    'Polyline2D': ('point',),
+    'Contour2D': ('children',),
+    'NurbsSurface': (
+        'uDimension',
+        'vDimension',
+        'uKnot',
+        'vKnot',
+        'uOrder',
+        'vOrder',
+        'controlPoint',
+        'color',
+        'weight',
+        'uTessellation',
+        'vTessellation',
+        'ccw',
+    ),
+    'TrimmedSurface': ('trimmingContour', 'surface'),
+}
+
+
+class Polyline(object):
+    """Points sampled along a curve
+
+    points -- (N,3) (or (N,2) for 2D curves) points in order
+    colors -- (N,3) per-point colours or None
+    """
+
+    def __init__(self, points, colors=None):
+        self.points = points
+        self.colors = colors
+
+    def __len__(self):
+        return len(self.points)
+
+
+def defaultKnots(count, order):
+    """Uniform open knot vector for count control points"""
+    return arrays.concatenate(
+        (
+            arrays.zeros(order - 1),
+            arrays.linspace(0.0, 1.0, count - order + 2),
+            arrays.ones(order - 1),
+        )
+    )
+
+
+def knotVector(knot, count, order):
+    """Validated knot vector (see defaultKnots for invalid ones)"""
+    knots = arrays.asarray(knot, 'd').ravel()
+    if (
+        len(knots) != count + order
+        or arrays.any(arrays.diff(knots) < 0)
+        or not knots[order - 1] < knots[count]
+    ):
+        return defaultKnots(count, order)
+    return knots
+
+
+def basisFunctions(knots, degree, count, u):
+    """Evaluate the non-zero basis functions at every parameter in u
+
+    knots -- (count+degree+1,) knot vector
+    degree -- degree (order-1) of the basis functions
+    count -- number of control points
+    u -- (N,) parameter values within the knot vector's domain
+
+    returns ((N,) knot span of each value, (N,degree+1) values of
+    the basis functions span-degree to span at each value)
+    """
+    u = arrays.asarray(u, 'd').ravel()
+    spans = arrays.searchsorted(knots, u, side='right') - 1
+    spans = arrays.clip(spans, degree, count - 1)
+    basis = arrays.zeros((len(u), degree + 1), 'd')
+    basis[:, 0] = 1.0
+    left = arrays.zeros((len(u), degree + 1), 'd')
+    right = arrays.zeros((len(u), degree + 1), 'd')
+    for j in range(1, degree + 1):
+        left[:, j] = u - knots[spans + 1 - j]
+        right[:, j] = knots[spans + j] - u
+        saved = arrays.zeros(len(u), 'd')
+        for r in range(j):
+            denominator = right[:, r + 1] + left[:, j - r]
+            # repeated knots give zero-width spans
+            temp = arrays.where(
+                denominator != 0,
+                basis[:, r] / arrays.where(denominator != 0, denominator, 1.0),
+                0.0,
+            )
+            basis[:, r] = saved + right[:, r + 1] * temp
+            saved = left[:, j - r] * temp
+        basis[:, j] = saved
+    return spans, basis
+
+
+def _homogeneous(points, weights):
+    """(N,D+1) homogeneous coordinates of weighted points"""
+    points = arrays.asarray(points, 'd')
+    weights = arrays.asarray(weights, 'd').ravel()
+    if len(weights) != len(points):
+        weights = arrays.ones(len(points), 'd')
+    return arrays.column_stack((points * weights[:, arrays.newaxis], weights))
+
+
+def _project(homogeneous):
+    """Project (...,D+1) homogeneous coordinates back to (...,D)"""
+    weights = homogeneous[..., -1:]
+    return homogeneous[..., :-1] / arrays.where(weights != 0, weights, 1.0)
+
+
+def evaluateCurve(knots, order, controlPoints, weights, u):
+    """Evaluate a NURBS curve at the (N,) parameter values u
+
+    controlPoints -- (count,D) control points (with any extra
+        columns, e.g. colours, being interpolated the same way)
+    weights -- (count,) weights, or empty for a non-rational curve
+
+    returns (N,D) points
+    """
+    controlPoints = arrays.asarray(controlPoints, 'd')
+    count = len(controlPoints)
+    degree = order - 1
+    spans, basis = basisFunctions(knots, degree, count, u)
+    indices = spans[:, arrays.newaxis] - degree + arrays.arange(order)
+    homogeneous = _homogeneous(controlPoints, weights)[indices]
+    return _project(arrays.einsum('nk,nkd->nd', basis, homogeneous))
+
+
+def evaluateSurface(uKnots, vKnots, uOrder, vOrder, controlPoints, weights, u, v):
+    """Evaluate a NURBS surface over the grid of parameter values (v,u)
+
+    controlPoints -- (vDimension,uDimension,D) control points
+    weights -- (vDimension*uDimension,) weights or empty
+    u, v -- (U,) and (V,) parameter values
+
+    returns (V,U,D) points
+    """
+    controlPoints = arrays.asarray(controlPoints, 'd')
+    vDimension, uDimension, dimension = controlPoints.shape
+    homogeneous = _homogeneous(
+        controlPoints.reshape((-1, dimension)), weights
+    ).reshape((vDimension, uDimension, dimension + 1))
+    uSpans, uBasis = basisFunctions(uKnots, uOrder - 1, uDimension, u)
+    vSpans, vBasis = basisFunctions(vKnots, vOrder - 1, vDimension, v)
+    uIndices = uSpans[:, arrays.newaxis] - (uOrder - 1) + arrays.arange(uOrder)
+    vIndices = vSpans[:, arrays.newaxis] - (vOrder - 1) + arrays.arange(vOrder)
+    # along u for every row of control points, then along v
+    rows = arrays.einsum('uk,rukd->rud', uBasis, homogeneous[:, uIndices])
+    return _project(arrays.einsum('vl,vlud->vud', vBasis, rows[vIndices]))
+
+
+def segmentCount(tessellation, count, scale=1.0):
+    """Number of segments for a tessellation field value"""
+    if tessellation > 0:
+        segments = tessellation
+    elif tessellation < 0:
+        segments = -tessellation * count
+    else:
+        segments = 2 * count
+    return max(int(round(segments * scale)), 1)
+
+
+def samples(knots, order, count, segments):
+    """(segments+1,) parameter values evenly spaced over the knot domain"""
+    return arrays.linspace(knots[order - 1], knots[count], segments + 1)
+
+
+def tessellationScale(path):
+    """Product of the tessellationScale of the NurbsGroups in path"""
+    scale = 1.0
+    for node in path:
+        if protoName(node) == 'NurbsGroup':
+            scale *= node.tessellationScale
+    return scale
+
+
+def _cached(node, key, function, scale):
+    """Get node's tessellation from its CACHE holder, calculating it if needed"""
+    holder = cache.CACHE.getHolder(node, key=key)
+    if holder is None:
+        holder = cache.CACHE.holder(node, None, key=key)
+    elif holder.data is not None:
+        return holder.data
+    # the referenced nodes may have been replaced since the holder was created
+    _depend(holder, node)
+    holder.data = function(node, scale)
+    return holder.data
+
+
+def _depend(holder, node):
+    """Make holder depend on the fields of node and the nurbs nodes it refers to"""
+    fields = NURBS_FIELDS.get(protoName(node), ())
+    for fieldName in fields:
+        holder.depend(node, fieldName)
+    for fieldName in ('children', 'trimmingContour'):
+        if fieldName in fields:
+            for child in getattr(node, fieldName):
+                _depend(holder, child)
+    if 'surface' in fields and node.surface:
+        _depend(holder, node.surface)
+
+
+def _curve(node, scale, dimension):
+    """Sample a NurbsCurve/NurbsCurve2D"""
+    order = node.order
+    controlPoints = arrays.asarray(node.controlPoint, 'd').reshape((-1, dimension))
+    count = len(controlPoints)
+    if order < 2 or count < order:
+        return Polyline(arrays.zeros((0, dimension), 'f'))
+    knots = knotVector(node.knot, count, order)
+    u = samples(knots, order, count, segmentCount(node.tessellation, count, scale))
+    colors = arrays.asarray(getattr(node, 'color', ()), 'd').reshape((-1, 3))
+    if len(colors) == count:
+        controlPoints = arrays.column_stack((controlPoints, colors))
+    points = evaluateCurve(knots, order, controlPoints, node.weight, u)
+    if len(colors) == count:
+        return Polyline(
+            points[:, :dimension].astype('f'), points[:, dimension:].astype('f')
+        )
+    return Polyline(points.astype('f'))
+
+
+def _polyline(node, scale):
+    """Calculate the Polyline for a curve or contour node"""
+    name = protoName(node)
+    if name == 'NurbsCurve':
+        return _curve(node, scale, 3)
+    if name == 'NurbsCurve2D':
+        return _curve(node, scale, 2)
+    if name == 'Polyline2D':
+        return Polyline(arrays.asarray(node.point, 'f').reshape((-1, 2)))
+    if name == 'Contour2D':
+        # the contour's segments are joined in order
+        points = [curvePolyline(child, scale).points for child in node.children]
+        if not points:
+            return Polyline(arrays.zeros((0, 2), 'f'))
+        return Polyline(arrays.concatenate(points))
+    raise TypeError('Not a nurbs curve or contour: %r' % (node,))
+
+
+def curvePolyline(node, scale=1.0):
+    """Get the (cached) Polyline for a curve, Polyline2D or Contour2D"""
+    return _cached(node, ('curvePolyline', scale), _polyline, scale)
+
+
+def _inside(points, contours):
+    """Even-odd test of (N,2) points against closed (M,2) contours"""
+    starts = []
+    ends = []
+    for contour in contours:
+        if len(contour) > 1:
+            starts.append(contour)
+            ends.append(arrays.roll(contour, -1, axis=0))
+    inside = arrays.zeros(len(points), bool)
+    if not starts:
+        return inside
+    starts = arrays.concatenate(starts).astype('d')
+    ends = arrays.concatenate(ends).astype('d')
+    # (points, edges) pairs in blocks of about a million
+    step = max(1, 2 ** 20 // len(starts))
+    for first in range(0, len(points), step):
+        block = points[first : first + step, arrays.newaxis]
+        x, y = block[..., 0], block[..., 1]
+        straddles = (starts[:, 1] > y) != (ends[:, 1] > y)
+        height = ends[:, 1] - starts[:, 1]
+        crossing = starts[:, 0] + (y - starts[:, 1]) * (ends[:, 0] - starts[:, 0]) / (
+            arrays.where(height != 0, height, 1.0)
+        )
+        crossings = arrays.sum(straddles & (x < crossing), axis=1)
+        inside[first : first + step] = crossings % 2 == 1
+    return inside
+
+
+def _surface(node, scale):
+    """Tessellate a NurbsSurface, returning (mesh, (V*U,2) parameters)"""
+    uDimension, vDimension = node.uDimension, node.vDimension
+    uOrder, vOrder = node.uOrder, node.vOrder
+    controlPoints = arrays.asarray(node.controlPoint, 'd').reshape((-1, 3))
+    count = uDimension * vDimension
+    if (
+        uOrder < 2
+        or vOrder < 2
+        or uDimension < uOrder
+        or vDimension < vOrder
+        or len(controlPoints) != count
+    ):
+        return procedural.emptyMesh(), arrays.zeros((0, 2), 'd')
+    uKnots = knotVector(node.uKnot, uDimension, uOrder)
+    vKnots = knotVector(node.vKnot, vDimension, vOrder)
+    u = samples(
+        uKnots, uOrder, uDimension, segmentCount(node.uTessellation, uDimension, scale)
+    )
+    v = samples(
+        vKnots, vOrder, vDimension, segmentCount(node.vTessellation, vDimension, scale)
+    )
+    colors = arrays.asarray(node.color, 'd').reshape((-1, 3))
+    if len(colors) == count:
+        controlPoints = arrays.column_stack((controlPoints, colors))
+    values = evaluateSurface(
+        uKnots,
+        vKnots,
+        uOrder,
+        vOrder,
+        controlPoints.reshape((vDimension, uDimension, -1)),
+        node.weight,
+        u,
+        v,
+    )
+    parameters = arrays.empty((len(v), len(u), 2), 'd')
+    parameters[..., 0] = u
+    parameters[..., 1] = v[:, arrays.newaxis]
+    parameters = parameters.reshape((-1, 2))
+    low = arrays.array([uKnots[uOrder - 1], vKnots[vOrder - 1]])
+    high = arrays.array([uKnots[uDimension], vKnots[vDimension]])
+    # rows run along v and columns along u, so the quads are
+    # counterclockwise about the dS/du x dS/dv normal
+    mesh = procedural.gridMesh(
+        values[..., :3],
+        texCoords=(parameters - low) / (high - low),
+        colors=(
+            (values[..., 3:].reshape((-1, 3)), True) if len(colors) == count else None
+        ),
+        creaseAngle=arrays.pi,
+        ccw=node.ccw,
+    )
+    return mesh, parameters
+
+
+def _trimmed(node, scale):
+    """Tessellate a NurbsSurface or TrimmedSurface"""
+    name = protoName(node)
+    if name == 'NurbsSurface':
+        return _surface(node, scale)[0]
+    if name != 'TrimmedSurface':
+        raise TypeError('Not a nurbs surface: %r' % (node,))
+    if not node.surface:
+        return procedural.emptyMesh()
+    mesh, parameters = _surface(node.surface, scale)
+    contours = [
+        curvePolyline(contour, scale).points for contour in node.trimmingContour
+    ]
+    if not len(mesh) or not contours:
+        return mesh
+    centres = parameters[mesh.indices].mean(axis=1)
+    keep = _inside(centres, contours)
+    return meshes.TriangleMesh(
+        mesh.vertices,
+        normals=mesh.normals,
+        colors=mesh.colors,
+        texCoords=mesh.texCoords,
+        indices=mesh.indices[keep],
+        faces=mesh.faces[keep],
+    )
+
+
+def surfaceMesh(node, scale=1.0):
+    """Get the (cached) TriangleMesh for a NurbsSurface or TrimmedSurface
+
+    scale -- multiplies the number of segments (see tessellationScale)
+    """
+    return _cached(node, ('surfaceMesh', scale), _trimmed, scale)
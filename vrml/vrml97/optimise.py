@@ -0,0 +1,632 @@
+"""Optimisation passes over VRML97 scene-graphs
+
+deduplicate -- share structurally identical nodes (e.g. the
+    thousands of identical Material or Coordinate nodes written
+    by exporters which do not use DEF/USE)
+flattenTransforms -- bake the matrices of static Transforms
+    into the coordinates and normals of the geometry below them
+"""
+
+from __future__ import unicode_literals
+
+from vrml import arrays, node
+from vrml.protofunctions import *
+from vrml.vrml97 import basenodes, bounds, hashing, linearise, transformmatrix
+
+# node types which deduplicate shares by default, nodes with
+# time-dependent behaviour or other identity-dependent state
+# (e.g. sensors, MovieTexture, Scripts) are not included
+DEDUPLICATE = (
+    'Appearance',
+    'Color',
+    'Coordinate',
+    'FontStyle',
+    'ImageTexture',
+    'Material',
+    'Normal',
+    'PixelTexture',
+    'TextureCoordinate',
+    'TextureTransform',
+)
+
+
+def nodeFields(clientNode):
+    """The SFNode/MFNode fields which clientNode has set"""
+    dictionary = clientNode.__dict__
+    return [
+        field
+        for field in getFields(clientNode)
+        if field.nodes and field.name[:1] != ' ' and field.name in dictionary
+    ]
+
+
+def childNodes(clientNode):
+    """The nodes referenced by clientNode's SFNode/MFNode fields"""
+    result = []
+    for field in nodeFields(clientNode):
+        value = clientNode.__dict__[field.name]
+        if isinstance(value, node.Node):
+            value = [value]
+        result.extend([item for item in value if item is not node.NULL])
+    return result
+
+
+def walk(nodes):
+    """Yield each distinct node reachable from nodes"""
+    seen = set()
+    pending = list(nodes)
+    while pending:
+        current = pending.pop()
+        if not isinstance(current, node.Node) or id(current) in seen:
+            continue
+        seen.add(id(current))
+        yield current
+        pending.extend(childNodes(current))
+
+
+def nodeTree(nodes):
+    """(distinct nodes, maximum nesting depth) of the scene-graph below nodes"""
+    depths = {}
+
+    def depth(current):
+        key = id(current)
+        if key not in depths:
+            # cyclic references (through Scripts) end the path
+            depths[key] = 0
+            children = [depth(child) for child in childNodes(current)]
+            depths[key] = 1 + max(children or [0])
+        return depths[key]
+
+    deepest = max([depth(item) for item in nodes if isinstance(item, node.Node)] or [0])
+    return len(depths), deepest
+
+
+def arrayBytes(nodes):
+    """Bytes of the (distinct) numeric arrays held by nodes and their children"""
+    seen = set()
+    arraysSeen = set()
+    total = 0
+    pending = list(nodes)
+    while pending:
+        current = pending.pop()
+        if not isinstance(current, node.Node) or id(current) in seen:
+            continue
+        seen.add(id(current))
+        for value in list(current.__dict__.values()):
+            if isinstance(value, arrays.ArrayType):
+                if id(value) not in arraysSeen:
+                    arraysSeen.add(id(value))
+                    total += value.nbytes
+        for field in nodeFields(current):
+            value = current.__dict__[field.name]
+            if isinstance(value, node.Node):
+                pending.append(value)
+            else:
+                pending.extend(value)
+    return total
+
+
+class DeduplicateReport(object):
+    """Summary of a deduplicate pass
+
+    replaced -- number of references re-pointed to a shared node
+    removed -- {protoName: number of duplicate nodes dropped}
+    before, after -- bytes of array data referenced by the
+        scene-graph before and after the pass
+    """
+
+    def __init__(self):
+        self.replaced = 0
+        self.removed = {}
+        self.before = self.after = 0
+
+    @property
+    def saved(self):
+        """Bytes of array data no longer referenced"""
+        return self.before - self.after
+
+    def __str__(self):
+        removed = ', '.join(
+            ['%s: %s' % (key, count) for key, count in sorted(self.removed.items())]
+        )
+        return 'Deduplicated %s references (%s), saved %s of %s array bytes' % (
+            self.replaced,
+            removed or 'none',
+            self.saved,
+            self.before,
+        )
+
+
+class Deduplicator(object):
+    """Shares structurally identical nodes within a scene-graph
+
+    Candidate nodes are grouped by vrml.vrml97.hashing's
+    structural hash, and are only shared once their content has
+    been compared, so hash collisions do not merge nodes.
+
+    Nodes which are the source or destination of a ROUTE or
+    which are reachable from a Script's fields are never
+    replaced (their identity is observable), nor are the
+    bodies of PROTOs (IS mappings refer to particular nodes).
+    DEF'd nodes are never replaced either (they are looked up
+    by name), they become the shared node of their group.
+    """
+
+    def __init__(self, types=DEDUPLICATE):
+        self.types = set(types)
+
+    def run(self, sceneGraph):
+        """Deduplicate sceneGraph, returns a DeduplicateReport"""
+        self.report = DeduplicateReport()
+        self.report.before = arrayBytes(sceneGraph.children)
+        # structural hash: [canonical nodes]
+        self.canonical = {}
+        # id(node): node with its children shared
+        self.visited = {}
+        # id(duplicate): canonical
+        self.replacements = {}
+        self.shared = {}
+        self.protected = self.protect(sceneGraph)
+        self.named = set([id(value) for value in sceneGraph.defNames.values()])
+        # register DEF'd nodes first so their unnamed duplicates use them
+        for current in walk(sceneGraph.children):
+            if defName(current) or id(current) in self.named:
+                self.named.add(id(current))
+                self.canonicalise(current)
+        children = [self.share(child) for child in sceneGraph.children]
+        if any([a is not b for a, b in zip(children, sceneGraph.children)]):
+            sceneGraph.children = children
+        self.name(sceneGraph)
+        self.report.after = arrayBytes(sceneGraph.children)
+        return self.report
+
+    def protect(self, sceneGraph):
+        """ids of nodes whose identity is observable"""
+        protected = set()
+        pending = []
+        for route in sceneGraph.routes:
+            pending.extend([route.source, route.destination])
+        for current in list(walk(sceneGraph.children)):
+            if protoName(current) == 'Script':
+                pending.extend(childNodes(current))
+        for current in walk(pending):
+            protected.add(id(current))
+        return protected
+
+    def share(self, clientNode):
+        """Share clientNode's children, return clientNode's replacement"""
+        if not isinstance(clientNode, node.Node) or clientNode is node.NULL:
+            return clientNode
+        key = id(clientNode)
+        if key in self.visited:
+            return self.visited[key]
+        # cyclic references (through Scripts) resolve to the node itself
+        self.visited[key] = clientNode
+        if key not in self.protected:
+            for field in nodeFields(clientNode):
+                value = clientNode.__dict__[field.name]
+                if isinstance(value, node.Node):
+                    shared = self.share(value)
+                    if shared is not value:
+                        field.fset(clientNode, shared)
+                else:
+                    shared = [self.share(item) for item in value]
+                    if any([a is not b for a, b in zip(shared, value)]):
+                        field.fset(clientNode, shared)
+        result = self.visited[key] = self.canonicalise(clientNode)
+        if result is not clientNode:
+            self.report.replaced += 1
+            self.shared[id(result)] = result
+            name = protoName(clientNode)
+            self.report.removed[name] = self.report.removed.get(name, 0) + 1
+            self.replacements[key] = result
+        return result
+
+    def canonicalise(self, clientNode):
+        """Find the first (DEF'd) node identical to clientNode"""
+        if id(clientNode) in self.protected or protoName(clientNode) not in self.types:
+            return clientNode
+        candidates = self.canonical.setdefault(hashing.structuralHash(clientNode), [])
+        if id(clientNode) in self.named:
+            if not any([candidate is clientNode for candidate in candidates]):
+                candidates.append(clientNode)
+            return clientNode
+        for candidate in candidates:
+            if self.identical(candidate, clientNode):
+                return candidate
+        candidates.append(clientNode)
+        return clientNode
+
+    def identical(self, first, second):
+        """Compare the content of two nodes (with shared children)"""
+        if first is second:
+            return True
+        prototype = getPrototype(first)
+        if prototype is not getPrototype(second) or not builtin(prototype):
+            return False
+        for field, isDefault, category in linearise.fieldTable(prototype).fields:
+            a = first.__dict__.get(field.name, field)
+            b = second.__dict__.get(field.name, field)
+            if a is field:
+                a = field.getDefault()
+            if b is field:
+                b = field.getDefault()
+            if field.nodes:
+                if isinstance(a, node.Node) or isinstance(b, node.Node):
+                    if not self.identical(a, b):
+                        return False
+                elif len(a) != len(b) or not all(
+                    [self.identical(x, y) for x, y in zip(a, b)]
+                ):
+                    return False
+            elif isinstance(a, arrays.ArrayType) or isinstance(b, arrays.ArrayType):
+                a, b = arrays.asarray(a), arrays.asarray(b)
+                if a.shape != b.shape or a.dtype != b.dtype:
+                    return False
+                if not arrays.array_equal(a, b):
+                    return False
+            elif a != b:
+                return False
+        return True
+
+    def name(self, sceneGraph):
+        """Give shared nodes DEF names so they are linearised as DEF/USE"""
+        for key, value in list(sceneGraph.defNames.items()):
+            if id(value) in self.replacements:
+                sceneGraph.defNames[key] = self.replacements[id(value)]
+        for clientNode in self.shared.values():
+            if defName(clientNode):
+                continue
+            base = protoName(clientNode)
+            index = 1
+            while '%s_%d' % (base, index) in sceneGraph.defNames:
+                index += 1
+            sceneGraph.regDefName('%s_%d' % (base, index), clientNode)
+
+
+def deduplicate(sceneGraph, types=DEDUPLICATE):
+    """Share structurally identical nodes of the given types
+
+    sceneGraph -- the scene-graph to rewrite in-place
+    types -- protoNames of the node types to share
+
+    Shared nodes without DEF names are given one, so the
+    lineariser writes them as DEF/USE.
+
+    returns DeduplicateReport
+    """
+    return Deduplicator(types).run(sceneGraph)
+
+
+def sameNodes(first, second):
+    """Whether two lists hold the same nodes"""
+    return len(first) == len(second) and all(
+        [a is b for a, b in zip(first, second)]
+    )
+
+
+# geometry types whose coordinates flattenTransforms bakes
+# matrices into, with their (coordinate, normal) fields
+BAKEABLE = {
+    'IndexedFaceSet': ('coord', 'normal'),
+    'IndexedLineSet': ('coord', None),
+    'PointSet': ('coord', None),
+}
+
+
+class FlattenReport(object):
+    """Summary of a flattenTransforms pass
+
+    collapsed -- number of Transforms removed
+    copied -- {protoName: number of nodes copied} for nodes which
+        are also used with a different (or no) baked matrix
+    nodesBefore, nodesAfter -- distinct nodes in the scene-graph
+    depthBefore, depthAfter -- maximum nesting depth of the scene-graph
+    """
+
+    def __init__(self):
+        self.collapsed = 0
+        self.copied = {}
+        self.nodesBefore = self.nodesAfter = 0
+        self.depthBefore = self.depthAfter = 0
+
+    def __str__(self):
+        copied = ', '.join(
+            ['%s: %s' % (key, count) for key, count in sorted(self.copied.items())]
+        )
+        return 'Collapsed %s Transforms (copied %s), nodes %s -> %s, depth %s -> %s' % (
+            self.collapsed,
+            copied or 'none',
+            self.nodesBefore,
+            self.nodesAfter,
+            self.depthBefore,
+            self.depthAfter,
+        )
+
+
+class Flattener(object):
+    """Collapses static Transforms into the geometry below them
+
+    A Transform is static when its subtree holds only Transforms,
+    Groups and Shapes with BAKEABLE geometry (or none), none of
+    which is the source or destination of a ROUTE or IS mapping
+    or reachable from a Script's fields, and neither it nor the
+    Transforms below it have DEF names (which the browser API
+    could use to reach them).  Static Transforms whose parent is
+    kept are replaced by their children, with the Transforms'
+    matrices baked into Coordinate.point and Normal.vector (and
+    IndexedFaceSet.ccw flipped by mirroring matrices).
+
+    Nodes are modified in-place when all of their uses have the
+    same baked matrix, otherwise copied for each further matrix.
+    Changes are applied once every copy has been taken.
+    """
+
+    def run(self, sceneGraph):
+        """Flatten sceneGraph, returns a FlattenReport"""
+        self.report = FlattenReport()
+        self.report.nodesBefore, self.report.depthBefore = nodeTree(
+            sceneGraph.children
+        )
+        self.protected = self.protect(sceneGraph)
+        self.named = set([id(value) for value in sceneGraph.defNames.values()])
+        # id(node): whether its subtree is static
+        self.statics = {}
+        # id(transform): local matrix
+        self.matrices = {}
+        # id(node): [matrix keys of its uses, None when untransformed]
+        self.uses = {}
+        for child in sceneGraph.children:
+            self.plan(child, None)
+        # (id(node), matrix key): transformed node
+        self.results = {}
+        self.claimed = set()
+        self.kept = set()
+        self.collapsed = set()
+        self.assignments = []
+        children = self.expand(sceneGraph.children)
+        for target, fieldName, value in self.assignments:
+            getField(target, fieldName).fset(target, value)
+        if not sameNodes(children, sceneGraph.children):
+            sceneGraph.children = children
+        self.report.collapsed = len(self.collapsed)
+        self.report.nodesAfter, self.report.depthAfter = nodeTree(sceneGraph.children)
+        return self.report
+
+    def protect(self, sceneGraph):
+        """ids of nodes whose fields are observable"""
+        protected = set()
+        for route in sceneGraph.routes:
+            protected.update([id(route.source), id(route.destination)])
+        prototypes = list(sceneGraph.protoTypes.values())
+        pending = []
+        for current in list(walk(sceneGraph.children)):
+            prototypes.append(getPrototype(current))
+            if protoName(current) == 'Script':
+                pending.extend(childNodes(current))
+        for prototype in prototypes:
+            for targets in node.ISMAPS.get(prototype, {}).values():
+                protected.update([id(target) for target, fieldName in targets])
+        for current in walk(pending):
+            protected.add(id(current))
+        return protected
+
+    def static(self, current):
+        """Whether current's subtree can have a matrix baked into it"""
+        key = id(current)
+        if key not in self.statics:
+            # cyclic references are not static
+            self.statics[key] = False
+            self.statics[key] = self._static(current)
+        return self.statics[key]
+
+    def _static(self, current):
+        if id(current) in self.protected or not builtin(getPrototype(current)):
+            return False
+        name = protoName(current)
+        if name == 'Transform':
+            if defName(current) or id(current) in self.named:
+                return False
+            matrix = self.local(current)
+            # a collapsed (zero) scale has no normal matrix
+            if matrix is not None and not arrays.linalg.det(matrix[:3, :3]):
+                return False
+            return all([self.static(child) for child in current.children])
+        if name == 'Group':
+            return all([self.static(child) for child in current.children])
+        if name == 'Shape':
+            geometry = current.geometry
+            if not geometry:
+                return True
+            fields = BAKEABLE.get(protoName(geometry))
+            if fields is None or id(geometry) in self.protected:
+                return False
+            return not any(
+                [
+                    id(getattr(geometry, fieldName)) in self.protected
+                    for fieldName in fields
+                    if fieldName
+                ]
+            )
+        return False
+
+    def collapsible(self, current):
+        """Whether current is a Transform to be collapsed"""
+        return protoName(current) == 'Transform' and self.static(current)
+
+    def local(self, transform):
+        """transform's local matrix (None for identity)
+
+        Calculated directly rather than through the Transform's
+        cached localMatrices, which would connect to the fields
+        of the nodes being removed.
+        """
+        key = id(transform)
+        if key not in self.matrices:
+            values = [
+                (fieldName, getattr(transform, fieldName))
+                for fieldName in bounds.MATRIX_FIELDS
+            ]
+            self.matrices[key] = transformmatrix.localMatrices(**dict(values))[0]
+        return self.matrices[key]
+
+    def combine(self, transform, matrix):
+        """The matrix baked into the children of a collapsed transform"""
+        local = self.local(transform)
+        if local is None:
+            return matrix
+        if matrix is None:
+            return local
+        return arrays.dot(local, matrix)
+
+    def plan(self, current, matrix):
+        """Record the matrix of each use of current and the nodes below it"""
+        key = None if matrix is None else matrix.tobytes()
+        uses = self.uses.setdefault(id(current), [])
+        if key in uses:
+            return
+        uses.append(key)
+        if self.collapsible(current):
+            for child in current.children:
+                self.plan(child, self.combine(current, matrix))
+        elif matrix is None:
+            for child in childNodes(current):
+                self.plan(child, None)
+        elif protoName(current) == 'Group':
+            for child in current.children:
+                self.plan(child, matrix)
+        elif protoName(current) == 'Shape':
+            if current.geometry:
+                self.plan(current.geometry, matrix)
+        elif protoName(current) in BAKEABLE:
+            for fieldName in BAKEABLE[protoName(current)]:
+                if fieldName and getattr(current, fieldName):
+                    self.plan(getattr(current, fieldName), matrix)
+
+    def expand(self, nodes):
+        """nodes with collapsible Transforms replaced by their children"""
+        result = []
+        for current in nodes:
+            if isinstance(current, node.Node) and self.collapsible(current):
+                result.extend(self.flatten(current, None))
+            else:
+                self.keep(current)
+                result.append(current)
+        return result
+
+    def keep(self, current):
+        """Collapse the static Transforms in the fields of a kept node"""
+        if not isinstance(current, node.Node) or id(current) in self.kept:
+            return
+        self.kept.add(id(current))
+        if not builtin(getPrototype(current)) or protoName(current) == 'Script':
+            return
+        for field in nodeFields(current):
+            value = current.__dict__[field.name]
+            if isinstance(value, node.Node):
+                if value is not node.NULL:
+                    expanded = self.expand([value])
+                    if not sameNodes(expanded, [value]):
+                        self.assign(current, field.name, self.group(expanded))
+            elif field.name == 'children':
+                expanded = self.expand(value)
+                if not sameNodes(expanded, value):
+                    self.assign(current, field.name, expanded)
+            else:
+                # one node per entry (e.g. Switch.choice, LOD.level)
+                expanded = [self.expand([item]) for item in value]
+                grouped = [self.group(items) for items in expanded]
+                if not sameNodes(grouped, value):
+                    self.assign(current, field.name, grouped)
+
+    def group(self, nodes):
+        """A single node holding nodes"""
+        if len(nodes) == 1:
+            return nodes[0]
+        return basenodes.Group(children=nodes)
+
+    def flatten(self, transform, matrix):
+        """The nodes replacing a collapsed transform (within matrix)"""
+        self.collapsed.add(id(transform))
+        matrix = self.combine(transform, matrix)
+        result = []
+        for child in transform.children:
+            if self.collapsible(child):
+                result.extend(self.flatten(child, matrix))
+            else:
+                result.append(self.bake(child, matrix))
+        return result
+
+    def bake(self, current, matrix):
+        """current with matrix applied"""
+        if matrix is None:
+            self.keep(current)
+            return current
+        key = (id(current), matrix.tobytes())
+        if key in self.results:
+            return self.results[key]
+        target = self.results[key] = self.target(current)
+        name = protoName(current)
+        if name == 'Group':
+            children = []
+            for child in current.children:
+                if self.collapsible(child):
+                    children.extend(self.flatten(child, matrix))
+                else:
+                    children.append(self.bake(child, matrix))
+            self.assign(target, 'children', children)
+        elif name == 'Shape':
+            if current.geometry:
+                self.assign(target, 'geometry', self.bake(current.geometry, matrix))
+        elif name in BAKEABLE:
+            for fieldName in BAKEABLE[name]:
+                if fieldName and getattr(current, fieldName):
+                    value = self.bake(getattr(current, fieldName), matrix)
+                    self.assign(target, fieldName, value)
+            if name == 'IndexedFaceSet' and arrays.linalg.det(matrix[:3, :3]) < 0:
+                self.assign(target, 'ccw', not current.ccw)
+        elif name == 'Coordinate':
+            points = arrays.asarray(current.point, 'd').reshape((-1, 3))
+            points = arrays.dot(points, matrix[:3, :3]) + matrix[3, :3]
+            self.assign(target, 'point', points.astype('f'))
+        elif name == 'Normal':
+            vectors = arrays.asarray(current.vector, 'd').reshape((-1, 3))
+            vectors = arrays.dot(vectors, arrays.linalg.inv(matrix[:3, :3]).T)
+            lengths = arrays.sqrt(arrays.sum(vectors * vectors, axis=1))
+            vectors /= arrays.where(lengths > 0, lengths, 1.0)[:, arrays.newaxis]
+            self.assign(target, 'vector', vectors.astype('f'))
+        return target
+
+    def target(self, current):
+        """current for its first transformed use if all its uses are, else a copy"""
+        uses = self.uses.get(id(current), ())
+        if None not in uses and id(current) not in self.claimed:
+            self.claimed.add(id(current))
+            return current
+        copy = type(current).__new__(type(current))
+        copy.__dict__.update(
+            [
+                (field.name, current.__dict__[field.name])
+                for field in getFields(current)
+                if field.name in current.__dict__ and field.name != ' DEF'
+            ]
+        )
+        name = protoName(current)
+        self.report.copied[name] = self.report.copied.get(name, 0) + 1
+        return copy
+
+    def assign(self, target, fieldName, value):
+        """Set target's field once the pass has read every original value"""
+        self.assignments.append((target, fieldName, value))
+
+
+def flattenTransforms(sceneGraph):
+    """Collapse static Transforms into the geometry below them
+
+    sceneGraph -- the scene-graph to rewrite in-place
+
+    See Flattener for the Transforms which are collapsed.
+
+    returns FlattenReport
+    """
+    return Flattener().run(sceneGraph)
@@ -0,0 +1,356 @@
+"""Vectorised ray picking against a scene-graph's triangulated geometry
+
+rayTriangles(origins, directions, triangles) -- Moller-Trumbore
+    intersection of each ray with its paired triangle
+Picker -- intersects batches of rays with the Shapes of a
+    scene-graph (through a vrml.vrml97.bvh.SceneBVH)
+pick(scene, origins, directions) -- one-shot form of Picker.intersect
+
+The Picker transforms the triangles of every Shape's geometry (see
+TRIANGULATORS) to world space and builds a vrml.vrml97.bvh.BVH over
+the triangles' boxes.  Rays descend the tree together, each level
+testing every (ray,node) pair of the frontier with one slab test,
+and the (ray,triangle) pairs reaching the leaves are tested with
+one rayTriangles call.  A ray's closest hit so far prunes the
+nodes further along the ray.
+
+Large batches are split into chunks of chunkSize rays which are
+traced on a thread pool, NumPy releasing the GIL for the bulk
+of the array operations.
+
+When the scene changes, the triangles of moved or changed Shapes
+are re-transformed and the tree refitted, the tree is only
+rebuilt when the scene's structure or a Shape's triangle count
+changes.
+"""
+
+from __future__ import unicode_literals
+
+from vrml import arrays
+from vrml.protofunctions import protoName
+from vrml.vrml97 import bvh, meshes, nurbseval, primitives, procedural
+
+
+def faceSetMesh(geometry):
+    """Get the (cached) indexed TriangleMesh for an IndexedFaceSet"""
+    return meshes.triangleMesh(geometry, indexed=True)
+
+
+# geometry protoName: function returning the geometry's TriangleMesh
+TRIANGULATORS = {
+    'IndexedFaceSet': faceSetMesh,
+    'Box': primitives.primitiveMesh,
+    'Sphere': primitives.primitiveMesh,
+    'Cone': primitives.primitiveMesh,
+    'Cylinder': primitives.primitiveMesh,
+    'ElevationGrid': procedural.elevationGridMesh,
+    'Extrusion': procedural.extrusionMesh,
+    'NurbsSurface': nurbseval.surfaceMesh,
+    'TrimmedSurface': nurbseval.surfaceMesh,
+}
+
+
+def shapeMesh(shape):
+    """Get the TriangleMesh for shape's geometry, or None if not triangulated"""
+    geometry = getattr(shape, 'geometry', None)
+    if not geometry:
+        return None
+    function = TRIANGULATORS.get(protoName(geometry))
+    if function is None:
+        return None
+    return function(geometry)
+
+
+def meshTriangles(mesh):
+    """Get the (T,3) vertex indices of each of mesh's triangles"""
+    if mesh.indices is not None:
+        return mesh.indices
+    return arrays.arange(len(mesh.vertices)).reshape((-1, 3))
+
+
+def rayTriangles(origins, directions, triangles):
+    """Moller-Trumbore intersection of rays with triangles
+
+    origins, directions -- (N,3) rays
+    triangles -- (N,3,3) vertices of the triangle tested against
+        each ray, triangles are hit from either side
+
+    returns (t,u,v) (N,) arrays, where the hit point is
+    origins+t*directions, and (1-u-v,u,v) are its barycentric
+    coordinates, t is inf where the ray misses its triangle
+    """
+    first = triangles[:, 0]
+    edge1 = triangles[:, 1] - first
+    edge2 = triangles[:, 2] - first
+    p = arrays.cross(directions, edge2)
+    determinant = arrays.einsum('ij,ij->i', edge1, p)
+    inverse = 1.0 / determinant
+    s = origins - first
+    u = arrays.einsum('ij,ij->i', s, p) * inverse
+    q = arrays.cross(s, edge1)
+    v = arrays.einsum('ij,ij->i', directions, q) * inverse
+    t = arrays.einsum('ij,ij->i', edge2, q) * inverse
+    hit = (determinant != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return arrays.where(hit, t, arrays.inf), u, v
+
+
+class Hits(object):
+    """Closest hits of a batch of rays
+
+    distances -- (R,) distance along each ray to its hit (inf for
+        misses), in world units
+    leaves -- (R,) SceneBVH leaf hit by each ray (-1 for misses)
+    triangles -- (R,) index of the triangle hit within the leaf's
+        TriangleMesh (-1 for misses)
+    barycentrics -- (R,3) barycentric coordinates of the hit
+        points within their triangles
+    points -- (R,3) world-space hit points (inf for misses)
+    """
+
+    def __init__(self, picker, count):
+        self.picker = picker
+        self.distances = arrays.full(count, arrays.inf, 'd')
+        self.leaves = arrays.full(count, -1, 'l')
+        self.triangles = arrays.full(count, -1, 'l')
+        self.barycentrics = arrays.zeros((count, 3), 'd')
+        self.points = arrays.full((count, 3), arrays.inf, 'd')
+
+    def __len__(self):
+        return len(self.distances)
+
+    @property
+    def hit(self):
+        """(R,) boolean array, true for rays which hit something"""
+        return self.leaves >= 0
+
+    def faces(self):
+        """(R,) index of the polygon hit by each ray (-1 for misses)"""
+        faces = arrays.full(len(self), -1, 'l')
+        for index in arrays.flatnonzero(self.hit):
+            mesh = self.picker.meshes[self.leaves[index]]
+            if mesh.faces is not None:
+                faces[index] = mesh.faces[self.triangles[index]]
+        return faces
+
+    def path(self, index):
+        """Get the path to the Shape hit by ray index, or None"""
+        leaf = self.leaves[index]
+        if leaf < 0:
+            return None
+        return self.picker.scene.path(leaf)
+
+    def paths(self):
+        """Get the path to the Shape hit by each ray (None for misses)"""
+        return [self.path(index) for index in range(len(self))]
+
+
+class Picker(object):
+    """Ray picking against the triangles of a scene-graph's Shapes
+
+    scene -- the vrml.vrml97.bvh.SceneBVH tracking the Shapes and
+        their world matrices, updated before each intersection
+    meshes -- TriangleMesh for each of the scene's leaves (None for
+        Shapes whose geometry is not triangulated)
+    offsets -- (L+1,) start of each leaf's triangles in triangles
+    triangles -- (T,3,3) world-space vertices of every triangle
+    triangleLeaves -- (T,) leaf to which each triangle belongs
+    tree -- BVH over the boxes of the triangles
+    """
+
+    def __init__(
+        self, scene, leafSize=4, method='sah', chunkSize=1024, workers=None, **named
+    ):
+        """Initialise the picker
+
+        scene -- SceneBVH, or a root (SceneGraph or grouping node)
+            for which to build a SceneBVH (with named arguments)
+        leafSize, method -- passed to the triangle BVH
+        chunkSize -- number of rays traced together
+        workers -- maximum number of threads tracing chunks of a
+            batch, None for the concurrent.futures default, 1 to
+            trace in the calling thread
+        """
+        if not isinstance(scene, bvh.SceneBVH):
+            scene = bvh.SceneBVH(scene, **named)
+        self.scene = scene
+        self.leafSize = leafSize
+        self.method = method
+        self.chunkSize = chunkSize
+        self.workers = workers
+        self.rebuild()
+
+    def rebuild(self):
+        """Re-triangulate every Shape and rebuild the tree"""
+        scene = self.scene
+        self.sceneTree = scene.tree
+        self.meshes = [shapeMesh(shape) for shape in scene.shapes]
+        counts = arrays.array(
+            [
+                0 if mesh is None else len(meshTriangles(mesh))
+                for mesh in self.meshes
+            ],
+            'l',
+        )
+        self.offsets = arrays.concatenate(([0], arrays.cumsum(counts)))
+        self.triangles = arrays.zeros((self.offsets[-1], 3, 3), 'd')
+        self.triangleLeaves = arrays.repeat(arrays.arange(len(counts)), counts)
+        self.transformTriangles(arrays.arange(len(counts)))
+        self.tree = bvh.BVH(self.boxes(), self.leafSize, self.method)
+
+    def transformTriangles(self, leaves):
+        """Update the world-space triangles of the given leaves"""
+        matrices = self.scene.worldMatrices(leaves)
+        for leaf, matrix in zip(leaves, matrices):
+            mesh = self.meshes[leaf]
+            if mesh is None:
+                continue
+            vertices = arrays.dot(mesh.vertices, matrix[:3, :3]) + matrix[3, :3]
+            start, stop = self.offsets[leaf], self.offsets[leaf + 1]
+            self.triangles[start:stop] = vertices[meshTriangles(mesh)]
+
+    def boxes(self, items=slice(None)):
+        """Get the (K,2,3) boxes of the given triangles"""
+        triangles = self.triangles[items]
+        return arrays.stack((triangles.min(axis=1), triangles.max(axis=1)), axis=1)
+
+    def update(self):
+        """Refit the tree for moved and changed Shapes
+
+        returns the indices of the leaves whose triangles changed
+        """
+        scene = self.scene
+        changed = scene.update()
+        if scene.tree is not self.sceneTree:
+            self.rebuild()
+            return arrays.arange(len(self.meshes))
+        if not len(changed):
+            return changed
+        for leaf in changed:
+            mesh = shapeMesh(scene.shapes[leaf])
+            count = 0 if mesh is None else len(meshTriangles(mesh))
+            if count != self.offsets[leaf + 1] - self.offsets[leaf]:
+                self.rebuild()
+                return arrays.arange(len(self.meshes))
+            self.meshes[leaf] = mesh
+        self.transformTriangles(changed)
+        items = bvh._ranges(
+            self.offsets[changed], self.offsets[changed + 1] - self.offsets[changed]
+        )
+        self.tree.boxes[items] = self.boxes(items)
+        self.tree.refit(items)
+        return changed
+
+    def trace(self, origins, directions, limits):
+        """Find the closest triangle hit by each ray
+
+        origins, directions -- (R,3) rays, directions of unit length
+        limits -- (R,) maximum distance of a hit along each ray
+
+        returns (distances, triangles, u, v) (R,) arrays, triangles
+        being indices into self.triangles (-1 for misses)
+        """
+        tree = self.tree
+        count = len(origins)
+        best = limits.copy()
+        found = arrays.full(count, -1, 'l')
+        u = arrays.zeros(count, 'd')
+        v = arrays.zeros(count, 'd')
+        if not len(tree):
+            return best, found, u, v
+        inverse = 1.0 / directions
+        rays = arrays.arange(count)
+        nodes = arrays.zeros(count, 'l')
+        while len(rays):
+            boxes = tree.bounds[nodes]
+            start = (boxes[:, 0] - origins[rays]) * inverse[rays]
+            stop = (boxes[:, 1] - origins[rays]) * inverse[rays]
+            # a ray parallel to a slab and on one of its planes has a
+            # NaN (0*inf) bound, it is within the slab along its length
+            near = arrays.nan_to_num(arrays.minimum(start, stop), nan=-arrays.inf)
+            near = arrays.maximum(arrays.maximum(near[:, 0], near[:, 1]), near[:, 2])
+            far = arrays.nan_to_num(arrays.maximum(start, stop), nan=arrays.inf)
+            far = arrays.minimum(arrays.minimum(far[:, 0], far[:, 1]), far[:, 2])
+            keep = (near <= far) & (far >= 0) & (near <= best[rays])
+            rays, nodes = rays[keep], nodes[keep]
+            leaf = tree.children[nodes, 0] < 0
+            if arrays.any(leaf):
+                leaves = nodes[leaf]
+                pairs = arrays.repeat(rays[leaf], tree.counts[leaves])
+                items = tree.nodeItems(leaves)
+                t, pairU, pairV = rayTriangles(
+                    origins[pairs], directions[pairs], self.triangles[items]
+                )
+                closer = arrays.flatnonzero(t < best[pairs])
+                # the closest of each ray's hits
+                closer = closer[arrays.lexsort((t[closer], pairs[closer]))]
+                first = arrays.ones(len(closer), bool)
+                first[1:] = pairs[closer[1:]] != pairs[closer[:-1]]
+                closer = closer[first]
+                hitRays = pairs[closer]
+                best[hitRays] = t[closer]
+                found[hitRays] = items[closer]
+                u[hitRays] = pairU[closer]
+                v[hitRays] = pairV[closer]
+            rays = arrays.repeat(rays[~leaf], 2)
+            nodes = tree.children[nodes[~leaf]].ravel()
+        return best, found, u, v
+
+    def intersect(self, origins, directions, maxDistance=arrays.inf):
+        """Find the closest hit of each ray
+
+        origins, directions -- (R,3) (or (3,), broadcast) world-space
+            rays, directions need not be normalised
+        maxDistance -- maximum distance of a hit from its origin
+
+        returns Hits for the rays
+        """
+        self.update()
+        origins, directions = arrays.broadcast_arrays(
+            arrays.asarray(origins, 'd').reshape((-1, 3)),
+            arrays.asarray(directions, 'd').reshape((-1, 3)),
+        )
+        lengths = arrays.sqrt(arrays.sum(directions * directions, axis=1))
+        directions = directions / lengths[:, arrays.newaxis]
+        # zero-length directions hit nothing
+        limits = arrays.where(lengths > 0, float(maxDistance), -1.0)
+        hits = Hits(self, len(origins))
+
+        def chunk(start):
+            block = slice(start, start + self.chunkSize)
+            distances, triangles, u, v = self.trace(
+                origins[block], directions[block], limits[block]
+            )
+            hit = arrays.flatnonzero(triangles >= 0)
+            indices = arrays.arange(len(origins))[block][hit]
+            triangles = triangles[hit]
+            leaves = self.triangleLeaves[triangles]
+            hits.distances[indices] = distances[hit]
+            hits.leaves[indices] = leaves
+            hits.triangles[indices] = triangles - self.offsets[leaves]
+            hits.barycentrics[indices] = arrays.column_stack(
+                (1.0 - u[hit] - v[hit], u[hit], v[hit])
+            )
+            hits.points[indices] = (
+                origins[indices] + directions[indices] * distances[hit, arrays.newaxis]
+            )
+
+        starts = range(0, len(origins), self.chunkSize)
+        if self.workers == 1 or len(starts) < 2:
+            for start in starts:
+                chunk(start)
+        else:
+            from concurrent import futures
+
+            with futures.ThreadPoolExecutor(self.workers) as executor:
+                # list() re-raises any exception from the workers
+                list(executor.map(chunk, starts))
+        return hits
+
+
+def pick(scene, origins, directions, maxDistance=arrays.inf):
+    """Closest hits of rays with the Shapes in scene (a SceneGraph or grouping node)
+
+    Builds a Picker for the scene, use a Picker to pick in the
+    same scene repeatedly.
+    """
+    return Picker(scene).intersect(origins, directions, maxDistance)
@@ -0,0 +1,345 @@
+"""Tessellation of the Box, Sphere, Cone and Cylinder primitives
+
+boxMesh, sphereMesh, coneMesh, cylinderMesh -- build a
+    meshes.TriangleMesh (indexed, with normals and texture
+    coordinates) from a primitive's parameters
+primitiveMesh(node, divisions) -- get the (cached) TriangleMesh
+    for a primitive geometry node
+
+divisions is the level of detail, the number of segments around
+the curved primitives (a Sphere has divisions//2 segments from
+pole to pole), DEFAULT_DIVISIONS is used when it is None.
+
+Texture coordinates follow the VRML97 specification: the sides
+of Spheres, Cones and Cylinders wrap the texture counterclockwise
+(seen from +Y) starting at the back (-Z), the caps appear right
+side up when tilted toward the viewer (+Z for top caps, -Z for
+bottom caps) and each face of a Box holds the whole texture.
+
+Meshes are shared: MESHES maps the primitive's parameters (and
+divisions) to its TriangleMesh, so primitives with the same
+parameters share one mesh, whose arrays are read-only.  The
+mapping holds its meshes weakly, a mesh lasts as long as a node
+(through its vrml.cache.CACHE holder) or a consumer refers to it.
+"""
+
+from __future__ import unicode_literals
+
+import weakref
+
+from vrml import arrays, cache
+from vrml.protofunctions import protoName
+from vrml.vrml97 import meshes
+
+DEFAULT_DIVISIONS = 24
+MIN_DIVISIONS = 3
+# (protoName, parameters..., divisions): TriangleMesh
+MESHES = weakref.WeakValueDictionary()
+
+
+def _mesh(vertices, normals, texCoords, triangles, faces):
+    """Build a read-only TriangleMesh from the tessellation arrays"""
+    mesh = meshes.TriangleMesh(
+        arrays.asarray(vertices, 'f'),
+        normals=arrays.asarray(normals, 'f'),
+        texCoords=arrays.asarray(texCoords, 'f'),
+        indices=arrays.asarray(triangles, 'i').reshape((-1, 3)),
+        faces=arrays.asarray(faces, 'i'),
+    )
+    for value in (
+        mesh.vertices,
+        mesh.normals,
+        mesh.texCoords,
+        mesh.indices,
+        mesh.faces,
+    ):
+        value.flags.writeable = False
+    return mesh
+
+
+def _combine(parts):
+    """Concatenate (vertices, normals, texCoords, triangles, faces) parts"""
+    if not parts:
+        return _mesh(
+            arrays.zeros((0, 3)),
+            arrays.zeros((0, 3)),
+            arrays.zeros((0, 2)),
+            arrays.zeros((0, 3)),
+            arrays.zeros(0),
+        )
+    vertexOffset = faceOffset = 0
+    triangles, faces = [], []
+    for vertices, normals, texCoords, partTriangles, partFaces in parts:
+        triangles.append(partTriangles + vertexOffset)
+        faces.append(partFaces + faceOffset)
+        vertexOffset += len(vertices)
+        faceOffset += int(partFaces.max()) + 1 if len(partFaces) else 0
+    return _mesh(
+        arrays.concatenate([part[0] for part in parts]),
+        arrays.concatenate([part[1] for part in parts]),
+        arrays.concatenate([part[2] for part in parts]),
+        arrays.concatenate(triangles),
+        arrays.concatenate(faces),
+    )
+
+
+def _divisions(divisions):
+    """Resolve the divisions level of detail"""
+    if divisions is None:
+        divisions = DEFAULT_DIVISIONS
+    return max(int(divisions), MIN_DIVISIONS)
+
+
+def _grid(rows, columns):
+    """Triangulate a rows x columns grid of quads
+
+    Grid vertex (row,column) is vertex row*(columns+1)+column, each
+    quad (a,b,c,d) = ((r,c),(r,c+1),(r+1,c+1),(r+1,c)) becomes the
+    triangles (a,b,c) and (a,c,d)
+
+    returns (rows,columns,2,3) triangle vertex indices
+    """
+    row, column = arrays.meshgrid(
+        arrays.arange(rows), arrays.arange(columns), indexing='ij'
+    )
+    a = row * (columns + 1) + column
+    b = a + 1
+    d = a + columns + 1
+    c = d + 1
+    return arrays.stack(
+        (arrays.stack((a, b, c), axis=-1), arrays.stack((a, c, d), axis=-1)), axis=-2
+    )
+
+
+def _around(divisions):
+    """Angles (and s texture coordinates) of divisions+1 seam-duplicated columns
+
+    Angle 0 is at -Z, increasing counterclockwise seen from +Y, the
+    unit circle points are (-sin(angle), -cos(angle)) in (x,z)
+    """
+    s = arrays.linspace(0.0, 1.0, divisions + 1)
+    angles = s * 2 * arrays.pi
+    return s, -arrays.sin(angles), -arrays.cos(angles)
+
+
+def _side(bottomRadius, topRadius, height, divisions):
+    """Side of a (truncated) cone/cylinder with one face per column"""
+    s, x, z = _around(divisions)
+    half = height / 2.0
+    radii = arrays.array([bottomRadius, topRadius], 'd')[:, arrays.newaxis]
+    vertices = arrays.stack(
+        (x * radii, arrays.repeat([[-half], [half]], divisions + 1, 1), z * radii),
+        axis=-1,
+    ).reshape((-1, 3))
+    # the normals lean by the slope of the side
+    length = arrays.hypot(height, bottomRadius - topRadius)
+    radial = height / length
+    slope = (bottomRadius - topRadius) / length
+    normal = arrays.column_stack((x * radial, arrays.full(len(x), slope), z * radial))
+    normals = arrays.concatenate((normal, normal))
+    texCoords = arrays.stack(
+        (arrays.tile(s, 2), arrays.repeat([0.0, 1.0], divisions + 1)), axis=-1
+    )
+    triangles = _grid(1, divisions)[0]
+    if not topRadius:
+        # the (a,c,d) triangles would meet at the apex, so each column
+        # is a single (a,b,d) triangle whose apex vertex d lies in the
+        # middle of the column
+        middle = (s[:-1] + s[1:]) / 2.0
+        apex = slice(divisions + 1, 2 * divisions + 1)
+        angles = middle * 2 * arrays.pi
+        normals[apex, 0] = -arrays.sin(angles) * radial
+        normals[apex, 2] = -arrays.cos(angles) * radial
+        texCoords[apex, 0] = middle
+        triangles = arrays.column_stack((triangles[:, 0, :2], triangles[:, 1, 2]))
+        faces = arrays.arange(divisions)
+    else:
+        faces = arrays.repeat(arrays.arange(divisions), 2)
+    return vertices, normals, texCoords, triangles.reshape((-1, 3)), faces
+
+
+def _cap(radius, y, up, divisions):
+    """Disc of radius at height y, facing +Y if up, as a single face"""
+    s, x, z = _around(divisions)
+    x, z = x[:-1], z[:-1]
+    vertices = arrays.column_stack(
+        (x * radius, arrays.full(divisions, float(y)), z * radius)
+    )
+    normals = arrays.zeros((divisions, 3))
+    normals[:, 1] = 1.0 if up else -1.0
+    texCoords = arrays.column_stack(
+        (0.5 + x / 2.0, 0.5 - z / 2.0 if up else 0.5 + z / 2.0)
+    )
+    # fan from the first vertex, the ring runs counterclockwise seen
+    # from +Y, so the fan is reversed for the bottom cap
+    second = arrays.arange(1, divisions - 1)
+    if up:
+        triangles = arrays.column_stack(
+            (arrays.zeros(divisions - 2, 'i'), second, second + 1)
+        )
+    else:
+        triangles = arrays.column_stack(
+            (arrays.zeros(divisions - 2, 'i'), second + 1, second)
+        )
+    return vertices, normals, texCoords, triangles, arrays.zeros(divisions - 2, 'i')
+
+
+def boxMesh(size):
+    """Tessellate a Box of size (x,y,z) as 6 faces of 2 triangles"""
+    half = arrays.asarray(size, 'd') / 2.0
+    # (normal, s direction, t direction) of each face, the side
+    # faces are upright seen from outside with +Y up, the top face
+    # seen from above with -Z up and the bottom from below with +Z up
+    axes = arrays.array(
+        [
+            [(0, 0, 1), (1, 0, 0), (0, 1, 0)],
+            [(0, 0, -1), (-1, 0, 0), (0, 1, 0)],
+            [(1, 0, 0), (0, 0, -1), (0, 1, 0)],
+            [(-1, 0, 0), (0, 0, 1), (0, 1, 0)],
+            [(0, 1, 0), (1, 0, 0), (0, 0, -1)],
+            [(0, -1, 0), (1, 0, 0), (0, 0, 1)],
+        ],
+        'd',
+    )
+    corners = arrays.array([(0, 0), (1, 0), (1, 1), (0, 1)], 'd')
+    normal, sAxis, tAxis = axes[:, 0], axes[:, 1], axes[:, 2]
+    offsets = (corners * 2 - 1)[arrays.newaxis, :, :, arrays.newaxis]
+    vertices = (
+        normal[:, arrays.newaxis]
+        + offsets[..., 0, :] * sAxis[:, arrays.newaxis]
+        + offsets[..., 1, :] * tAxis[:, arrays.newaxis]
+    ) * half
+    starts = arrays.arange(6)[:, arrays.newaxis] * 4
+    triangles = arrays.concatenate(
+        (starts + [0, 1, 2], starts + [0, 2, 3]), axis=1
+    ).reshape((-1, 3))
+    return _mesh(
+        vertices.reshape((-1, 3)),
+        arrays.repeat(normal, 4, axis=0),
+        arrays.tile(corners, (6, 1)),
+        triangles,
+        arrays.repeat(arrays.arange(6), 2),
+    )
+
+
+def sphereMesh(radius, divisions=None):
+    """Tessellate a Sphere with divisions segments around its equator"""
+    divisions = _divisions(divisions)
+    stacks = max(divisions // 2, 2)
+    s, x, z = _around(divisions)
+    t = arrays.linspace(0.0, 1.0, stacks + 1)[:, arrays.newaxis]
+    # latitude from -pi/2 (bottom) to pi/2 (top)
+    latitude = (t - 0.5) * arrays.pi
+    ring = arrays.cos(latitude)
+    normals = arrays.stack(
+        (
+            x * ring,
+            arrays.repeat(arrays.sin(latitude), divisions + 1, 1),
+            z * ring,
+        ),
+        axis=-1,
+    ).reshape((-1, 3))
+    texCoords = arrays.stack(arrays.broadcast_arrays(s, t), axis=-1).reshape((-1, 2))
+    triangles = _grid(stacks, divisions)
+    faces = arrays.repeat(arrays.arange(stacks * divisions), 2).reshape(
+        (stacks, divisions, 2)
+    )
+    # the triangles touching a pole have two coincident vertices
+    keep = arrays.ones((stacks, divisions, 2), bool)
+    keep[0, :, 0] = False
+    keep[-1, :, 1] = False
+    return _mesh(normals * radius, normals, texCoords, triangles[keep], faces[keep])
+
+
+def coneMesh(bottomRadius, height, side=True, bottom=True, divisions=None):
+    """Tessellate a Cone with divisions segments around its base"""
+    divisions = _divisions(divisions)
+    parts = []
+    if side:
+        parts.append(_side(bottomRadius, 0.0, height, divisions))
+    if bottom:
+        parts.append(_cap(bottomRadius, -height / 2.0, False, divisions))
+    return _combine(parts)
+
+
+def cylinderMesh(radius, height, side=True, top=True, bottom=True, divisions=None):
+    """Tessellate a Cylinder with divisions segments around its side"""
+    divisions = _divisions(divisions)
+    parts = []
+    if side:
+        parts.append(_side(radius, radius, height, divisions))
+    if top:
+        parts.append(_cap(radius, height / 2.0, True, divisions))
+    if bottom:
+        parts.append(_cap(radius, -height / 2.0, False, divisions))
+    return _combine(parts)
+
+
+# protoName: (function, fields passed as the function's arguments,
+#   whether the function takes divisions)
+PRIMITIVES = {
+    'Box': (boxMesh, ('size',), False),
+    'Sphere': (sphereMesh, ('radius',), True),
+    'Cone': (coneMesh, ('bottomRadius', 'height', 'side', 'bottom'), True),
+    'Cylinder': (cylinderMesh, ('radius', 'height', 'side', 'top', 'bottom'), True),
+}
+
+
+def _parameter(value):
+    """Convert a field value to a hashable parameter"""
+    if isinstance(value, (bool, int)):
+        return value
+    try:
+        return tuple(float(item) for item in value)
+    except TypeError:
+        return float(value)
+
+
+def sharedMesh(name, parameters, divisions=None):
+    """Get the shared TriangleMesh for a primitive's parameters
+
+    name -- primitive protoName (see PRIMITIVES)
+    parameters -- tuple of the values of the primitive's fields
+    divisions -- level of detail, ignored for Boxes
+    """
+    function, fields, detailed = PRIMITIVES[name]
+    parameters = tuple(_parameter(value) for value in parameters)
+    if detailed:
+        divisions = _divisions(divisions)
+        key = (name,) + parameters + (divisions,)
+    else:
+        key = (name,) + parameters
+    mesh = MESHES.get(key)
+    if mesh is None:
+        if detailed:
+            mesh = function(*parameters, divisions=divisions)
+        else:
+            mesh = function(*parameters)
+        MESHES[key] = mesh
+    return mesh
+
+
+def primitiveMesh(node, divisions=None):
+    """Get the (cached, shared) TriangleMesh for a primitive geometry node
+
+    node -- Box, Sphere, Cone or Cylinder
+    divisions -- level of detail (see module docstring)
+
+    The node's vrml.cache.CACHE holder refers to the shared mesh
+    and is cleared when the node's fields change.
+    """
+    name = protoName(node)
+    function, fields, detailed = PRIMITIVES[name]
+    key = ('primitiveMesh', _divisions(divisions) if detailed else None)
+    holder = cache.CACHE.getHolder(node, key=key)
+    if holder is None:
+        holder = cache.CACHE.holder(node, None, key=key)
+        for fieldName in fields:
+            holder.depend(node, fieldName)
+    elif holder.data is not None:
+        return holder.data
+    mesh = sharedMesh(
+        name, [getattr(node, fieldName) for fieldName in fields], divisions
+    )
+    holder.data = mesh
+    return mesh
@@ -0,0 +1,521 @@
+"""Mesh generation for the ElevationGrid and Extrusion nodes
+
+gridMesh(points, ...) -- triangulate an (R,K,3) grid of points as
+    (R-1)*(K-1) quads, generating creaseAngle-aware normals
+elevationGridMesh(node), extrusionMesh(node) -- get the (cached)
+    meshes.TriangleMesh for an ElevationGrid or Extrusion
+
+Both nodes describe grids of quads: an ElevationGrid's heights form
+a zDimension by xDimension grid, the sides of an Extrusion form a
+grid of spine points by crossSection points (see
+bounds.extrusionPoints, which calculates every spine-aligned
+cross-section plane at once).  The vertex and index arrays are
+built by broadcasting over the grid.
+
+Generated normals honour creaseAngle as meshes.computeNormals does
+for IndexedFaceSets, but use the grid's structure rather than
+sorting the corners by vertex: the (up to) four quads around each
+vertex are found by slicing a padded array of quad normals, so
+the cost is a few whole-array operations per corner of a quad.
+Corners that reach every quad around their vertex across edges
+within creaseAngle share the vertex, the other corners get a
+vertex per distinct set of reachable quads.  A closed Extrusion
+crossSection (or spine) is smoothed across its seam.
+
+Extrusion caps are flat (their normals are not smoothed with the
+sides), triangulated as fans unless convex is FALSE, and textured
+with the bounding square of the crossSection.
+
+The meshes are cached in vrml.cache.CACHE, the cache is cleared
+when the node's fields, or the values of an ElevationGrid's Color,
+Normal and TextureCoordinate nodes, change.
+"""
+
+from __future__ import unicode_literals
+
+from vrml import arrays, cache
+from vrml.vrml97 import bounds, meshes
+
+ELEVATION_GRID_FIELDS = (
+    'height',
+    'xDimension',
+    'zDimension',
+    'xSpacing',
+    'zSpacing',
+    'creaseAngle',
+    'ccw',
+    'color',
+    'colorPerVertex',
+    'normal',
+    'normalPerVertex',
+    'texCoord',
+)
+EXTRUSION_FIELDS = (
+    'crossSection',
+    'spine',
+    'scale',
+    'orientation',
+    'beginCap',
+    'endCap',
+    'creaseAngle',
+    'ccw',
+    'convex',
+)
+# (row, column) offset of each corner of a quad, in order
+CORNERS = ((0, 0), (0, 1), (1, 1), (1, 0))
+
+
+def quadCorners(rows, columns):
+    """(Q,4) vertex indices of the corners of each quad of a rows x columns grid"""
+    row, column = arrays.meshgrid(
+        arrays.arange(rows - 1), arrays.arange(columns - 1), indexing='ij'
+    )
+    return arrays.stack(
+        [
+            ((row + rowOffset) * columns + column + columnOffset).ravel()
+            for rowOffset, columnOffset in CORNERS
+        ],
+        axis=1,
+    ).astype('i')
+
+
+def _wrap(values, wrapRows, wrapColumns):
+    """Pad (R-1,K-1,3) quad values with a border of neighbouring (or zero) quads"""
+    rows, columns = values.shape[:2]
+    padded = arrays.zeros((rows + 2, columns + 2, 3), values.dtype)
+    padded[1:-1, 1:-1] = values
+    if wrapRows:
+        padded[0, 1:-1] = values[-1]
+        padded[-1, 1:-1] = values[0]
+    if wrapColumns:
+        padded[:, 0] = padded[:, -2]
+        padded[:, -1] = padded[:, 1]
+    return padded
+
+
+def gridNormals(points, creaseAngle=0.0, ccw=True, wrapRows=False, wrapColumns=False):
+    """Generate normals for the quads of an (R,K,3) grid
+
+    wrapRows, wrapColumns -- if true, the first and last rows
+        (columns) of points coincide and are smoothed as one
+
+    returns ((N,3) unit normals, (Q,4) index into the normals for
+    each corner of each quad, (Q,4) boolean array, true where the
+    index is the corner's vertex index)
+    """
+    points = arrays.asarray(points, 'd')
+    rows, columns = points.shape[:2]
+    # Newell normal of each quad, twice its area
+    weighted = arrays.cross(
+        points[1:, 1:] - points[:-1, :-1], points[1:, :-1] - points[:-1, 1:]
+    )
+    if not ccw:
+        weighted = -weighted
+    count = (rows - 1) * (columns - 1)
+    if creaseAngle <= 0:
+        unit = meshes._normalise(weighted.reshape((-1, 3)))
+        indices = arrays.repeat(arrays.arange(count, dtype='i'), 4).reshape((-1, 4))
+        return unit.astype('f'), indices, arrays.zeros((count, 4), bool)
+    padded = _wrap(weighted, wrapRows, wrapColumns)
+    smooth = sum(
+        padded[rowOffset : rowOffset + rows, columnOffset : columnOffset + columns]
+        for rowOffset, columnOffset in CORNERS
+    ).reshape((-1, 3))
+    vertices = quadCorners(rows, columns)
+    if creaseAngle >= arrays.pi:
+        return (
+            meshes._normalise(smooth).astype('f'),
+            vertices,
+            arrays.ones((count, 4), bool),
+        )
+    unit = meshes._normalise(weighted.reshape((-1, 3))).reshape(weighted.shape)
+    unit = _wrap(unit, wrapRows, wrapColumns)
+    cosine = arrays.cos(creaseAngle)
+    # the (up to) four quads around each vertex, CORNERS runs round
+    # the vertex so consecutive quads share an edge
+    windows = [
+        (
+            slice(rowOffset, rowOffset + rows),
+            slice(columnOffset, columnOffset + columns),
+        )
+        for rowOffset, columnOffset in CORNERS
+    ]
+    present = [arrays.any(padded[window] != 0, axis=-1) for window in windows]
+    # whether the edge between quads bit and bit + 1 is smoothed
+    joined = [
+        present[bit]
+        & present[(bit + 1) % 4]
+        & (
+            arrays.einsum(
+                '...i,...i->...', unit[windows[bit]], unit[windows[(bit + 1) % 4]]
+            )
+            >= cosine
+        )
+        for bit in range(4)
+    ]
+    presentMask = sum(present[bit].astype('B') << bit for bit in range(4))
+    # bit set for each quad reachable from quad own across smoothed edges
+    reachable = []
+    for own in range(4):
+        mask = arrays.full((rows, columns), 1 << own, 'B')
+        forward = backward = arrays.ones((rows, columns), bool)
+        for step in range(1, 4):
+            forward = forward & joined[(own + step - 1) % 4]
+            backward = backward & joined[(own - step) % 4]
+            mask |= forward.astype('B') << ((own + step) % 4)
+            mask |= backward.astype('B') << ((own - step) % 4)
+        reachable.append(mask)
+    masks = arrays.empty((count, 4), 'B')
+    shared = arrays.empty((count, 4), bool)
+    for corner, (cornerRow, cornerColumn) in enumerate(CORNERS):
+        # the quad itself is the one diagonally opposite the corner's offset
+        own = CORNERS.index((1 - cornerRow, 1 - cornerColumn))
+        window = (
+            slice(cornerRow, cornerRow + rows - 1),
+            slice(cornerColumn, cornerColumn + columns - 1),
+        )
+        masks[:, corner] = reachable[own][window].ravel()
+        shared[:, corner] = masks[:, corner] == presentMask[window].ravel()
+    indices = vertices.copy()
+    split = ~shared
+    if not arrays.any(split):
+        return meshes._normalise(smooth).astype('f'), indices, shared
+    # corners with the same vertex and set of neighbouring quads
+    # have the same normal
+    keys = vertices[split] * 16 + masks[split]
+    keys, first, inverse = arrays.unique(keys, return_index=True, return_inverse=True)
+    indices[split] = len(smooth) + inverse.ravel()
+    quads, corners = arrays.nonzero(split)
+    quads, corners = quads[first], corners[first]
+    row, column = arrays.divmod(quads, columns - 1)
+    offsets = arrays.array(CORNERS)
+    extra = arrays.zeros((len(first), 3), 'd')
+    for bit, (rowOffset, columnOffset) in enumerate(CORNERS):
+        neighbours = padded[
+            row + offsets[corners, 0] + rowOffset,
+            column + offsets[corners, 1] + columnOffset,
+        ]
+        extra += neighbours * ((masks[split][first] >> bit) & 1)[:, arrays.newaxis]
+    normals = meshes._normalise(arrays.concatenate((smooth, extra)))
+    return normals.astype('f'), indices, shared
+
+
+def _compile(positions, corners, attributes, ccw=True):
+    """Build an indexed TriangleMesh for quads
+
+    positions -- (V,3) vertex positions
+    corners -- (Q,4) vertex indices of each quad's corners
+    attributes -- dictionary of TriangleMesh attribute name to
+        None or (values, (Q,4) indices, (Q,4) shared) where shared
+        is true for corners whose index is their vertex's index
+        (the first V values being per-vertex)
+
+    quad q becomes triangles 2q and 2q+1, both of face q
+    """
+    count = len(corners)
+    positions = arrays.asarray(positions, 'f')
+    present = [
+        (name, (_asarray(value[0]),) + tuple(value[1:]))
+        for name, value in attributes.items()
+        if value is not None
+    ]
+    plain = arrays.ones(corners.shape, bool)
+    for name, (values, indices, shared) in present:
+        plain &= shared
+    if arrays.all(plain):
+        # every corner shares its vertex
+        vertices = positions
+        sources = dict((name, values) for name, (values, indices, shared) in present)
+    elif any(not arrays.any(shared) for name, (values, indices, shared) in present):
+        # a per-quad attribute, so every corner has its own vertex
+        vertices = positions[corners.ravel()]
+        sources = dict(
+            (name, values[indices.ravel()])
+            for name, (values, indices, shared) in present
+        )
+        corners = arrays.arange(corners.size, dtype='i').reshape((-1, 4))
+    else:
+        split = arrays.flatnonzero(~plain.ravel())
+        keys = arrays.column_stack(
+            [corners.ravel()[split]]
+            + [indices.ravel()[split] for name, (values, indices, shared) in present]
+        )
+        keys, first, inverse = meshes.uniqueRows(keys)
+        base = len(positions) if arrays.any(plain) else 0
+        vertices = arrays.concatenate((positions[:base], positions[keys[:, 0]]))
+        sources = {}
+        for column, (name, (values, indices, shared)) in enumerate(present):
+            sources[name] = arrays.concatenate(
+                (values[:base], values[keys[:, column + 1]])
+            )
+        corners = corners.ravel().copy()
+        corners[split] = base + inverse
+        corners = corners.reshape((-1, 4))
+    triangles = arrays.concatenate(
+        (corners[:, [0, 1, 2]], corners[:, [0, 2, 3]]), axis=1
+    ).reshape((-1, 3))
+    if not ccw:
+        triangles = triangles[:, ::-1]
+    return meshes.TriangleMesh(
+        vertices,
+        normals=sources.get('normals'),
+        colors=sources.get('colors'),
+        texCoords=sources.get('texCoords'),
+        indices=arrays.ascontiguousarray(triangles, 'i'),
+        faces=arrays.repeat(arrays.arange(count, dtype='i'), 2),
+    )
+
+
+def _asarray(values):
+    """values as a float array (or None)"""
+    if values is None:
+        return None
+    return arrays.asarray(values, 'f')
+
+
+def gridMesh(
+    points,
+    texCoords=None,
+    colors=None,
+    normals=None,
+    creaseAngle=0.0,
+    ccw=True,
+    wrapRows=False,
+    wrapColumns=False,
+):
+    """Triangulate the quads of an (R,K,3) grid of points
+
+    The quad ((r,k),(r,k+1),(r+1,k+1),(r+1,k)) is taken to be
+    counterclockwise if ccw is true, quad (r,k) is face r*(K-1)+k
+
+    texCoords -- None or (R*K,2) per-vertex texture coordinates
+    colors, normals -- None, or (values, perVertex) where values
+        are (R*K,3) per-vertex or ((R-1)*(K-1),3) per-quad values,
+        normals are generated when None
+    creaseAngle, wrapRows, wrapColumns -- see gridNormals
+    """
+    points = arrays.asarray(points, 'd')
+    rows, columns = points.shape[:2]
+    if rows < 2 or columns < 2:
+        return emptyMesh()
+    corners = quadCorners(rows, columns)
+    attributes = {}
+    if normals is None:
+        attributes['normals'] = gridNormals(
+            points, creaseAngle, ccw, wrapRows, wrapColumns
+        )
+    else:
+        attributes['normals'] = _perCorner(corners, *normals)
+    if colors is not None:
+        attributes['colors'] = _perCorner(corners, *colors)
+    if texCoords is not None:
+        attributes['texCoords'] = (texCoords, corners, arrays.ones(corners.shape, bool))
+    return _compile(points.reshape((-1, 3)), corners, attributes, ccw)
+
+
+def _perCorner(corners, values, perVertex):
+    """(values, indices, shared) for per-vertex or per-quad values"""
+    if perVertex:
+        return values, corners, arrays.ones(corners.shape, bool)
+    indices = arrays.repeat(arrays.arange(len(corners), dtype='i'), 4).reshape((-1, 4))
+    return values, indices, arrays.zeros(corners.shape, bool)
+
+
+def emptyMesh():
+    """A TriangleMesh without triangles"""
+    return meshes.TriangleMesh(
+        arrays.zeros((0, 3), 'f'),
+        normals=arrays.zeros((0, 3), 'f'),
+        indices=arrays.zeros((0, 3), 'i'),
+        faces=arrays.zeros(0, 'i'),
+    )
+
+
+def _nodeValues(geometry, fieldName, count):
+    """First count values of an attribute node, or None if it has fewer"""
+    values = meshes._values(geometry, fieldName)
+    if values is None or len(values) < count:
+        return None
+    return values[:count]
+
+
+def elevationGridArrays(geometry):
+    """Generate the TriangleMesh for an ElevationGrid (without caching)"""
+    xDimension, zDimension = geometry.xDimension, geometry.zDimension
+    count = xDimension * zDimension
+    height = arrays.asarray(geometry.height, 'd').ravel()
+    if xDimension < 2 or zDimension < 2 or len(height) < count:
+        return emptyMesh()
+    quads = (xDimension - 1) * (zDimension - 1)
+    points = arrays.empty((zDimension, xDimension, 3), 'd')
+    points[..., 0] = arrays.arange(xDimension) * geometry.xSpacing
+    points[..., 1] = height[:count].reshape((zDimension, xDimension))
+    points[..., 2] = arrays.arange(zDimension)[:, arrays.newaxis] * geometry.zSpacing
+    texCoords = _nodeValues(geometry, 'texCoord', count)
+    if texCoords is None:
+        texCoords = arrays.empty((zDimension, xDimension, 2), 'd')
+        texCoords[..., 0] = arrays.linspace(0.0, 1.0, xDimension)
+        texCoords[..., 1] = arrays.linspace(0.0, 1.0, zDimension)[:, arrays.newaxis]
+        texCoords = texCoords.reshape((-1, 2))
+    attributes = []
+    for fieldName, perVertex in (
+        ('color', geometry.colorPerVertex),
+        ('normal', geometry.normalPerVertex),
+    ):
+        values = _nodeValues(geometry, fieldName, count if perVertex else quads)
+        attributes.append(None if values is None else (values, bool(perVertex)))
+    colors, normals = attributes
+    # rows run along +Z, so the grid's quads are clockwise seen from +Y
+    return gridMesh(
+        points,
+        texCoords=texCoords,
+        colors=colors,
+        normals=normals,
+        creaseAngle=geometry.creaseAngle,
+        ccw=not geometry.ccw,
+    )
+
+
+def _lengths(points):
+    """Cumulative lengths along (N,D) points, normalised to [0,1]"""
+    steps = arrays.sqrt(arrays.sum(arrays.diff(points, axis=0) ** 2, axis=1))
+    lengths = arrays.concatenate(([0.0], arrays.cumsum(steps)))
+    if lengths[-1] > 0:
+        return lengths / lengths[-1]
+    return arrays.linspace(0.0, 1.0, len(points))
+
+
+def _cap(points, section, convex, reverse, ccw):
+    """TriangleMesh arrays for an Extrusion cap
+
+    points -- (C,3) cap vertices, counterclockwise seen from the
+        direction the cap faces when reverse is false
+    section -- (C,2) crossSection points for the texture coordinates
+    """
+    if len(points) > 1 and arrays.array_equal(section[0], section[-1]):
+        points, section = points[:-1], section[:-1]
+    if len(points) < 3:
+        return None
+    if convex:
+        second = arrays.arange(1, len(points) - 1)
+        triangles = arrays.column_stack(
+            (arrays.zeros(len(second), 'l'), second, second + 1)
+        )
+    else:
+        triangles = arrays.array(meshes.earClip(points), 'l').reshape((-1, 3))
+    if reverse != (not ccw):
+        triangles = triangles[:, ::-1]
+    # Newell normal
+    normal = arrays.sum(arrays.cross(points, arrays.roll(points, -1, axis=0)), axis=0)
+    if reverse != (not ccw):
+        normal = -normal
+    normal = meshes._normalise(normal[arrays.newaxis])
+    low, high = section.min(axis=0), section.max(axis=0)
+    size = (high - low).max()
+    texCoords = (section - low) / (size if size > 0 else 1.0)
+    return (
+        points,
+        arrays.repeat(normal, len(points), axis=0),
+        texCoords,
+        triangles,
+    )
+
+
+def extrusionArrays(geometry):
+    """Generate the TriangleMesh for an Extrusion (without caching)"""
+    spine = arrays.asarray(geometry.spine, 'd').reshape((-1, 3))
+    section = arrays.asarray(geometry.crossSection, 'd').reshape((-1, 2))
+    if not len(spine) or not len(section):
+        return emptyMesh()
+    points = bounds.extrusionPoints(geometry)
+    texCoords = arrays.empty(points.shape[:2] + (2,), 'd')
+    texCoords[..., 0] = _lengths(section)
+    texCoords[..., 1] = _lengths(spine)[:, arrays.newaxis]
+    side = gridMesh(
+        points,
+        texCoords=texCoords.reshape((-1, 2)),
+        creaseAngle=geometry.creaseAngle,
+        ccw=geometry.ccw,
+        wrapRows=len(spine) > 2 and arrays.array_equal(spine[0], spine[-1]),
+        wrapColumns=len(section) > 2 and arrays.array_equal(section[0], section[-1]),
+    )
+    parts = [side]
+    faceCount = (len(spine) - 1) * (len(section) - 1)
+    for enabled, cross, reverse in (
+        (geometry.beginCap, points[0], True),
+        (geometry.endCap, points[-1], False),
+    ):
+        cap = enabled and _cap(cross, section, geometry.convex, reverse, geometry.ccw)
+        if not cap:
+            continue
+        vertices, normals, capTexCoords, triangles = cap
+        parts.append(
+            meshes.TriangleMesh(
+                arrays.asarray(vertices, 'f'),
+                normals=arrays.asarray(normals, 'f'),
+                texCoords=arrays.asarray(capTexCoords, 'f'),
+                indices=triangles.astype('i'),
+                faces=arrays.full(len(triangles), faceCount, 'i'),
+            )
+        )
+        faceCount += 1
+    return concatenate(parts)
+
+
+def concatenate(parts):
+    """Concatenate indexed TriangleMeshes which share their attributes"""
+    parts = [part for part in parts if len(part.vertices)]
+    if not parts:
+        return emptyMesh()
+    if len(parts) == 1:
+        return parts[0]
+    offsets = arrays.cumsum([0] + [len(part.vertices) for part in parts[:-1]])
+    merged = {}
+    for name in ('vertices', 'normals', 'texCoords'):
+        merged[name] = arrays.concatenate([getattr(part, name) for part in parts])
+    return meshes.TriangleMesh(
+        merged['vertices'],
+        normals=merged['normals'],
+        texCoords=merged['texCoords'],
+        indices=arrays.concatenate(
+            [part.indices + offset for part, offset in zip(parts, offsets)]
+        ).astype('i'),
+        faces=arrays.concatenate([part.faces for part in parts]).astype('i'),
+    )
+
+
+def _cached(geometry, key, fields, attributeFields, function):
+    """Get geometry's mesh from its CACHE holder, generating it if needed"""
+    holder = cache.CACHE.getHolder(geometry, key=key)
+    if holder is None:
+        holder = cache.CACHE.holder(geometry, None, key=key)
+        for fieldName in fields:
+            holder.depend(geometry, fieldName)
+    elif holder.data is not None:
+        return holder.data
+    mesh = function(geometry)
+    # the attribute nodes may have been replaced since the holder was created
+    for fieldName in attributeFields:
+        attributeNode = getattr(geometry, fieldName)
+        if attributeNode:
+            holder.depend(attributeNode, meshes.ATTRIBUTE_FIELDS[fieldName])
+    holder.data = mesh
+    return mesh
+
+
+def elevationGridMesh(geometry):
+    """Get the (cached) TriangleMesh for an ElevationGrid"""
+    return _cached(
+        geometry,
+        'elevationGridMesh',
+        ELEVATION_GRID_FIELDS,
+        ('color', 'normal', 'texCoord'),
+        elevationGridArrays,
+    )
+
+
+def extrusionMesh(geometry):
+    """Get the (cached) TriangleMesh for an Extrusion"""
+    return _cached(
+        geometry, 'extrusionMesh', EXTRUSION_FIELDS, (), extrusionArrays
+    )
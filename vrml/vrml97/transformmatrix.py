@@ -18,7 +18,9 @@ you would do the following:
     return dot( p, matrix)
 
 That is, you use the homogenous coordinate, and
-make it the first item in the dot'ing.
+make it the first item in the dot'ing.  For whole arrays
+of points, normals or bounding boxes use the NodePath's
+transformPoints, transformNormals and transformBounds.
 """
 from math import *
 from vrml.arrays import *
@@ -29,6 +31,10 @@ try:
         transMatrix,
         perspectiveMatrix,
         orthoMatrix,
+        localMatrices as _localMatrices,
+        rotMatrices,
+        scaleMatrices,
+        transMatrices,
     )
 except ImportError:
     from vrml.vrml97._transformmatrix import (
@@ -37,6 +43,10 @@ except ImportError:
         transMatrix,
         perspectiveMatrix,
         orthoMatrix,
+        localMatrices as _localMatrices,
+        rotMatrices,
+        scaleMatrices,
+        transMatrices,
     )
 
 assert perspectiveMatrix 
@@ -72,12 +82,8 @@ def transformMatrix(
     transformation matrix, a 4x4 matrix of such as
     returned by this function.
     """
-    T,T1 = transMatrix( translation )
-    C,C1 = transMatrix( center )
-    R,R1 = rotMatrix( rotation )
-    SO,SO1 = rotMatrix( scaleOrientation )
-    S,S1 = scaleMatrix( scale )
-    return compressMatrices( parentMatrix, T,C,R,SO,S,SO1,C1 )
+    forward,inverse = _localMatrices( translation, center, rotation, scale, scaleOrientation )
+    return compressMatrices( parentMatrix, forward )
     
 def itransformMatrix(
         translation = (0,0,0),
@@ -106,12 +112,8 @@ def itransformMatrix(
     transformation matrix, a 4x4 matrix of such as
     returned by this function.
     """
-    T,T1 = transMatrix( translation )
-    C,C1 = transMatrix( center )
-    R,R1 = rotMatrix( rotation )
-    SO,SO1 = rotMatrix( scaleOrientation )
-    S,S1 = scaleMatrix( scale )
-    return compressMatrices( parentMatrix, C,SO, S1, SO1, R1, C1, T1)
+    forward,inverse = _localMatrices( translation, center, rotation, scale, scaleOrientation )
+    return compressMatrices( parentMatrix, inverse )
 
 def transformMatrices( 
         translation = (0,0,0),
@@ -122,14 +124,10 @@ def transformMatrices(
         parentMatrix = None,
     ):
     """Calculate both forward and backward matrices for these parameters"""
-    T,T1 = transMatrix( translation )
-    C,C1 = transMatrix( center )
-    R,R1 = rotMatrix( rotation )
-    SO,SO1 = rotMatrix( scaleOrientation )
-    S,S1 = scaleMatrix( scale )
+    forward,inverse = _localMatrices( translation, center, rotation, scale, scaleOrientation )
     return (
-        compressMatrices( parentMatrix, T,C,R,SO,S,SO1,C1 ),
-        compressMatrices( parentMatrix, C,SO, S1, SO1, R1, C1, T1)
+        compressMatrices( parentMatrix, forward ),
+        compressMatrices( parentMatrix, inverse ),
     )
 
 def localMatrices(
@@ -140,16 +138,103 @@ def localMatrices(
         scaleOrientation = (0,1,0,0),
         parentMatrix = None,
     ):
-    """Calculate (forward,inverse) matrices for this transform element"""
-    T,T1 = transMatrix( translation )
-    C,C1 = transMatrix( center )
-    R,R1 = rotMatrix( rotation )
-    SO,SO1 = rotMatrix( scaleOrientation )
-    S,S1 = scaleMatrix( scale )
-    return (
-        compressMatrices( T,C,R,SO,S,SO1,C1 ),
-        compressMatrices( C,SO, S1, SO1, R1, C1, T1)
-    )
+    """Calculate (forward,inverse) matrices for this transform element
+
+    Uses the closed-form construction, so each matrix is
+    built with a single allocation rather than dot'ing up
+    to seven component matrices together.
+    """
+    return _localMatrices( translation, center, rotation, scale, scaleOrientation )
+
+def localMatrixStacks(
+        translation = None,
+        center = None,
+        rotation = None,
+        scale = None,
+        scaleOrientation = None,
+    ):
+    """Calculate (forward,inverse) matrix stacks for N transform elements
+
+    Each argument is an (N,3) array (an (N,4) array for the rotations)
+    holding the VRML Transform field values for N transforms, or None
+    to use the field's default value for every transform.  At least
+    one argument must be provided to determine N.
+
+    Builds every matrix at once rather than dot'ing seven matrices
+    together for each transform.
+
+    returns (forward,inverse) as (N,4,4) double arrays, where
+    forward[i] and inverse[i] match the results of localMatrices
+    (with None replaced by identity matrices)
+    """
+    count = None
+    for value in (translation,center,rotation,scale,scaleOrientation):
+        if value is not None:
+            count = len(value)
+            break
+    if count is None:
+        raise ValueError( """Need at least one array of transform values""" )
+    linear = empty( (count,3,3), 'd' )
+    linear[:] = identity( 3, 'd' )
+    ilinear = linear.copy()
+    if scale is not None:
+        scale = asarray( scale, 'd' )[:,:3]
+        iscale = 1.0/where( scale == 0, VERY_SMALL, scale )
+        if scaleOrientation is not None:
+            SO = rotMatrices( scaleOrientation )[0][:,:3,:3]
+            SO1 = SO.transpose( 0,2,1 )
+            linear = matmul( SO1 * scale[:,newaxis,:], SO )
+            ilinear = matmul( SO1 * iscale[:,newaxis,:], SO )
+        else:
+            linear = linear * scale[:,newaxis,:]
+            ilinear = ilinear * iscale[:,newaxis,:]
+    if rotation is not None:
+        R = rotMatrices( rotation )[0][:,:3,:3]
+        linear = matmul( linear, R )
+        ilinear = matmul( R.transpose( 0,2,1 ), ilinear )
+    offset = zeros( (count,3), 'd' )
+    if translation is not None:
+        offset += asarray( translation, 'd' )[:,:3]
+    forward = zeros( (count,4,4), 'd' )
+    inverse = zeros( (count,4,4), 'd' )
+    forward[:,:3,:3] = linear
+    inverse[:,:3,:3] = ilinear
+    forward[:,3,3] = inverse[:,3,3] = 1.0
+    if center is not None:
+        center = asarray( center, 'd' )[:,:3]
+        forward[:,3,:3] = center + offset - einsum( 'ni,nij->nj', center, linear )
+        inverse[:,3,:3] = center - einsum( 'ni,nij->nj', center+offset, ilinear )
+    else:
+        forward[:,3,:3] = offset
+        inverse[:,3,:3] = -einsum( 'ni,nij->nj', offset, ilinear )
+    return forward, inverse
+
+def transformBounds( bounds, matrix, out=None ):
+    """Transform axis-aligned bounding boxes by matrix (or matrices)
+
+    bounds -- (2,3) or (N,2,3) array of (minimum,maximum) corners
+    matrix -- 4x4 matrix as returned by transformMatrix, or an
+        (N,4,4) stack with one matrix for each of N boxes
+    out -- optional array of bounds' shape into which to write
+
+    The result is the axis-aligned box enclosing the transformed
+    box, calculated from the box center and half-extents rather
+    than by transforming all 8 corners.
+
+    returns out (or a new array of bounds' shape)
+    """
+    matrix = asarray( matrix )
+    bounds = asarray( bounds )
+    linear = matrix[...,:3,:3]
+    center = (bounds[...,0,:] + bounds[...,1,:]) * .5
+    extent = (bounds[...,1,:] - bounds[...,0,:]) * .5
+    center = matmul( center[...,newaxis,:], linear )[...,0,:] + matrix[...,3,:3]
+    extent = matmul( extent[...,newaxis,:], absolute( linear ) )[...,0,:]
+    if out is None:
+        out = empty( bounds.shape, center.dtype )
+    out[...,0,:] = center - extent
+    out[...,1,:] = center + extent
+    return out
 
 def compressMatrices( *matrices ):
     """Compress a set of matrices